@@ -7,12 +7,15 @@ from dotenv import load_dotenv
 from pathlib import Path
 from extensions import bcrypt, jwt, db, limiter, jwt_required, get_jwt_identity, create_access_token
 from utils import check_if_token_revoked, create_default_plans
+from utils.admission import admission_state
+from utils.batch_jobs import start_batch_worker
+from utils.email_outbox import start_email_worker, smtp_configured
 from routes import (
     user_api, admin_api, auth_api, email_api, profile_api, project_api,
     generated_content_api, notification_api, plan_api, ai_generation_api,
-    ai_generation_video_api, chat_api, download_api
+    ai_generation_video_api, chat_api, download_api, batch_api
 )
-from models import User, Plan
+from models import User, Plan, ChatMessage, ChatAttachment
 from sqlalchemy import inspect, text
 import os, uuid
 
@@ -156,16 +159,48 @@ def create_default_admin():
 
 with app.app_context():
     inspector = inspect(db.engine)
-    existing_cols = {col.get("name") for col in inspector.get_columns("users")}
-    if "whatsapp_number" not in existing_cols:
-        with db.engine.connect() as conn:
-            conn.execute(text("ALTER TABLE users ADD COLUMN whatsapp_number VARCHAR(30)"))
-            conn.commit()
+    # create_all não adiciona colunas novas em tabelas já existentes
+    added_columns = {
+        "users": {"whatsapp_number": "VARCHAR(30)"},
+        "chats": {
+            "state_provider": "VARCHAR(20)",
+            "state_id": "VARCHAR(120)",
+            "state_message_id": "VARCHAR",
+            "state_updated_at": "DATETIME",
+        },
+        "chat_attachments": {"text_status": "VARCHAR(20)", "content_hash": "VARCHAR(64)", "caption": "TEXT"},
+        "chat_messages": {"status": "VARCHAR(20) DEFAULT 'complete'", "parent_id": "VARCHAR", "cached_tokens": "INTEGER"},
+    }
+    for table, columns in added_columns.items():
+        if not inspector.has_table(table):
+            continue
+        existing_cols = {col.get("name") for col in inspector.get_columns(table)}
+        for column, ddl in columns.items():
+            if column not in existing_cols:
+                with db.engine.connect() as conn:
+                    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+                    conn.commit()
 
     db.create_all()
+
+    # create_all não cria índices novos em tabelas já existentes
+    for model in (User, ChatMessage, ChatAttachment):
+        existing_indexes = {ix.get("name") for ix in inspector.get_indexes(model.__tablename__)}
+        for index in model.__table__.indexes:
+            if index.name not in existing_indexes:
+                index.create(bind=db.engine)
+
     create_default_plans()
     create_default_admin()
 
+# Workers de fundo sobem com o processo: retomam o que ficou pendente num restart/deploy
+# (desligados nos testes com START_BACKGROUND_WORKERS=false)
+if os.getenv("START_BACKGROUND_WORKERS", "true").lower() == "true":
+    start_batch_worker(app)
+    # outbox e retentativas de email pendentes desde antes do restart
+    if smtp_configured():
+        start_email_worker()
+
 # =========================
 # Tratadores de erro JWT/Limiter
 # =========================
@@ -191,6 +226,13 @@ def serve_user_photo(filename):
     uploads_path = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "static", "uploads"))
     return send_from_directory(uploads_path, filename)
 
+# =========================
+# Health check (sem banco/Redis; sempre tem thread reservada, ver utils/admission.py)
+# =========================
+@app.route("/api/health")
+def health():
+    return jsonify({"status": "ok", "admission": admission_state()}), 200
+
 # =========================
 # Blueprints (rotas)
 # =========================
@@ -207,6 +249,7 @@ app.register_blueprint(ai_generation_api, url_prefix="/api/ai")
 app.register_blueprint(ai_generation_video_api, url_prefix="/api/ai")
 app.register_blueprint(chat_api, url_prefix="/api/chats")
 app.register_blueprint(download_api, url_prefix="/api/downloads")
+app.register_blueprint(batch_api, url_prefix="/api/batches")
 
 print("🚀 Ambiente:", "DESENVOLVIMENTO" if ENV == "dev" else "PRODUÇÃO")
 
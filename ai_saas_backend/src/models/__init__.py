@@ -13,7 +13,9 @@ from .plan import (
     Feature,
     PlanFeature,
 ) 
-from .chat import Chat, ChatMessage, ChatAttachment
+from .chat import Chat, ChatMessage, ChatAttachment, DocumentChunk
+from .usage import UsageDaily
+from .batch import BatchJob, BatchItem
 
 __all__ = [
     "User",
@@ -30,4 +32,8 @@ __all__ = [
     "Chat"
     "ChatMessage",
     "ChatAttachment",
+    "DocumentChunk",
+    "UsageDaily",
+    "BatchJob",
+    "BatchItem",
 ]
\ No newline at end of file
@@ -0,0 +1,80 @@
+import json
+import uuid
+from datetime import datetime
+from extensions import db
+
+def generate_uuid():
+    return str(uuid.uuid4())
+
+class BatchJob(db.Model):
+    """Lote de gerações (texto ou imagem) enviado de uma vez; processado fora da requisição."""
+    __tablename__ = "batch_jobs"
+
+    id = db.Column(db.String, primary_key=True, default=generate_uuid)
+    user_id = db.Column(db.String, db.ForeignKey("users.id"), nullable=False, index=True)
+    kind = db.Column(db.String(20), nullable=False)  # "text" | "image"
+    model = db.Column(db.String(120), nullable=False)
+    # "openai_batch" / "anthropic_batch" (API de lote do provedor) ou "pool" (workers com rate limit)
+    mode = db.Column(db.String(30), nullable=False)
+    # queued -> submitted (lote no provedor) / running (pool) -> completed | failed | cancelled
+    status = db.Column(db.String(20), nullable=False, default="queued", index=True)
+    provider_batch_id = db.Column(db.String(120), nullable=True)
+    # parâmetros comuns a todos os itens (temperatura, estilo, proporção, qualidade), em JSON
+    params = db.Column(db.Text, nullable=True)
+    total_items = db.Column(db.Integer, nullable=False, default=0)
+    succeeded_items = db.Column(db.Integer, nullable=False, default=0)
+    failed_items = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    completed_at = db.Column(db.DateTime, nullable=True)
+
+    def __repr__(self):
+        return f"<BatchJob {self.id} {self.kind} status={self.status}>"
+
+    @property
+    def params_dict(self):
+        return json.loads(self.params) if self.params else {}
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "model": self.model,
+            "mode": self.mode,
+            "status": self.status,
+            "params": self.params_dict,
+            "total_items": self.total_items,
+            "succeeded_items": self.succeeded_items,
+            "failed_items": self.failed_items,
+            "error": self.error,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "completed_at": self.completed_at.isoformat() if self.completed_at else None,
+        }
+
+class BatchItem(db.Model):
+    __tablename__ = "batch_items"
+    __table_args__ = (
+        db.Index("ix_batch_items_job_status", "job_id", "status"),
+    )
+
+    # também é o custom_id enviado ao provedor
+    id = db.Column(db.String, primary_key=True, default=generate_uuid)
+    job_id = db.Column(db.String, db.ForeignKey("batch_jobs.id"), nullable=False)
+    position = db.Column(db.Integer, nullable=False)
+    prompt = db.Column(db.Text, nullable=False)
+    # pending -> succeeded | failed
+    status = db.Column(db.String(20), nullable=False, default="pending")
+    content_id = db.Column(db.String, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "position": self.position,
+            "prompt": self.prompt,
+            "status": self.status,
+            "content_id": self.content_id,
+            "error": self.error,
+        }
@@ -23,6 +23,12 @@ class Chat(db.Model):
     provider = db.Column(db.String(50), nullable=True)
     archived = db.Column(db.Boolean, default=False)
     supports_vision = db.Column(db.Boolean, default=False)
+    # estado da conversa guardado no provedor (utils/conversation_state.py): id da última
+    # resposta/interação e a mensagem da IA até onde ele cobre o histórico
+    state_provider = db.Column(db.String(20), nullable=True)
+    state_id = db.Column(db.String(120), nullable=True)
+    state_message_id = db.Column(db.String, nullable=True)
+    state_updated_at = db.Column(db.DateTime, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
@@ -72,6 +78,13 @@ class ChatMessage(db.Model):
     prompt_tokens = db.Column(db.Integer, nullable=True)
     completion_tokens = db.Column(db.Integer, nullable=True)
     total_tokens = db.Column(db.Integer, nullable=True)
+    # parte de prompt_tokens lida do cache de prompt do provedor (utils/prompt_cache.py)
+    cached_tokens = db.Column(db.Integer, nullable=True)
+    # "complete", "partial" (geração cancelada pelo usuário ou por desconexão)
+    # ou "streaming" (geração retomável em andamento)
+    status = db.Column(db.String(20), nullable=True, default="complete")
+    # mensagem a que esta responde; no modo comparação as respostas são irmãs (mesmo pai)
+    parent_id = db.Column(db.String, nullable=True, index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
 
     chat = db.relationship("Chat", back_populates="messages")
@@ -101,8 +114,11 @@ class ChatMessage(db.Model):
                 "prompt_tokens": self.prompt_tokens,
                 "completion_tokens": self.completion_tokens,
                 "total_tokens": self.total_tokens,
+                "cached_tokens": self.cached_tokens,
             },
             "attachments": [a.to_dict() for a in (self.attachments or [])],
+            "status": self.status or "complete",
+            "parent_id": self.parent_id,
             "created_at": self.created_at.isoformat() if self.created_at else None,
         }
 
@@ -115,9 +131,17 @@ class ChatAttachment(db.Model):
     path = db.Column(db.String(600), nullable=False)
     mimetype = db.Column(db.String(120), nullable=False, default="application/octet-stream")
     size_bytes = db.Column(db.Integer, nullable=True)
+    # PDFs: texto extraído no upload (utils/documents.py): None (não processado),
+    # "indexed", "empty" (sem texto, ex.: digitalizado) ou "error"
+    text_status = db.Column(db.String(20), nullable=True)
+    # imagens: hash do conteúdo (chave das derivadas redimensionadas) e legenda curta usada
+    # no lugar dos pixels quando a mensagem fica antiga (utils/vision_inputs.py)
+    content_hash = db.Column(db.String(64), nullable=True, index=True)
+    caption = db.Column(db.Text, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     message = db.relationship("ChatMessage", back_populates="attachments")
+    chunks = db.relationship("DocumentChunk", cascade="all, delete-orphan", lazy=True)
 
     def __repr__(self):
         return f"<ChatAttachment {self.id} name={self.name!r}>"
@@ -132,3 +156,18 @@ class ChatAttachment(db.Model):
             "url": f"/api/chats/attachments/{self.id}",
             "created_at": self.created_at.isoformat() if self.created_at else None,
         }
+
+class DocumentChunk(db.Model):
+    """Trecho de texto de um PDF anexado; indexado por chat para recuperação (BM25)."""
+    __tablename__ = "document_chunks"
+
+    id = db.Column(db.String, primary_key=True, default=generate_uuid)
+    attachment_id = db.Column(db.String, db.ForeignKey("chat_attachments.id"), nullable=False, index=True)
+    chat_id = db.Column(db.String, db.ForeignKey("chats.id"), nullable=False, index=True)
+    position = db.Column(db.Integer, nullable=False)
+    page = db.Column(db.Integer, nullable=True)
+    text = db.Column(db.Text, nullable=False)
+    tokens = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<DocumentChunk {self.attachment_id}#{self.position}>"
@@ -0,0 +1,35 @@
+from datetime import datetime
+from extensions import db
+
+class UsageDaily(db.Model):
+    """Rollup diário de tokens por (dia, usuário, modelo), mantido incrementalmente."""
+    __tablename__ = "usage_daily"
+    __table_args__ = (
+        db.UniqueConstraint("day", "user_id", "model", name="uq_usage_daily_day_user_model"),
+        db.Index("ix_usage_daily_user_day", "user_id", "day"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False, index=True)
+    user_id = db.Column(db.String, db.ForeignKey("users.id"), nullable=False)
+    # "" quando o modelo não foi registrado (NULL quebraria a unicidade da chave)
+    model = db.Column(db.String(120), nullable=False, default="")
+    prompt_tokens = db.Column(db.BigInteger, nullable=False, default=0)
+    completion_tokens = db.Column(db.BigInteger, nullable=False, default=0)
+    total_tokens = db.Column(db.BigInteger, nullable=False, default=0)
+    message_count = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<UsageDaily {self.day} user={self.user_id} model={self.model!r}>"
+
+    def to_dict(self):
+        return {
+            "day": self.day.isoformat() if self.day else None,
+            "user_id": self.user_id,
+            "model": self.model or None,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "total_tokens": self.total_tokens,
+            "message_count": self.message_count,
+        }
@@ -10,4 +10,5 @@ from .plan_api import plan_api
 from .ai_generation_api import ai_generation_api
 from .ai_generation_video_api import ai_generation_video_api
 from .chat_api import chat_api
-from .download_api import download_api
\ No newline at end of file
+from .download_api import download_api
+from .batch_api import batch_api
\ No newline at end of file
@@ -1,22 +1,86 @@
 from flask import Blueprint, jsonify, request
 from extensions import db, bcrypt, jwt_required
-from utils import admin_required
-from models import User, Plan
-from models.chat import Chat, ChatMessage
-from sqlalchemy import func
-from datetime import datetime, timedelta
+from utils import admin_required, rebuild_usage_rollups
+from utils.email_outbox import outbox_stats, requeue_dead_letters
+from utils.metrics import snapshot as metrics_snapshot
+from utils.provider_limits import queue_depths
+from utils.scheduler import scheduler_status
+from utils.circuit_breaker import breaker_status, reset as reset_circuit
+from utils.model_router import routing_table
+from utils.response_cache import cache_stats
+import redis
+from models import User, Plan, Feature, PlanFeature, UsageDaily
+from models.chat import Chat
+from sqlalchemy import func, or_
+from sqlalchemy.orm import joinedload
+from datetime import datetime, date, timedelta
 import uuid, os, re
 
 admin_api = Blueprint("admin_api", __name__)
 
+def _escape_like(value):
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+# Diretório de usuários paginado no servidor, com busca por prefixo e filtros
 @admin_api.route("/users", methods=["GET"])
 @jwt_required()
 @admin_required
 def list_all_users():
-    users = User.query.all()
+    try:
+        page = max(int(request.args.get("page", 1)), 1)
+        per_page = min(max(int(request.args.get("per_page", 30)), 1), 200)
+        plan_id = int(request.args["plan_id"]) if request.args.get("plan_id") else None
+    except ValueError:
+        return jsonify({"error": "page/per_page/plan_id inválidos"}), 400
+
+    search = (request.args.get("q") or "").strip()
+    role = request.args.get("role")
+    is_active = request.args.get("is_active")
+    with_stats = request.args.get("with_stats", "").lower() in ("1", "true")
+
+    query = User.query.options(joinedload(User.plan))
+
+    if search:
+        # prefixo (LIKE 'x%') para aproveitar os índices de full_name/username/email
+        pattern = f"{_escape_like(search)}%"
+        query = query.filter(or_(
+            User.full_name.like(pattern, escape="\\"),
+            User.username.like(pattern, escape="\\"),
+            User.email.like(pattern, escape="\\"),
+        ))
+    if plan_id is not None:
+        query = query.filter(User.plan_id == plan_id)
+    if role:
+        query = query.filter(User.role == role)
+    if is_active in ("true", "false"):
+        query = query.filter(User.is_active == (is_active == "true"))
+
+    total = query.order_by(None).count()
+
+    users = query.order_by(User.created_at.desc(), User.id
+    ).offset((page - 1) * per_page).limit(per_page).all()
+
+    chat_counts, tokens_month = {}, {}
+    if with_stats and users:
+        # agregados só dos usuários da página (o custo acompanha per_page, não o tamanho da base)
+        page_ids = [u.id for u in users]
+        month_start, month_end = _current_month_bounds()
+        chat_counts = dict(
+            db.session.query(Chat.user_id, func.count(Chat.id))
+            .filter(Chat.user_id.in_(page_ids))
+            .group_by(Chat.user_id)
+            .all()
+        )
+        tokens_month = dict(
+            db.session.query(UsageDaily.user_id, func.sum(UsageDaily.total_tokens))
+            .filter(UsageDaily.user_id.in_(page_ids), UsageDaily.day >= month_start, UsageDaily.day <= month_end)
+            .group_by(UsageDaily.user_id)
+            .all()
+        )
+
     result = []
     for user in users:
-        result.append({
+        item = {
             "id": user.id,
             "full_name": user.full_name,
             "username": user.username,
@@ -29,8 +93,21 @@ def list_all_users():
                 "name": user.plan.name
             } if user.plan else None,
             "is_active": user.is_active
-        })
-    return jsonify(result)
+        }
+        if with_stats:
+            item["stats"] = {
+                "chat_count": int(chat_counts.get(user.id) or 0),
+                "tokens_this_month": int(tokens_month.get(user.id) or 0),
+            }
+        result.append(item)
+
+    return jsonify({
+        "results": result,
+        "total": total,
+        "page": page,
+        "per_page": per_page,
+        "pages": (total + per_page - 1) // per_page,
+    })
 
 @admin_api.route("/users", methods=["POST"])
 @jwt_required()
@@ -149,80 +226,197 @@ def update_user_status(user_id):
     }), 200
 
 # Relatório de uso de tokens por usuário, com filtros de período e modelo
+# Lê os rollups diários (usage_daily) em vez de agregar chat_messages a cada chamada.
+USAGE_SORT_COLUMNS = ("total_tokens", "prompt_tokens", "completion_tokens", "message_count", "username", "email")
+
+def _parse_day(value):
+    # aceita "YYYY-MM-DD" ou datetime ISO (usa só a parte da data)
+    return date.fromisoformat(value.strip()[:10])
+
+def _current_month_bounds():
+    month_start = datetime.utcnow().date().replace(day=1)
+    if month_start.month == 12:
+        next_month = month_start.replace(year=month_start.year + 1, month=1)
+    else:
+        next_month = month_start.replace(month=month_start.month + 1)
+    return month_start, next_month - timedelta(days=1)
+
 @admin_api.route("/usage", methods=["GET"])
 @jwt_required()
 @admin_required
 def usage_report():
     # Admin já validado pelo decorator @admin_required
 
-    start = request.args.get("start")
-    end = request.args.get("end")
     model = request.args.get("model")
-
-    # Se período não informado, considera mês corrente (UTC)
-    if not start or not end:
-        today = datetime.utcnow().date()
-        month_start = today.replace(day=1)
-        # próximo mês
-        if month_start.month == 12:
-            next_month = month_start.replace(year=month_start.year + 1, month=1, day=1)
-        else:
-            next_month = month_start.replace(month=month_start.month + 1, day=1)
-        # usa ISO date
-        start = start or month_start.isoformat()
-        end = end or next_month.isoformat()
-
-    q = db.session.query(
-        Chat.user_id.label("user_id"),
-        func.coalesce(func.sum(ChatMessage.prompt_tokens), 0).label("prompt_tokens"),
-        func.coalesce(func.sum(ChatMessage.completion_tokens), 0).label("completion_tokens"),
-        func.coalesce(func.sum(ChatMessage.total_tokens), 0).label("total_tokens"),
-    ).join(ChatMessage, Chat.id == ChatMessage.chat_id
-    ).filter(ChatMessage.role == "assistant")
-
-    if start:
-        q = q.filter(ChatMessage.created_at >= start)
-    if end:
-        q = q.filter(ChatMessage.created_at <= end)
+    sort = request.args.get("sort", "total_tokens")
+    order = request.args.get("order", "desc").lower()
+    if sort not in USAGE_SORT_COLUMNS:
+        return jsonify({"error": f"sort inválido, use: {', '.join(USAGE_SORT_COLUMNS)}"}), 400
+
+    try:
+        page = max(int(request.args.get("page", 1)), 1)
+        per_page = min(max(int(request.args.get("per_page", 50)), 1), 500)
+    except ValueError:
+        return jsonify({"error": "page/per_page inválidos"}), 400
+
+    # Se período não informado, considera mês corrente (UTC); "end" é inclusivo
+    month_start, month_end = _current_month_bounds()
+    try:
+        start = _parse_day(request.args["start"]) if request.args.get("start") else month_start
+        end = _parse_day(request.args["end"]) if request.args.get("end") else month_end
+    except ValueError:
+        return jsonify({"error": "Datas inválidas, use YYYY-MM-DD"}), 400
+
+    agg = db.session.query(
+        UsageDaily.user_id.label("user_id"),
+        func.sum(UsageDaily.prompt_tokens).label("prompt_tokens"),
+        func.sum(UsageDaily.completion_tokens).label("completion_tokens"),
+        func.sum(UsageDaily.total_tokens).label("total_tokens"),
+        func.sum(UsageDaily.message_count).label("message_count"),
+    ).filter(UsageDaily.day >= start, UsageDaily.day <= end)
     if model:
-        q = q.filter(ChatMessage.model_used == model)
+        agg = agg.filter(UsageDaily.model == model)
+    agg = agg.group_by(UsageDaily.user_id).subquery()
 
-    q = q.group_by(Chat.user_id).order_by(func.sum(ChatMessage.total_tokens).desc())
-    rows = q.all()
+    # quota mensal por plano (Feature: token_quota_monthly), resolvida no mesmo SELECT
+    quota = db.session.query(
+        PlanFeature.plan_id.label("plan_id"),
+        PlanFeature.value.label("value"),
+    ).join(Feature, Feature.id == PlanFeature.feature_id
+    ).filter(Feature.key == "token_quota_monthly").subquery()
 
-    users = {}
-    if rows:
-        ids = [r.user_id for r in rows]
-        for u in User.query.filter(User.id.in_(ids)).all():
-            users[u.id] = u
+    q = db.session.query(
+        agg,
+        User.username,
+        User.full_name,
+        User.email,
+        quota.c.value.label("quota_value"),
+    ).outerjoin(User, User.id == agg.c.user_id
+    ).outerjoin(quota, quota.c.plan_id == User.plan_id)
+
+    total = db.session.query(func.count()).select_from(agg).scalar() or 0
+
+    if sort in ("username", "email"):
+        sort_col = getattr(User, sort)
+    else:
+        sort_col = agg.c[sort]
+    sort_expr = sort_col.asc() if order == "asc" else sort_col.desc()
+    rows = q.order_by(sort_expr, agg.c.user_id).offset((page - 1) * per_page).limit(per_page).all()
 
     data = []
     for r in rows:
-        u = users.get(r.user_id)
-        # quota mensal por plano (Feature: token_quota_monthly)
-        quota = 0
-        if u and u.plan and getattr(u.plan, "features", None):
-            try:
-                for pf in u.plan.features:
-                    if getattr(pf, "feature", None) and pf.feature.key == "token_quota_monthly":
-                        quota = int(pf.value or "0")
-                        break
-            except Exception:
-                quota = 0
+        try:
+            quota_value = int(r.quota_value or "0")
+        except ValueError:
+            quota_value = 0
 
         used = int(r.total_tokens or 0)
-        remaining = max(quota - used, 0) if quota else None
+        remaining = max(quota_value - used, 0) if quota_value else None
 
         data.append({
             "user_id": r.user_id,
-            "username": getattr(u, "username", None),
-            "full_name": getattr(u, "full_name", None),
-            "email": getattr(u, "email", None),
+            "username": r.username,
+            "full_name": r.full_name,
+            "email": r.email,
             "prompt_tokens": int(r.prompt_tokens or 0),
             "completion_tokens": int(r.completion_tokens or 0),
             "total_tokens": used,
-            "quota_monthly": quota,
+            "message_count": int(r.message_count or 0),
+            "quota_monthly": quota_value,
             "remaining_tokens": remaining,
-            "period": {"start": start, "end": end},
+            "period": {"start": start.isoformat(), "end": end.isoformat()},
         })
-    return jsonify({"count": len(data), "results": data}), 200
+    return jsonify({
+        "count": len(data),
+        "total": total,
+        "page": page,
+        "per_page": per_page,
+        "results": data,
+    }), 200
+
+# Recalcula os rollups de um período (backfill ou job periódico de reconciliação)
+@admin_api.route("/usage/rollups/rebuild", methods=["POST"])
+@jwt_required()
+@admin_required
+def rebuild_usage():
+    data = request.get_json(silent=True) or {}
+    month_start, month_end = _current_month_bounds()
+    try:
+        start = _parse_day(data["start"]) if data.get("start") else month_start
+        end = _parse_day(data["end"]) if data.get("end") else month_end
+    except ValueError:
+        return jsonify({"error": "Datas inválidas, use YYYY-MM-DD"}), 400
+    if end < start:
+        return jsonify({"error": "end deve ser maior ou igual a start"}), 400
+
+    rows = rebuild_usage_rollups(start, end)
+    return jsonify({
+        "message": "Rollups recalculados",
+        "rows": rows,
+        "period": {"start": start.isoformat(), "end": end.isoformat()},
+    }), 200
+
+# Situação da outbox de emails (fila, retentativas e dead-letter)
+@admin_api.route("/email-outbox", methods=["GET"])
+@jwt_required()
+@admin_required
+def email_outbox_status():
+    return jsonify(outbox_stats()), 200
+
+@admin_api.route("/email-outbox/requeue", methods=["POST"])
+@jwt_required()
+@admin_required
+def email_outbox_requeue():
+    moved = requeue_dead_letters()
+    return jsonify({"message": "Mensagens devolvidas para a outbox", "requeued": moved}), 200
+
+# Métricas operacionais: contadores/tempos agregados e filas por provedor
+@admin_api.route("/metrics", methods=["GET"])
+@jwt_required()
+@admin_required
+def operational_metrics():
+    try:
+        return jsonify({
+            **metrics_snapshot(),
+            "provider_queues": queue_depths(),
+            "generation_queue": scheduler_status(),
+        }), 200
+    except redis.exceptions.RedisError as e:
+        return jsonify({"error": f"Métricas indisponíveis: {e}"}), 503
+
+# Circuit breakers por provedor/modelo: estado, taxa de erro, latência e saúde
+@admin_api.route("/circuits", methods=["GET"])
+@jwt_required()
+@admin_required
+def list_circuits():
+    try:
+        return jsonify(breaker_status()), 200
+    except redis.exceptions.RedisError as e:
+        return jsonify({"error": f"Estado dos circuitos indisponível: {e}"}), 503
+
+@admin_api.route("/circuits/<path:scope>/reset", methods=["POST"])
+@jwt_required()
+@admin_required
+def reset_circuit_state(scope):
+    reset_circuit(scope)
+    return jsonify({"message": f"Circuito {scope} fechado"}), 200
+
+# Cadeias de fallback declarativas e a saúde ao vivo de cada modelo usada pelo roteador
+@admin_api.route("/routing", methods=["GET"])
+@jwt_required()
+@admin_required
+def model_routing():
+    try:
+        return jsonify(routing_table()), 200
+    except redis.exceptions.RedisError as e:
+        return jsonify({"error": f"Dados de roteamento indisponíveis: {e}"}), 503
+
+# Cache exato de respostas: entradas e taxa de acerto por tipo (texto/imagem)
+@admin_api.route("/response-cache", methods=["GET"])
+@jwt_required()
+@admin_required
+def response_cache_stats():
+    try:
+        return jsonify(cache_stats()), 200
+    except redis.exceptions.RedisError as e:
+        return jsonify({"error": f"Cache de respostas indisponível: {e}"}), 503
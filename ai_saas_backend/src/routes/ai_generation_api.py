@@ -1,10 +1,30 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, after_this_request, Response, stream_with_context, g, make_response
 from extensions import jwt_required, db
 from models.chat import Chat, ChatMessage, ChatAttachment, SenderType
 from models.generated_content import GeneratedImageContent
 from models.user import User  # <--- corrigido, import do modelo User
+from utils import record_usage, cost_limited, idempotent, scheduled, admission_controlled, delete_chats, delete_messages
+from utils.admission import degraded_model, is_degraded
+from utils.provider_limits import provider_for_url, ProviderBusyError, busy_response
+from utils.retry import call_provider, set_request_deadline, status_of
+from utils.hedging import hedged_call
+from utils.turn_tasks import run_dag
+from utils.image_intent import wants_image
+from utils.chat_titles import provisional_title, enqueue_title
+from utils import response_cache
+from utils.rate_limit import refund_current_request
+from utils.cancellation import start_generation, finish_generation, request_cancel, wait as wait_cancellable
+from utils.provider_stream import collect_stream
+from utils import prompt_cache, conversation_state, documents, vision_inputs
+from utils.resumable_stream import (
+    GenerationStream, message_for_generation, read_events, stream_exists, READ_DEADLINE_SECONDS,
+)
+from utils.model_router import (
+    route as route_model, ModelUnavailableError, is_gemini_model, is_openrouter_model, is_anthropic_model, is_perplexity_model,
+)
 from flask_jwt_extended import get_jwt_identity
-import os, uuid, base64, requests, time
+import os, uuid, base64, requests, time, shutil, json, queue
+import redis
 from datetime import datetime
 from dotenv import load_dotenv
 from pathlib import Path
@@ -35,46 +55,13 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))  # pasta src
 UPLOAD_DIR = os.path.join(BASE_DIR, "..", "static", "uploads")
 UPLOAD_DIR = os.path.abspath(UPLOAD_DIR)
 os.makedirs(UPLOAD_DIR, exist_ok=True)
+# imagens até este tamanho vão inline para o Gemini (acima disso, upload via Files API)
+GEMINI_INLINE_MAX_BYTES = int(os.getenv("GEMINI_INLINE_MAX_BYTES", 4 * 1024 * 1024))
 ai_generation_api = Blueprint("ai_generation_api", __name__)
 
-GEMINI_MODELS = ("gemini-2.5-pro", "gemini-2.5-flash", "gemini-2.5-flash-lite", "gemini-3-pro-preview")
-OPENROUTER_PREFIXES = ("deepseek/", "google/", "tngtech/", "qwen/", "z-ai/")
-OPENROUTER_SUFFIX = ":free"
-
-def resolve_gemini_model(req_model: str) -> str:
-    # mapeia temporariamente modelos sem quota para um que funciona
-    fallback = {
-        "gemini-2.5-pro": "gemini-2.5-flash",
-        "gemini-3-pro-preview": "gemini-2.5-flash",
-    }
-    return fallback.get(req_model, req_model)
-
-def is_gemini_model(model: str) -> bool:
-    return model in GEMINI_MODELS
-
-def is_openrouter_model(model: str) -> bool:
-    return bool(model) and ("/" in model or model.endswith(OPENROUTER_SUFFIX) or model.startswith(OPENROUTER_PREFIXES))
-
 def uses_completion_tokens_for_openai(model: str) -> bool:
     return model.startswith("o") or model.startswith("gpt-5")
 
-def is_anthropic_model(model: str) -> bool:
-    return bool(model) and model.startswith("claude-")
-
-def is_perplexity_model(model: str) -> bool:
-    return bool(model) and model.startswith("sonar")
-
-def resolve_perplexity_try_models(model: str) -> list[str]:
-    chain = [model]
-    if model == "sonar-reasoning-pro":
-        chain += ["sonar-reasoning", "sonar"]
-    elif model == "sonar-reasoning":
-        chain += ["sonar"]
-    elif model == "sonar-deep-research":
-        # deep-research pode exigir superfície/endpoint diferentes; fallback para sonar
-        chain += ["sonar-reasoning", "sonar"]
-    return chain
-
 def is_model_allowed_for_basic_plan(model: str) -> bool:
     # Básico: gpt-4o, deepseek/deepseek-r1-0528:free, sonar, sonar-reasoning, claude-haiku-4-5 (inclui snapshots)
     if not model:
@@ -105,6 +92,13 @@ def is_model_allowed_for_free_plan(model: str) -> bool:
         return True
     return False
 
+def plan_allows_model(plan_name: str, model: str) -> bool:
+    if plan_name in ("grátis", "gratis"):
+        return is_model_allowed_for_free_plan(model)
+    if plan_name in ("básico", "basico"):
+        return is_model_allowed_for_basic_plan(model)
+    return True
+
 def supports_vision(model: str) -> bool:
     res = model.startswith("gpt-4o") or model.startswith("o") or model.startswith("gpt-5") or is_gemini_model(model)
     print(f"[DEBUG] supports_vision({model}) -> {res}")
@@ -187,13 +181,21 @@ def build_messages_for_openai(session_messages, model: str):
                 path = att["path"] if isinstance(att, dict) else att.path
                 name = att.get("name") if isinstance(att, dict) else att.name
 
-                if mimetype.startswith("image/") and os.path.exists(path):
+                if mimetype.startswith("image/") and isinstance(att, dict) and att.get("caption"):
+                    # imagem de turno antigo: legenda no lugar dos pixels
+                    parts.append({"type": "text", "text": att["caption"]})
+                elif mimetype.startswith("image/") and os.path.exists(path):
                     if role == "assistant":
                         print(f"[DEBUG] Pulando carregamento de imagem do assistant: {name}")
                     else:
+                        # derivada no tamanho máximo útil para o modelo (utils/vision_inputs.py)
+                        path, mimetype = vision_inputs.prepared_image(path, mimetype, model)
                         img_part = {"type": "image_url", "image_url": {"url": to_data_url(path, mimetype)}}
                         parts.append(img_part)
                         print(f"[DEBUG] Imagem anexada adicionada: {img_part}")
+                elif mimetype == "application/pdf" and isinstance(att, dict) and att.get("indexed"):
+                    # texto já extraído: os trechos relevantes vão no texto da mensagem atual
+                    non_images.append(name)
                 elif mimetype == "application/pdf" and os.path.exists(path):
                     with open(path, "rb") as f:
                         file_b64 = base64.b64encode(f.read()).decode("utf-8")
@@ -241,6 +243,22 @@ def build_messages_for_anthropic(session_messages):
         })
     return msgs
 
+def build_anthropic_request(model, session_messages, temperature, api_key):
+    """(endpoint, headers, body) de /v1/messages com breakpoints de cache no prefixo estável."""
+    headers = {
+        "x-api-key": api_key,
+        "anthropic-version": "2023-06-01",
+        "content-type": "application/json"
+    }
+    body = {
+        "model": model,
+        "max_tokens": 1024,
+        "temperature": temperature,
+        "system": prompt_cache.anthropic_system(generate_system_message(model)["content"]),
+        "messages": prompt_cache.mark_anthropic_history(build_messages_for_anthropic(session_messages)),
+    }
+    return "https://api.anthropic.com/v1/messages", headers, body
+
 def extract_text_from_anthropic(resp_json):
     blocks = resp_json.get("content", []) or []
     texts = []
@@ -249,41 +267,350 @@ def extract_text_from_anthropic(resp_json):
             texts.append(b.get("text", ""))
     return "\n".join([t for t in texts if t])
 
-def make_request_with_retry(url, headers, body, max_retries=5, backoff=3):
-    for attempt in range(max_retries):
-        response = requests.post(url, headers=headers, json=body, timeout=120)
-        if response.status_code == 429:
-            if attempt < max_retries - 1:
-                print(f"nova tentativa OpenAI/OpenRouter {attempt+1}/{max_retries}")
-                time.sleep(backoff * (attempt + 1))
+# provedores com API chat/completions compatível (podem servir de backup um do outro no hedge)
+CHAT_COMPLETION_PROVIDERS = ("openai", "openrouter")
+
+def build_chat_completion_request(model, session_messages, temperature, env_keys, prompt_cache_key=None):
+    """(endpoint, headers, body) de chat/completions para modelos OpenAI ou OpenRouter."""
+    if is_openrouter_model(model):
+        endpoint = "https://openrouter.ai/api/v1/chat/completions"
+        key = env_keys["OPENROUTER_API_KEY"]
+        body = {
+            "model": model,
+            "messages": build_messages_for_openrouter(session_messages, model),
+            "temperature": temperature
+        }
+    else:
+        endpoint = "https://api.openai.com/v1/chat/completions"
+        key = env_keys["OPENAI_API_KEY"]
+        body = {"model": model, "messages": build_messages_for_openai(session_messages, model)}
+        if not uses_completion_tokens_for_openai(model):
+            body["temperature"] = temperature
+        if prompt_cache_key:
+            body["prompt_cache_key"] = prompt_cache_key
+    headers = {"Authorization": f"Bearer {key}", "Content-Type": "application/json"}
+    return endpoint, headers, body
+
+def request_chat_completion(model, session_messages, temperature, env_keys, cancel=None, sink=None, prompt_cache_key=None):
+    """Chamada chat/completions com hedge opcional (utils/hedging.py). Retorna (modelo_usado, body, resposta)."""
+    bodies = {}
+
+    def call(model_id, leg):
+        endpoint, headers, body = build_chat_completion_request(model_id, session_messages, temperature, env_keys, prompt_cache_key)
+        bodies[model_id] = body
+        if leg is None:
+            return make_request_with_retry(endpoint, headers, body, cancel=cancel, sink=sink)
+        # perna de hedge: cancelamento, buffer de deltas e prazo próprios
+        return make_request_with_retry(
+            endpoint, headers, body, leg.policy(), cancel=leg.cancel, sink=leg.sink, on_first_byte=leg.responded,
+        )
+
+    winner, response = hedged_call(model, call, providers=CHAT_COMPLETION_PROVIDERS, cancel=cancel, sink=sink)
+    return winner, bodies[winner], response
+
+def make_request_with_retry(url, headers, body, policy=None, cancel=None, sink=None, on_first_byte=None):
+    # backoff com jitter, Retry-After e prazo da requisição: ver utils/retry.py
+    if cancel is None and sink is None:
+        return call_provider(
+            provider_for_url(url),
+            body.get("model"),
+            lambda timeout: requests.post(url, headers=headers, json=body, timeout=min(120, timeout)),
+            policy,
+        )
+
+    # geração cancelável/retomável: usa o stream do provedor para poder abortar no meio
+    # (utils/cancellation.py) e repassar os deltas (utils/resumable_stream.py)
+    provider = provider_for_url(url)
+    shape = "anthropic" if provider == "anthropic" else "responses" if url.endswith("/responses") else "openai"
+    stream_body = {**body, "stream": True}
+    if shape == "openai" and provider in ("openai", "openrouter"):
+        stream_body["stream_options"] = {"include_usage": True}
+
+    def attempt(timeout):
+        if cancel is not None:
+            cancel.raise_if_cancelled()
+        if sink is not None:
+            sink.restart()
+        started = time.monotonic()
+        resp = requests.post(url, headers=headers, json=stream_body, timeout=min(120, timeout), stream=True)
+        first_byte_ms = (time.monotonic() - started) * 1000
+        if resp.status_code != 200:
+            resp.content  # corpo do erro lido por inteiro (usado nos logs e na classificação)
+            return resp
+        if on_first_byte is not None:
+            on_first_byte()
+        collected = collect_stream(resp, shape, cancel, on_delta=sink.write if sink is not None else None)
+        collected.latency_ms = first_byte_ms
+        return collected
+
+    return call_provider(provider, body.get("model"), attempt, policy)
+
+def send_with_retry_gemini(chat, message, model=None, policy=None):
+    return call_provider("gemini", model, lambda _timeout: chat.send_message(message), policy)
+
+def build_input_for_openai_responses(messages):
+    """
+    (instructions, input) da Responses API a partir das mensagens de build_messages_for_openai.
+    O system vai em instructions: não é herdado via previous_response_id e precisa ir a cada turno.
+    """
+    instructions, items = None, []
+    for m in messages:
+        content = m["content"]
+        if m["role"] == "system":
+            instructions = content
+            continue
+        if isinstance(content, list):
+            if m["role"] == "assistant":
+                content = "\n".join(p["text"] for p in content if p.get("type") == "text")
+            else:
+                converted = []
+                for p in content:
+                    if p["type"] == "text":
+                        converted.append({"type": "input_text", "text": p["text"]})
+                    elif p["type"] == "image_url":
+                        converted.append({"type": "input_image", "image_url": p["image_url"]["url"]})
+                    elif p["type"] == "file":
+                        converted.append({"type": "input_file", **p["file"]})
+                content = converted
+        items.append({"role": m["role"], "content": content})
+    return instructions, items
+
+def extract_text_from_responses(resp_json):
+    texts = []
+    for item in resp_json.get("output", []) or []:
+        if item.get("type") == "message":
+            texts.extend(c.get("text", "") for c in item.get("content", []) if c.get("type") == "output_text")
+    return "\n".join([t for t in texts if t])
+
+def request_openai_response(model, session_messages, temperature, api_key, previous_response_id=None,
+                            cancel=None, sink=None, prompt_cache_key=None):
+    """
+    Turno pela Responses API com a conversa guardada na OpenAI. Com previous_response_id só a
+    última mensagem vai no input; se o estado expirou, refaz uma vez com o histórico completo.
+    Retorna (body, resposta).
+    """
+    endpoint = "https://api.openai.com/v1/responses"
+    headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
+
+    def send(previous_id):
+        # o histórico só é montado (imagens/PDFs em base64) quando não há estado para continuar
+        instructions, items = build_input_for_openai_responses(
+            build_messages_for_openai(session_messages[-1:] if previous_id else session_messages, model)
+        )
+        body = {"model": model, "input": items, "store": True}
+        if instructions:
+            body["instructions"] = instructions
+        if previous_id:
+            body["previous_response_id"] = previous_id
+        if not uses_completion_tokens_for_openai(model):
+            body["temperature"] = temperature
+        if prompt_cache_key:
+            body["prompt_cache_key"] = prompt_cache_key
+        return body, make_request_with_retry(endpoint, headers, body, cancel=cancel, sink=sink)
+
+    body, response = send(previous_response_id)
+    if previous_response_id and response.status_code != 200 and conversation_state.is_missing_state_error(response.status_code, response.text):
+        print(f"[WARN] Estado da conversa não existe mais na OpenAI, reenviando o histórico: {response.text[:300]}")
+        conversation_state.note_rebuild("openai", "missing")
+        body, response = send(None)
+    return body, response
+
+def build_input_for_gemini_interactions(messages, model, doc_context=""):
+    """Conteúdos da Interactions API a partir das ChatMessage (imagens e PDFs não indexados inline)."""
+    contents = []
+    aged_ids = vision_inputs.aged_message_ids(messages)
+    for m in messages:
+        if m.content:
+            contents.append({"type": "text", "text": m.content})
+        for att in getattr(m, "attachments", []):
+            path = getattr(att, "path", None)
+            mimetype = getattr(att, "mimetype", "") or ""
+            if not path or not os.path.exists(path):
                 continue
-        return response
-    return response
+            if mimetype == "application/pdf" and getattr(att, "text_status", None) == "indexed":
+                contents.append({"type": "text", "text": f"[PDF anexado: {getattr(att, 'name', 'arquivo')}]"})
+            elif mimetype.startswith("image/") and m.id in aged_ids:
+                contents.append({"type": "text", "text": vision_inputs.caption_text(att)})
+            elif mimetype.startswith("image/") or mimetype == "application/pdf":
+                if mimetype.startswith("image/"):
+                    path, mimetype = vision_inputs.prepared_image(path, mimetype, model)
+                with open(path, "rb") as f:
+                    data = base64.b64encode(f.read()).decode("utf-8")
+                kind = "image" if mimetype.startswith("image/") else "document"
+                contents.append({"type": kind, "data": data, "mime_type": mimetype})
+            else:
+                contents.append({"type": "text", "text": f"[Anexo não suportado: {getattr(att, 'name', 'arquivo')}]"})
+    if doc_context:
+        contents.append({"type": "text", "text": doc_context})
+    return contents
+
+def send_gemini_interaction(client, model, history, previous_id=None, policy=None, doc_context=""):
+    """
+    Turno pela Interactions API do Gemini (equivalente ao previous_response_id). Com previous_id
+    só a mensagem atual (última do histórico) vai no input; estado expirado → histórico completo.
+    """
+    def send(prev):
+        contents = build_input_for_gemini_interactions(history[-1:] if prev else history, model, doc_context)
+        kwargs = {"model": model, "input": contents, "store": True}
+        if prev:
+            kwargs["previous_interaction_id"] = prev
+        return call_provider("gemini", model, lambda _timeout: client.interactions.create(**kwargs), policy)
 
-def send_with_retry_gemini(chat, message, retries=5, delay=2):
-    for attempt in range(retries):
+    try:
+        return send(previous_id)
+    except Exception as e:
+        if not previous_id or not conversation_state.is_missing_state_error(status_of(e), str(e)):
+            raise
+        print(f"[WARN] Estado da conversa não existe mais no Gemini, reenviando o histórico: {e}")
+        conversation_state.note_rebuild("gemini", "missing")
+        return send(None)
+
+def gemini_interaction_usage(interaction):
+    """(prompt, completion, total, cached) de uma interação do Gemini."""
+    u = getattr(interaction, "usage", None)
+    return (
+        getattr(u, "total_input_tokens", None),
+        getattr(u, "total_output_tokens", None),
+        getattr(u, "total_tokens", None),
+        getattr(u, "total_cached_tokens", None),
+    )
+
+# Modo comparação: mesmo prompt em vários modelos ao mesmo tempo
+MAX_COMPARE_MODELS = 4
+
+def build_session_messages(history, chat_id, query):
+    """
+    Mensagens do turno como dados simples (sem objetos ORM: podem ser montadas em threads).
+    PDFs viram trechos relevantes para `query` na mensagem atual (utils/documents.py) e
+    imagens de turnos antigos viram legendas.
+    Retorna (session_messages, doc_context).
+    """
+    attachments = [a for m in history for a in getattr(m, "attachments", [])]
+    documents.index_pending(chat_id, attachments)
+    doc_context = documents.document_context(chat_id, query, {a.id: a.name for a in attachments})
+    # imagens de turnos antigos: legenda curta no lugar dos pixels (utils/vision_inputs.py)
+    aged_ids = vision_inputs.aged_message_ids(history)
+    session_messages = [
+        {
+            "role": m.role,
+            "content": m.content,
+            "attachments": [
+                {
+                    "name": a.name,
+                    "path": a.path,
+                    "mimetype": a.mimetype,
+                    "indexed": a.text_status == "indexed",
+                    "caption": vision_inputs.caption_text(a) if m.id in aged_ids and a.mimetype.startswith("image/") else None,
+                }
+                for a in getattr(m, "attachments", [])
+            ],
+        }
+        for m in history
+    ]
+    return documents.with_context(session_messages, doc_context), doc_context
+
+def without_extra_siblings(history):
+    """Das respostas irmãs de uma comparação, só a primeira entra no contexto dos próximos turnos."""
+    seen_parents = set()
+    kept = []
+    for m in history:
+        if m.parent_id:
+            if m.parent_id in seen_parents:
+                continue
+            seen_parents.add(m.parent_id)
+        kept.append(m)
+    return kept
+
+class CompareSink:
+    """Repassa os deltas de um modelo da comparação para a fila de eventos da requisição."""
+
+    def __init__(self, model, events):
+        self.model = model
+        self.events = events
+        self.wrote = False
+
+    def restart(self):
+        if self.wrote:
+            self.wrote = False
+            self.events.put(("reset", self.model, None))
+
+    def write(self, delta):
+        self.wrote = True
+        self.events.put(("delta", self.model, delta))
+
+def _complete_text_once(model_id, session_messages, temperature, env_keys, sink=None):
+    """Uma resposta de texto de model_id. Retorna (texto, (prompt, completion, total)); levanta em erro."""
+    if is_gemini_model(model_id):
+        # o SDK do Gemini não faz stream por aqui: o texto chega inteiro no fim
+        client = genai.Client(api_key=env_keys["GEMINI_API_KEY"])
+        contents = [m["content"] for m in session_messages if m["content"]]
+        response = send_with_retry_gemini(client.chats.create(model=model_id), contents, model=model_id)
+        text = getattr(response, "text", None) or "[Sem retorno]"
+        if sink is not None:
+            sink.write(text)
+        return text, prompt_cache.gemini_usage(getattr(response, "usage_metadata", None))[:3]
+
+    if is_anthropic_model(model_id):
+        endpoint, headers, body = build_anthropic_request(model_id, session_messages, temperature, env_keys["ANTHROPIC_API_KEY"])
+    elif is_perplexity_model(model_id):
+        endpoint = "https://api.perplexity.ai/chat/completions"
+        headers = {"Authorization": f"Bearer {env_keys['PERPLEXITY_API_KEY']}", "Content-Type": "application/json"}
+        body = {
+            "model": model_id,
+            "messages": build_messages_for_openai(session_messages, model_id),
+            "temperature": temperature,
+            "return_citations": True
+        }
+    else:
+        endpoint, headers, body = build_chat_completion_request(model_id, session_messages, temperature, env_keys)
+
+    response = make_request_with_retry(endpoint, headers, body, sink=sink)
+    if response.status_code != 200:
+        raise RuntimeError(f"{response.status_code}: {(response.text or '')[:300]}")
+    data = response.json()
+    u = data.get("usage") or {}
+    if is_anthropic_model(model_id):
+        return extract_text_from_anthropic(data) or "[Sem retorno]", prompt_cache.anthropic_usage(u)[:3]
+    text = data["choices"][0]["message"]["content"] or "[Sem retorno]"
+    return text, (u.get("prompt_tokens"), u.get("completion_tokens"), u.get("total_tokens"))
+
+def complete_text(model, session_messages, temperature, env_keys, plan_name, sink=None):
+    """Resposta de texto seguindo a cadeia de fallback do roteador. Retorna (modelo_usado, texto, uso)."""
+    candidates = route_model(model, lambda m: plan_allows_model(plan_name, m))
+    for mid in candidates:
         try:
-            print(f"Tentativa {attempt+1} enviando para Gemini...")
-            return chat.send_message(message)
+            text, usage = _complete_text_once(mid, session_messages, temperature, env_keys, sink)
+            return mid, text, usage
         except Exception as e:
-            if "503" in str(e) or "UNAVAILABLE" in str(e):
-                print(f"Servidor Gemini ocupado, retry em {delay}s ({attempt+1}/{retries})")
-                time.sleep(delay)
-            elif "429" in str(e) or "RESOURCE_EXHAUSTED" in str(e):
-                print(f"Quota Gemini excedida, retry em {delay}s ({attempt+1}/{retries})")
-                time.sleep(delay)
-            else:
+            if mid == candidates[-1]:
                 raise
-    raise Exception("Falha após várias tentativas Gemini")
+            print(f"[WARN] {mid} falhou na comparação, tentando próximo modelo: {e}")
+
+def _note_unavailable(exc):
+    """
+    Guarda na requisição um erro de indisponibilidade (modelo desativado pelo operador ou
+    provedor sem vaga): se nada for gerado, a rota responde 503 em vez de gravar o texto de erro genérico.
+    """
+    if isinstance(exc, (ModelUnavailableError, ProviderBusyError)):
+        g.provider_unavailable = exc
+
+def _unavailable_response(exc):
+    if isinstance(exc, ProviderBusyError):
+        return busy_response(exc)
+    return make_response(jsonify({"error": str(exc)}), 503)
 
 @ai_generation_api.route("/generate-text", methods=["POST"])
 @jwt_required()
+@admission_controlled("text")
+@idempotent("text")
+@cost_limited("text")
+@scheduled("text")
 def generate_text():
+    set_request_deadline()
     try:
         # lê chaves atualizadas do ambiente a cada requisição
         env_keys = _get_env_keys()
         OPENAI_API_KEY = env_keys["OPENAI_API_KEY"]
-        OPENROUTER_API_KEY = env_keys["OPENROUTER_API_KEY"]
         GEMINI_API_KEY = env_keys["GEMINI_API_KEY"]
         ANTHROPIC_API_KEY = env_keys["ANTHROPIC_API_KEY"]
         PERPLEXITY_API_KEY = env_keys["PERPLEXITY_API_KEY"]
@@ -304,6 +631,10 @@ def generate_text():
             except Exception:
                 temperature = 0.7
             chat_id = request.form.get("chat_id")
+            use_cache = request.form.get("cache", "").lower() in ("1", "true")
+            generation_id = request.form.get("generation_id")
+            resumable = request.form.get("resumable", "").lower() in ("1", "true")
+            server_state = request.form.get("server_state", "").lower() in ("1", "true")
             files = request.files.getlist("files") or []
 
             for f in files:
@@ -331,6 +662,13 @@ def generate_text():
             except Exception:
                 temperature = 0.7
             chat_id = data.get("chat_id")
+            use_cache = bool(data.get("cache"))
+            generation_id = data.get("generation_id")
+            resumable = bool(data.get("resumable"))
+            server_state = bool(data.get("server_state"))
+
+        # sobrecarga: plano Grátis vai para um modelo mais barato (utils/admission.py)
+        model = degraded_model("text", model)
 
         print(f"[INFO] Usuário: {get_jwt_identity()}, Chat ID: {chat_id}, Modelo: {model}, Input: {user_input[:50]}")
 
@@ -345,6 +683,7 @@ def generate_text():
             user = User.query.get(user_id)
             plan_name = (user.plan.name if user and user.plan else "").strip().lower()
         except Exception as _e:
+            user = None
             plan_name = ""
         if plan_name == "bot":
             return jsonify({
@@ -378,27 +717,12 @@ def generate_text():
                 }), 403
 
         # Buscar chat existente ou criar novo
+        new_chat_prompt = None
         chat = Chat.query.filter_by(id=chat_id, user_id=user_id).first() if chat_id else None
         if chat is None:
-            chat_title = "Novo Chat"
-            if user_input:
-                try:
-                    title_res = requests.post(
-                        "https://api.openai.com/v1/chat/completions",
-                        headers={"Authorization": f"Bearer {OPENAI_API_KEY}", "Content-Type": "application/json"},
-                        json={
-                            "model": "gpt-3.5-turbo",
-                            "messages": [{"role": "user", "content": f"Crie um título curto (menos de 5 palavras) sem aspas para: {user_input[:1000]}"}],
-                            "max_tokens": 12,
-                            "temperature": 0.5
-                        },
-                        timeout=10
-                    )
-                    if title_res.status_code == 200:
-                        chat_title = title_res.json().get("choices", [{}])[0].get("message", {}).get("content", "Novo Chat").strip() or "Novo Chat"
-                except Exception as e:
-                    print(f"[WARN] Falha ao gerar título do chat: {e}")
-                    chat_title = "Novo Chat"
+            # título provisório local; o definitivo é gerado fora do caminho crítico (utils/chat_titles.py)
+            chat_title = provisional_title(user_input)
+            new_chat_prompt = user_input
 
             chat = Chat(user_id=user_id, title=chat_title, supports_vision=supports_vision(model))
             db.session.add(chat)
@@ -425,8 +749,16 @@ def generate_text():
                     size_bytes=f.get("size_bytes"),
                     created_at=datetime.utcnow()
                 )
+                if attachment_obj.mimetype.startswith("image/"):
+                    attachment_obj.content_hash = vision_inputs.content_hash(attachment_obj.path)
                 db.session.add(attachment_obj)
+                db.session.flush()
+                # PDFs: texto extraído uma única vez, no upload
+                documents.index_attachment(attachment_obj, chat.id)
                 db.session.commit()
+                if attachment_obj.mimetype.startswith("image/"):
+                    # legenda pronta antes de a imagem sair da janela de turnos recentes
+                    vision_inputs.enqueue_caption(attachment_obj.id)
                 uploaded_files.append({
                     "id": attachment_obj.id,
                     "name": attachment_obj.name,
@@ -438,8 +770,11 @@ def generate_text():
             except Exception as ae:
                 print(f"[WARN] Falha ao salvar attachment {f['name']}: {ae}")
 
-        history = ChatMessage.query.filter_by(chat_id=chat.id).order_by(ChatMessage.created_at).all()
-        session_messages = [{"role": m.role, "content": m.content, "attachments": getattr(m, "attachments", [])} for m in history]
+        history = without_extra_siblings(ChatMessage.query.filter_by(chat_id=chat.id).order_by(ChatMessage.created_at).all())
+        # estado da conversa no provedor (opt-in): vale só se cobre o histórico até a mensagem anterior
+        turn_history = history
+        prior_message_id = history[-2].id if len(history) >= 2 else None
+        session_messages, doc_context = build_session_messages(history, chat.id, user_input)
         print(f"[INFO] Iniciando envio para IA (modelo {model})")
 
         # Modelo efetivamente usado (pode mudar por fallback quando Gemini sem quota)
@@ -450,9 +785,53 @@ def generate_text():
         usage_prompt = None
         usage_completion = None
         usage_total = None
+        usage_cached = None
         max_tokens_used = None
+        state_provider = None
+        new_state_id = None
+
+        # geração cancelável (POST /generations/<id>/cancel ou desconexão do cliente).
+        # Retomável: segue no servidor mesmo se o cliente cair; deltas em GET /generations/<id>/stream
+        cancel = start_generation(user_id, generation_id, None if resumable else request.environ)
+        placeholder = None
+        stream_sink = None
+        if resumable:
+            placeholder = ChatMessage(
+                chat_id=chat.id,
+                role=SenderType.AI.value,
+                content="",
+                model_used=model,
+                status="streaming",
+                created_at=datetime.utcnow()
+            )
+            db.session.add(placeholder)
+            db.session.commit()
+            stream_sink = GenerationStream(placeholder.id, cancel.generation_id, db.engine)
+
+        @after_this_request
+        def _finish_generation(resp):
+            finish_generation(cancel)
+            if stream_sink is not None and not stream_sink.finished:
+                stream_sink.finish("error")
+            return resp
+
+        # cache exato (opt-in); respostas com imagem não são cacheadas
+        cache_key = None
+        cached = None
+        if response_cache.should_use("text", use_cache, temperature, user) and not wants_image(user_input):
+            cache_key = response_cache.cache_key(
+                "text", model, session_messages, temperature,
+                tools=["image_generation"] if supports_generate_image(model) else [],
+            )
+            cached = response_cache.get(cache_key)
         try:
-            if is_gemini_model(model):
+            if cached is not None:
+                # servido do cache: nenhum token consumido no provedor
+                generated_text = cached["text"]
+                used_model = cached["model_used"]
+                print(f"[INFO] Resposta servida do cache ({cache_key[:16]}...)")
+
+            elif is_gemini_model(model):
                 gemini_client = genai.Client(api_key=GEMINI_API_KEY)
                 gemini_chat = None
                 parts = []
@@ -461,61 +840,81 @@ def generate_text():
                 try:
                     print(f"[INFO] Inicializando chat Gemini para chat_id {chat.id}")
 
-                    gm = resolve_gemini_model(model)
-                    gemini_chat = gemini_client.chats.create(model=gm)
-                    used_model = gm
+                    # modelos na ordem do roteador (cadeia declarativa + saúde ao vivo)
+                    candidates = route_model(model, lambda m: plan_allows_model(plan_name, m))
 
                     # histórico
-                    history = ChatMessage.query.filter_by(chat_id=chat.id).order_by(ChatMessage.created_at).all()
+                    history = without_extra_siblings(ChatMessage.query.filter_by(chat_id=chat.id).order_by(ChatMessage.created_at).all())
                     print(f"[INFO] Histórico carregado: {len(history)} mensagens")
 
-                    for m in history:
-                        if m.content:
-                            parts.append(m.content)
-                        for att in getattr(m, "attachments", []):
-                            path = getattr(att, "path", None)
-                            mimetype = getattr(att, "mimetype", "")
-                            name = getattr(att, "name", "arquivo")
-                            if not path or not os.path.exists(path):
-                                continue
-                            if mimetype.startswith("image/"):
-                                uploaded_file = gemini_client.files.upload(file=path)
-                                parts.append(uploaded_file)
-                            elif mimetype == "application/pdf":
-                                with open(path, "rb") as f:
-                                    pdf_bytes = f.read()
-                                parts.append(types.Part.from_bytes(data=pdf_bytes, mime_type="application/pdf"))
-                            else:
-                                parts.append(f"[Anexo não suportado: {name}]")
-
-                    if user_input:
-                        parts.append(user_input)
-
-                    # intenção de imagem
-                    def should_generate_image(prompt: str) -> bool:
-                        try:
-                            analysis_prompt = (
-                                "Você é um verificador de intenção. "
-                                "Analise o texto e diga se ele pede geração de uma imagem. "
-                                "Perguntas como 'pode gerar imagem?' não contam. "
-                                "Responda apenas SIM ou NÃO.\n\n"
-                                f"{prompt}"
-                            )
-                            resp = gemini_client.models.generate_content(
-                                model=(model if is_gemini_model(model) else "gemini-2.5-flash"),
-                                contents=analysis_prompt
-                            )
-                            answer = resp.text.strip().upper()
-                            return answer == "SIM"
-                        except Exception:
-                            prompt_lower = prompt.lower()
-                            keys = ["imagem", "desenhe", "faça um desenho", "gere uma imagem", "foto de", "pinte"]
-                            return any(k in prompt_lower for k in keys)
-
-                    user_asked_image = should_generate_image(user_input)
-
-                    # envio com retry
-                    response = send_with_retry_gemini(gemini_chat, parts)
+                    if not server_state:
+                        # imagens de turnos antigos vão como legenda (utils/vision_inputs.py)
+                        aged_ids = vision_inputs.aged_message_ids(turn_history)
+                        for m in history:
+                            if m.content:
+                                parts.append(m.content)
+                            for att in getattr(m, "attachments", []):
+                                path = getattr(att, "path", None)
+                                mimetype = getattr(att, "mimetype", "")
+                                name = getattr(att, "name", "arquivo")
+                                if not path or not os.path.exists(path):
+                                    continue
+                                if mimetype.startswith("image/") and m.id in aged_ids:
+                                    parts.append(vision_inputs.caption_text(att))
+                                    continue
+                                if mimetype.startswith("image/"):
+                                    path, mimetype = vision_inputs.prepared_image(path, mimetype, model)
+                                if mimetype.startswith("image/") and os.path.getsize(path) > GEMINI_INLINE_MAX_BYTES:
+                                    uploaded_file = gemini_client.files.upload(file=path)
+                                    parts.append(uploaded_file)
+                                elif mimetype.startswith("image/"):
+                                    # inline: mesmos bytes a cada turno, o prefixo entra no cache implícito
+                                    # (o upload gera uma URI nova por turno e quebra o prefixo)
+                                    with open(path, "rb") as f:
+                                        parts.append(types.Part.from_bytes(data=f.read(), mime_type=mimetype))
+                                elif mimetype == "application/pdf" and getattr(att, "text_status", None) == "indexed":
+                                    parts.append(f"[PDF anexado: {name}]")
+                                elif mimetype == "application/pdf":
+                                    with open(path, "rb") as f:
+                                        pdf_bytes = f.read()
+                                    parts.append(types.Part.from_bytes(data=pdf_bytes, mime_type="application/pdf"))
+                                else:
+                                    parts.append(f"[Anexo não suportado: {name}]")
+
+                        if doc_context:
+                            parts.append(doc_context)
+                        if user_input:
+                            parts.append(user_input)
+
+                    if server_state:
+                        state_provider = "gemini"
+                        gemini_state_id = conversation_state.previous_id(chat, "gemini", prior_message_id)
+
+                    # envio com retry, seguindo a cadeia de fallback
+                    def send_main():
+                        for gm in candidates:
+                            cancel.raise_if_cancelled()
+                            try:
+                                if server_state:
+                                    return gm, send_gemini_interaction(gemini_client, gm, turn_history, gemini_state_id, doc_context=doc_context)
+                                gemini_chat = gemini_client.chats.create(model=gm)
+                                return gm, send_with_retry_gemini(gemini_chat, parts, model=gm)
+                            except Exception as ge:
+                                if gm == candidates[-1]:
+                                    raise
+                                print(f"[WARN] Gemini {gm} falhou, tentando próximo modelo: {ge}")
+                                _note_unavailable(ge)
+
+                    # intenção de imagem: detector local, sem round-trip extra ao Gemini
+                    user_asked_image = wants_image(user_input)
+                    # chamada única: roda na própria thread da requisição, sem passar pelo pool do turno.
+                    # O SDK do Gemini não é interrompível: o cancelamento vale entre as tentativas
+                    # da cadeia de fallback e, ao chegar, a resposta é descartada
+                    used_model, response = send_main()
+                    cancel.raise_if_cancelled()
+                    usage_prompt, usage_completion, usage_total, usage_cached = prompt_cache.gemini_usage(
+                        getattr(response, "usage_metadata", None)
+                    )
 
                     generated_text_local = None
                     generated_images_paths = []
@@ -537,17 +936,23 @@ def generate_text():
                                 img.save(save_path)
                                 generated_images_paths.append(save_path)
 
+                    if server_state:
+                        # Interactions API: texto, id e uso vêm direto na interação
+                        generated_text_local = getattr(response, "output_text", None)
+                        new_state_id = getattr(response, "id", None) or None
+                        usage_prompt, usage_completion, usage_total, usage_cached = gemini_interaction_usage(response)
+
                     if user_asked_image and not generated_images_paths:
                         try:
                             print("[INFO] Gerando imagem via API do Gemini...")
-                            img_response = gemini_client.models.generate_images(
+                            img_response = call_provider("gemini", "imagen-4.0-fast-generate-001", lambda _timeout: gemini_client.models.generate_images(
                                 model="imagen-4.0-fast-generate-001",
                                 prompt=user_input,
                                 config=types.GenerateImagesConfig(
                                     number_of_images=1,
                                     aspect_ratio="1:1"
                                 )
-                            )
+                            ))
                             if img_response.generated_images:
                                 img = img_response.generated_images[0].image
                                 filename = f"gemini_{uuid.uuid4().hex}.png"
@@ -569,55 +974,41 @@ def generate_text():
 
                 except Exception as e:
                     print(f"[ERROR] Gemini erro geral: {e}")
+                    _note_unavailable(e)
                     generated_text = "[Erro ao gerar resposta da IA]"
                     uploaded_images = []
 
             elif is_openrouter_model(model):
-                endpoint = "https://openrouter.ai/api/v1/chat/completions"
-                headers = {"Authorization": f"Bearer {OPENROUTER_API_KEY}", "Content-Type": "application/json"}
-                body = {
-                    "model": model,
-                    "messages": build_messages_for_openrouter(session_messages, model),
-                    "temperature": temperature
-                }
                 try:
-                    response = make_request_with_retry(endpoint, headers, body, max_retries=5, backoff=3)
+                    # stream do provedor: cancelável e retomável como no ramo OpenAI
+                    used_model, body, response = request_chat_completion(
+                        model, session_messages, temperature, env_keys, cancel, stream_sink,
+                        prompt_cache_key=prompt_cache.openai_cache_key(chat.id),
+                    )
                     try:
+                        # StreamedResponse: usage vem do último chunk (stream_options.include_usage)
                         j = response.json()
                         generated_text = j["choices"][0]["message"]["content"]
                         u = j.get("usage") or {}
                         usage_prompt = u.get("prompt_tokens")
                         usage_completion = u.get("completion_tokens")
                         usage_total = u.get("total_tokens")
+                        usage_cached = prompt_cache.openai_cached_tokens(u)
                         max_tokens_used = body.get("max_tokens")
                     except Exception:
                         print(f"[WARN] Resposta OpenRouter não é JSON:\n{response.text[:1000]}")
                         generated_text = "[Erro ao gerar resposta da IA]"
                 except Exception as oe:
                     print(f"[ERROR] Falha na chamada OpenRouter: {oe}")
+                    _note_unavailable(oe)
                     generated_text = "[Erro ao gerar resposta da IA]"
 
             elif is_anthropic_model(model):
                 def call_anthropic(model_id: str):
-                    endpoint = "https://api.anthropic.com/v1/messages"
-                    headers = {
-                        "x-api-key": ANTHROPIC_API_KEY,
-                        "anthropic-version": "2023-06-01",
-                        "content-type": "application/json"
-                    }
-                    system_msg = generate_system_message(model_id)["content"]
-                    body = {
-                        "model": model_id,
-                        "max_tokens": 1024,
-                        "temperature": temperature,
-                        "system": system_msg,
-                        "messages": build_messages_for_anthropic(session_messages),
-                    }
-                    return make_request_with_retry(endpoint, headers, body, max_retries=5, backoff=3)
+                    endpoint, headers, body = build_anthropic_request(model_id, session_messages, temperature, ANTHROPIC_API_KEY)
+                    return make_request_with_retry(endpoint, headers, body, cancel=cancel, sink=stream_sink)
 
-                try_models = [model]
-                if model == "claude-opus-4-5":
-                    try_models += ["claude-sonnet-4-5", "claude-haiku-4-5"]
+                try_models = route_model(model, lambda m: plan_allows_model(plan_name, m))
 
                 generated_text = ""
                 for mid in try_models:
@@ -625,6 +1016,7 @@ def generate_text():
                         response = call_anthropic(mid)
                     except Exception as ae:
                         print(f"[ERROR] Falha na chamada Anthropic ({mid}): {ae}")
+                        _note_unavailable(ae)
                         if mid == try_models[-1]:
                             generated_text = "[Erro ao gerar resposta da IA]"
                         continue
@@ -645,14 +1037,10 @@ def generate_text():
                         if txt:
                             used_model = mid
                             generated_text = txt
-                            # usage (Anthropic usa input/output tokens)
-                            u = (data or {}).get("usage") or {}
-                            _in = u.get("input_tokens")
-                            _out = u.get("output_tokens")
-                            if _in is not None or _out is not None:
-                                usage_prompt = _in
-                                usage_completion = _out
-                                usage_total = (_in or 0) + (_out or 0)
+                            # usage (Anthropic usa input/output tokens, com leituras/gravações de cache à parte)
+                            usage_prompt, usage_completion, usage_total, usage_cached = prompt_cache.anthropic_usage(
+                                (data or {}).get("usage")
+                            )
                             break
                         else:
                             print(f"[WARN] Anthropic sem texto (model={mid}) payload={str(data)[:500]}")
@@ -671,7 +1059,7 @@ def generate_text():
                             generated_text = f"[Erro Anthropic {status}: {err_msg}]"
 
             elif is_perplexity_model(model):
-                try_models = resolve_perplexity_try_models(model)
+                try_models = route_model(model, lambda m: plan_allows_model(plan_name, m))
                 generated_text = ""
                 for mid in try_models:
                     endpoint = "https://api.perplexity.ai/chat/completions"
@@ -686,7 +1074,7 @@ def generate_text():
                         "return_citations": True
                     }
                     try:
-                        response = make_request_with_retry(endpoint, headers, body, max_retries=5, backoff=3)
+                        response = make_request_with_retry(endpoint, headers, body, cancel=cancel, sink=stream_sink)
                         status = getattr(response, "status_code", 0)
                         if status == 200:
                             try:
@@ -716,42 +1104,68 @@ def generate_text():
                                 continue
                     except Exception as pe:
                         print(f"[ERROR] Falha na chamada Perplexity ({mid}): {pe}")
+                        _note_unavailable(pe)
                         if mid == try_models[-1]:
                             generated_text = "[Erro ao gerar resposta da IA]"
                         else:
                             continue
 
             else:
-                endpoint = "https://api.openai.com/v1/chat/completions"
-                headers = {"Authorization": f"Bearer {OPENAI_API_KEY}", "Content-Type": "application/json"}
-                body = {"model": model, "messages": build_messages_for_openai(session_messages, model)}
-                if not uses_completion_tokens_for_openai(model):
-                    body["temperature"] = temperature
+                def generate_gpt_images():
+                    client = OpenAI(api_key=OPENAI_API_KEY, max_retries=0)
+                    img_response = call_provider("openai", model, lambda _timeout: client.responses.create(
+                        model=model,
+                        input=[{"role": "user", "content": user_input}],
+                        tools=[{"type": "image_generation"}]
+                    ))
+                    return [
+                        o.result for o in getattr(img_response, "output", [])
+                        if getattr(o, "type", "") == "image_generation_call"
+                    ]
+
+                # completion e geração de imagem são independentes: rodam em paralelo
+                if server_state:
+                    # Responses API com estado no servidor: só a mensagem nova vai no input
+                    state_provider = "openai"
+                    openai_state_id = conversation_state.previous_id(chat, "openai", prior_message_id)
+                    turn_tasks = {"main": (lambda: (model, *request_openai_response(
+                        model, session_messages, temperature, OPENAI_API_KEY, openai_state_id, cancel, stream_sink,
+                        prompt_cache_key=prompt_cache.openai_cache_key(chat.id),
+                    )), [])}
+                else:
+                    turn_tasks = {"main": (lambda: request_chat_completion(
+                        model, session_messages, temperature, env_keys, cancel, stream_sink,
+                        prompt_cache_key=prompt_cache.openai_cache_key(chat.id),
+                    ), [])}
+                # a ferramenta de imagem só é chamada quando o prompt pede uma imagem
+                if supports_generate_image(model) and wants_image(user_input):
+                    turn_tasks["images"] = (generate_gpt_images, [])
+                turn = run_dag(turn_tasks)
                 try:
-                    response = make_request_with_retry(endpoint, headers, body, max_retries=5, backoff=3)
+                    used_model, body, response = turn["main"].result()
                     try:
                         j = response.json()
-                        generated_text = j["choices"][0]["message"]["content"]
                         u = j.get("usage") or {}
-                        usage_prompt = u.get("prompt_tokens")
-                        usage_completion = u.get("completion_tokens")
-                        usage_total = u.get("total_tokens")
+                        if server_state:
+                            generated_text = extract_text_from_responses(j)
+                            new_state_id = j.get("id") if response.status_code == 200 else None
+                            usage_prompt = u.get("input_tokens")
+                            usage_completion = u.get("output_tokens")
+                            usage_total = u.get("total_tokens")
+                            usage_cached = (u.get("input_tokens_details") or {}).get("cached_tokens")
+                        else:
+                            generated_text = j["choices"][0]["message"]["content"]
+                            usage_prompt = u.get("prompt_tokens")
+                            usage_completion = u.get("completion_tokens")
+                            usage_total = u.get("total_tokens")
+                            usage_cached = prompt_cache.openai_cached_tokens(u)
                         max_tokens_used = body.get("max_tokens")
                     except Exception:
                         print(f"[WARN] Resposta OpenAI não é JSON:\n{response.text[:1000]}")
                         generated_text = "[Erro ao gerar resposta da IA]"
-                    if supports_generate_image(model):
+                    if "images" in turn:
                         try:
-                            client = OpenAI(api_key=OPENAI_API_KEY)
-                            img_response = client.responses.create(
-                                model=model,
-                                input=[{"role": "user", "content": user_input}],
-                                tools=[{"type": "image_generation"}]
-                            )
-                            image_outputs = [
-                                o.result for o in getattr(img_response, "output", [])
-                                if getattr(o, "type", "") == "image_generation_call"
-                            ]
+                            image_outputs = wait_cancellable(turn["images"], cancel)
                             for idx, img_base64 in enumerate(image_outputs):
                                 image_path = os.path.join(UPLOAD_DIR, f"ai_image_{uuid.uuid4().hex}.png")
                                 with open(image_path, "wb") as f:
@@ -771,19 +1185,42 @@ def generate_text():
                     print(f"[INFO] Texto gerado: {generated_text[:200]}")
                 except Exception as oe:
                     print(f"[ERROR] Falha na chamada OpenAI: {oe}")
+                    _note_unavailable(oe)
                     generated_text = "[Erro ao gerar resposta da IA]"
                     uploaded_images = []
 
         except Exception as e:
             print(f"[ERROR] Falha geral ao gerar texto IA: {e}")
+            _note_unavailable(e)
             generated_text = "[Erro ao gerar resposta da IA]"
 
+        unavailable = getattr(g, "provider_unavailable", None)
+        if unavailable is not None and not cancel.cancelled and not uploaded_images and (not generated_text or generated_text.startswith("[")):
+            # nada foi gerado: desfaz o turno (o cliente pode repetir) e devolve as unidades do rate limit
+            db.session.rollback()
+            refund_current_request()
+            if new_chat_prompt:
+                delete_chats(user_id, [chat.id])
+            else:
+                delete_messages(chat.id, [user_msg.id] + ([placeholder.id] if placeholder is not None else []))
+            if stream_sink is not None:
+                stream_sink.finish("error")
+            return _unavailable_response(unavailable)
+
+        if cancel.cancelled:
+            # guarda o que foi produzido até o cancelamento e devolve as unidades do rate limit
+            print(f"[INFO] Geração {cancel.generation_id} cancelada ({cancel.reason})")
+            generated_text = cancel.partial_text
+            uploaded_images = []
+            refund_current_request()
+
+        if cache_key and cached is None and not cancel.cancelled and not uploaded_images and generated_text and not generated_text.startswith("["):
+            response_cache.put(cache_key, {"text": generated_text, "model_used": used_model})
+
         # cria a mensagem da IA
         try:
             safe_text = generated_text if not uploaded_images else ""
-            ai_msg = ChatMessage(
-                chat_id=chat.id,
-                role=SenderType.AI.value,
+            ai_fields = dict(
                 content=safe_text,
                 model_used=used_model,
                 temperature=None if uses_completion_tokens_for_openai(model) else temperature,
@@ -791,10 +1228,25 @@ def generate_text():
                 prompt_tokens=usage_prompt,
                 completion_tokens=usage_completion,
                 total_tokens=usage_total,
-                created_at=datetime.utcnow()
+                cached_tokens=usage_cached,
+                status="partial" if cancel.cancelled else "complete",
             )
+            if placeholder is not None:
+                # geração retomável: completa a mensagem criada no início
+                ai_msg = placeholder
+                for field, value in ai_fields.items():
+                    setattr(ai_msg, field, value)
+            else:
+                ai_msg = ChatMessage(chat_id=chat.id, role=SenderType.AI.value, created_at=datetime.utcnow(), **ai_fields)
             db.session.add(ai_msg)
+            record_usage(chat.user_id, used_model, usage_prompt, usage_completion, usage_total, at=ai_msg.created_at)
+            if server_state:
+                db.session.flush()
+                # resposta cancelada/cacheada/com erro não é continuável: o próximo turno reconstrói
+                keep = state_provider and new_state_id and not cancel.cancelled and cached is None
+                conversation_state.save(chat, state_provider, new_state_id if keep else None, ai_msg.id)
             db.session.commit()
+            prompt_cache.record(used_model, usage_prompt, usage_cached)
             print(f"[MSG AI] Chat {chat.id} - Mensagem gerada: {generated_text[:50]} (ID {ai_msg.id})")
 
             # agora salva os anexos da IA (se houver)
@@ -842,9 +1294,21 @@ def generate_text():
         if response is not None:
             print(f"[Response gerado] {response}")
 
+        if stream_sink is not None and 'ai_msg' in locals():
+            stream_sink.finish(ai_msg.status, ai_msg.to_dict())
+
+        if new_chat_prompt:
+            enqueue_title(chat.id, new_chat_prompt, chat.title)
+
         return jsonify({
             "chat_id": chat.id,
             "chat_title": chat.title,
+            "title_pending": bool(new_chat_prompt),
+            "cached": cached is not None,
+            "generation_id": cancel.generation_id,
+            "message_id": placeholder.id if placeholder is not None else None,
+            "cancelled": cancel.cancelled,
+            "degraded": is_degraded(),
             "messages": [m.to_dict() for m in history] + [ai_msg.to_dict()] if 'ai_msg' in locals() else [m.to_dict() for m in history],
             "generated_text": response_text,
             "model_used": used_model,
@@ -856,6 +1320,214 @@ def generate_text():
         db.session.rollback()
         print(f"[EXCEPTION] {str(e)}")
         return jsonify({"error": str(e)}), 500
+@ai_generation_api.route("/generations/<string:generation_id>/cancel", methods=["POST"])
+@jwt_required()
+def cancel_generation(generation_id):
+    # a requisição original responde com o texto parcial e "cancelled": true
+    if not request_cancel(generation_id, get_jwt_identity()):
+        return jsonify({"error": "Geração não encontrada ou já finalizada"}), 404
+    return jsonify({"message": "Cancelamento solicitado", "generation_id": generation_id}), 202
+
+
+def _sse(event, data, event_id=None):
+    head = f"id: {event_id}\n" if event_id else ""
+    return f"{head}event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@ai_generation_api.route("/generations/<string:generation_id>/stream", methods=["GET"])
+@jwt_required()
+@admission_controlled("stream")
+def stream_generation(generation_id):
+    """
+    Deltas de uma geração retomável (SSE). O cliente reconecta com ?after=<id> ou
+    Last-Event-ID e recebe só o que perdeu; "done" traz a mensagem final.
+    """
+    message_id = message_for_generation(generation_id)
+    msg = ChatMessage.query.get(message_id) if message_id else None
+    if not msg or msg.chat.user_id != get_jwt_identity():
+        return jsonify({"error": "Geração não encontrada"}), 404
+
+    after = request.args.get("after") or request.headers.get("Last-Event-ID") or "0-0"
+    try:
+        exists = stream_exists(msg.id)
+    except redis.exceptions.RedisError:
+        exists = False
+    if not exists:
+        # stream expirado: o que ficou no banco é a versão final (ou o último checkpoint)
+        final = msg.to_dict()
+        body = _sse("delta", {"text": final["content"]}) + _sse("done", {"status": msg.status, "message": final})
+        return Response(body, mimetype="text/event-stream")
+
+    def stored_done():
+        db.session.refresh(msg)
+        return _sse("done", {"status": msg.status, "message": msg.to_dict()})
+
+    def events():
+        cursor = after
+        deadline = time.monotonic() + READ_DEADLINE_SECONDS
+        while True:
+            if time.monotonic() >= deadline:
+                # status "streaming" no done: a geração segue, o cliente reconecta com Last-Event-ID
+                yield stored_done()
+                return
+            try:
+                batch = read_events(msg.id, cursor)
+                if not batch and not stream_exists(msg.id):
+                    # stream expirou antes do "done"
+                    yield stored_done()
+                    return
+            except redis.exceptions.RedisError as e:
+                print(f"[WARN] Stream retomável indisponível: {e}")
+                yield stored_done()
+                return
+            if not batch:
+                db.session.refresh(msg)
+                if msg.status != "streaming":
+                    # mensagem já finalizada no banco (o "done" não chegou ao stream): vale o banco
+                    yield stored_done()
+                    return
+                yield ": keep-alive\n\n"
+                continue
+            for event_id, fields in batch:
+                cursor = event_id
+                kind = fields.get("event")
+                if kind == "done":
+                    data = {"status": fields.get("status"), "message": json.loads(fields.get("message") or "{}")}
+                    yield _sse("done", data, event_id)
+                    return
+                data = {"text": fields["text"]} if kind == "delta" else {}
+                yield _sse(kind, data, event_id)
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return Response(stream_with_context(events()), mimetype="text/event-stream", headers=headers)
+
+@ai_generation_api.route("/compare", methods=["POST"])
+@jwt_required()
+@admission_controlled("compare")
+@cost_limited("compare")
+@scheduled("compare")
+def compare_models():
+    """
+    Mesmo prompt em até MAX_COMPARE_MODELS modelos, em paralelo. O contexto é montado uma vez;
+    cada resposta vira uma mensagem da IA irmã (parent_id = mensagem do usuário).
+    Por padrão responde em SSE (delta/reset/done por modelo); com "stream": false, JSON no fim.
+    """
+    set_request_deadline()
+    data = request.get_json(silent=True) or {}
+    user_input = (data.get("input") or "").strip()
+    models = list(dict.fromkeys(m for m in (data.get("models") or []) if isinstance(m, str) and m))
+    chat_id = data.get("chat_id")
+    stream = data.get("stream", True) is not False
+    try:
+        temperature = float(data.get("temperature", 0.7))
+    except Exception:
+        temperature = 0.7
+
+    if not user_input:
+        return jsonify({"error": "Campo 'input' é obrigatório"}), 400
+    if not 2 <= len(models) <= MAX_COMPARE_MODELS:
+        return jsonify({"error": f"Informe de 2 a {MAX_COMPARE_MODELS} modelos para comparar"}), 400
+
+    user_id = get_jwt_identity()
+    user = User.query.get(user_id)
+    plan_name = (user.plan.name if user and user.plan else "").strip().lower()
+    if plan_name == "bot":
+        return jsonify({"error": "Plano Bot não permite geração de texto"}), 403
+    blocked = [m for m in models if not plan_allows_model(plan_name, m)]
+    if blocked:
+        return jsonify({"error": "Modelos não disponíveis no seu plano", "models": blocked}), 403
+
+    new_chat_prompt = None
+    chat = Chat.query.filter_by(id=chat_id, user_id=user_id).first() if chat_id else None
+    if chat is None:
+        new_chat_prompt = user_input
+        chat = Chat(user_id=user_id, title=provisional_title(user_input), supports_vision=False)
+        db.session.add(chat)
+        db.session.commit()
+
+    user_msg = ChatMessage(chat_id=chat.id, role=SenderType.USER.value, content=user_input, created_at=datetime.utcnow())
+    db.session.add(user_msg)
+    db.session.commit()
+
+    # contexto montado uma única vez para todos os modelos
+    history = without_extra_siblings(ChatMessage.query.filter_by(chat_id=chat.id).order_by(ChatMessage.created_at).all())
+    session_messages, _ = build_session_messages(history, chat.id, user_input)
+
+    env_keys = _get_env_keys()
+    events = queue.Queue()
+
+    def answer(model):
+        def run():
+            try:
+                events.put(("done", model, complete_text(model, session_messages, temperature, env_keys, plan_name, CompareSink(model, events))))
+            except Exception as e:
+                print(f"[ERROR] Comparação: {model} falhou: {e}")
+                events.put(("error", model, str(e)))
+        return run
+
+    # todos ao mesmo tempo: a latência total é a do modelo mais lento
+    run_dag({model: (answer(model), []) for model in models})
+
+    def save(model, result):
+        used_model, text, (p_tokens, c_tokens, t_tokens) = result
+        msg = ChatMessage(
+            chat_id=chat.id,
+            role=SenderType.AI.value,
+            content=text,
+            model_used=used_model,
+            temperature=None if uses_completion_tokens_for_openai(used_model) else temperature,
+            prompt_tokens=p_tokens,
+            completion_tokens=c_tokens,
+            total_tokens=t_tokens,
+            parent_id=user_msg.id,
+            created_at=datetime.utcnow()
+        )
+        db.session.add(msg)
+        record_usage(chat.user_id, used_model, p_tokens, c_tokens, t_tokens, at=msg.created_at)
+        db.session.commit()
+        return msg.to_dict()
+
+    def results():
+        pending = set(models)
+        while pending:
+            kind, model, payload = events.get()
+            if kind == "delta":
+                yield "delta", {"model": model, "text": payload}
+            elif kind == "reset":
+                yield "reset", {"model": model}
+            else:
+                pending.discard(model)
+                result = payload if kind == "done" else (model, "[Erro ao gerar resposta da IA]", (None, None, None))
+                try:
+                    message = save(model, result)
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"[ERROR] Falha ao salvar resposta da comparação ({model}): {e}")
+                    message = None
+                yield "done", {"model": model, "message": message, "error": payload if kind == "error" else None}
+        if new_chat_prompt:
+            enqueue_title(chat.id, new_chat_prompt, chat.title)
+
+    header = {
+        "chat_id": chat.id,
+        "chat_title": chat.title,
+        "title_pending": bool(new_chat_prompt),
+        "user_message": user_msg.to_dict(),
+        "models": models,
+    }
+
+    if not stream:
+        answers = [payload for kind, payload in results() if kind == "done"]
+        return jsonify({**header, "answers": answers}), 200
+
+    def events_stream():
+        yield _sse("start", header)
+        for kind, payload in results():
+            yield _sse(kind, payload)
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return Response(stream_with_context(events_stream()), mimetype="text/event-stream", headers=headers)
+
 # Mapeia proporção para tamanho da imagem baseado no modelo
 def map_size(model, ratio):
     size_map = {
@@ -881,6 +1553,40 @@ def map_aspectratio_gemini(ratio):
         "aspectRatio": ratio_map.get(ratio, "1:1"),
     }
 
+def render_image(model, prompt, ratio="1024x1024", quality="auto"):
+    """Gera uma imagem sem referências e salva em UPLOAD_DIR. Retorna (caminho, proporção final)."""
+    env_keys = _get_env_keys()
+    save_path = os.path.join(UPLOAD_DIR, f"{uuid.uuid4()}.png")
+    if model.startswith("imagen-"):
+        aspect_ratio = map_aspectratio_gemini(ratio)["aspectRatio"]
+        client = genai.Client(api_key=env_keys["GEMINI_API_KEY"])
+        response = call_provider("gemini", model, lambda _timeout: client.models.generate_images(
+            model=model,
+            prompt=prompt,
+            config=types.GenerateImagesConfig(number_of_images=1, aspect_ratio=aspect_ratio)
+        ))
+        response.generated_images[0].image.save(save_path)
+        return save_path, aspect_ratio
+
+    size = map_size(model, ratio)
+    client = OpenAI(api_key=env_keys["OPENAI_API_KEY"], max_retries=0)
+    kwargs = {"model": model, "prompt": prompt, "n": 1, "size": size}
+    if quality and quality != "auto":
+        kwargs["quality"] = quality
+    response = call_provider("openai", model, lambda _timeout: client.images.generate(**kwargs))
+    if getattr(response.data[0], "b64_json", None):
+        image_data = base64.b64decode(response.data[0].b64_json)
+    elif getattr(response.data[0], "url", None):
+        img_res = requests.get(response.data[0].url, timeout=60)
+        img_res.raise_for_status()
+        image_data = img_res.content
+    else:
+        raise RuntimeError("Resposta da API OpenAI não contém imagem válida")
+    with open(save_path, "wb") as f:
+        f.write(image_data)
+    return save_path, size
+
+
 
 def _describe_reference_image_gemini(client, image_path: str) -> str:
     """Gera descrição concisa da imagem de referência para guiar identidade/estilo."""
@@ -897,10 +1603,10 @@ def _describe_reference_image_gemini(client, image_path: str) -> str:
                 " cabelo, acessórios, iluminação e plano de fundo."
             ),
         ]
-        resp = client.models.generate_content(
+        resp = call_provider("gemini", "gemini-2.5-flash", lambda _timeout: client.models.generate_content(
             model="gemini-2.5-flash",
             contents=contents,
-        )
+        ))
         return (resp.text or "").strip()
     except Exception as e:
         print(f"[WARN] Falha ao descrever imagem de referência: {e}")
@@ -908,7 +1614,12 @@ def _describe_reference_image_gemini(client, image_path: str) -> str:
 
 @ai_generation_api.route("/generate-image", methods=["POST"])
 @jwt_required()
+@admission_controlled("image")
+@idempotent("image")
+@cost_limited("image")
+@scheduled("image")
 def generate_image():
+    set_request_deadline()
     # lê chaves atualizadas do ambiente
     env_keys = _get_env_keys()
     OPENAI_API_KEY = env_keys["OPENAI_API_KEY"]
@@ -949,6 +1660,7 @@ def generate_image():
         style = request.form.get("style", "auto")
         ratio = request.form.get("ratio", "1024:1024")
         quality = request.form.get("quality", "auto")
+        use_cache = request.form.get("cache", "").lower() in ("1", "true")
         
         # Processa imagens de referência se enviadas (até 2)
         reference_image_files = request.files.getlist("reference_image")
@@ -970,6 +1682,11 @@ def generate_image():
         style = data.get("style", "auto")
         ratio = data.get("ratio", "1024:1024")
         quality = data.get("quality", "auto")
+        use_cache = bool(data.get("cache"))
+
+    if is_degraded():
+        model = degraded_model("image", model)
+        quality = "low"
 
     if not prompt:
         return jsonify({"error": "Prompt é obrigatório"}), 400
@@ -983,13 +1700,27 @@ def generate_image():
     else:
         final_prompt = prompt
 
+    # cache exato (opt-in) para o mesmo prompt/estilo/proporção/qualidade, sem imagens de referência
+    cache_key = None
+    cached = None
+    if not reference_image_paths and response_cache.should_use("image", use_cache, None, user):
+        cache_key = response_cache.cache_key("image", model, [final_prompt], style=style, ratio=ratio, quality=quality)
+        cached = response_cache.get(cache_key)
+        if cached is not None and not os.path.exists(cached["file_path"]):
+            cached = None
+
     try:
         os.makedirs(UPLOAD_DIR, exist_ok=True)
         filename = f"{uuid.uuid4()}.png"
         save_path = os.path.join(UPLOAD_DIR, filename)
-        if not model.startswith("imagen-"):
+        if cached is not None:
+            # cópia própria do arquivo: cada conteúdo gerado continua dono do seu arquivo
+            shutil.copyfile(cached["file_path"], save_path)
+            final_ratio = cached["ratio"]
+            print(f"[INFO] Imagem servida do cache ({cache_key[:16]}...)")
+        elif not model.startswith("imagen-"):
             size = map_size(model, ratio)
-            client = OpenAI(api_key=OPENAI_API_KEY)
+            client = OpenAI(api_key=OPENAI_API_KEY, max_retries=0)
             kwargs = {
                 "model": model,
                 "prompt": final_prompt,
@@ -1022,27 +1753,27 @@ def generate_image():
                     ]
                     
                     # Usa chat completions com visão em vez de images.generate
-                    response = client.chat.completions.create(
+                    response = call_provider("openai", model, lambda _timeout: client.chat.completions.create(
                         model=model,
                         messages=messages,
                         max_tokens=1000
-                    )
+                    ))
                     
                     # Extrai descrição da imagem gerada pelo modelo
                     image_description = response.choices[0].message.content
                     
                     # Gera imagem baseada na descrição
                     kwargs["prompt"] = f"Based on the reference image, generate: {image_description}"
-                    response = client.images.generate(**kwargs)
+                    response = call_provider("openai", model, lambda _timeout: client.images.generate(**kwargs))
                     
                 except Exception as e:
                     print(f"[WARN] Falha ao usar imagem de referência com {model}: {e}")
                     # Fallback para geração normal sem imagem
                     kwargs["prompt"] = final_prompt
-                    response = client.images.generate(**kwargs)
+                    response = call_provider("openai", model, lambda _timeout: client.images.generate(**kwargs))
             else:
                 # Geração normal sem imagem de referência
-                response = client.images.generate(**kwargs)
+                response = call_provider("openai", model, lambda _timeout: client.images.generate(**kwargs))
 
             if hasattr(response.data[0], "b64_json") and response.data[0].b64_json:
                 image_data = base64.b64decode(response.data[0].b64_json)
@@ -1076,18 +1807,21 @@ def generate_image():
                 else:
                     final_prompt = "Use as mesmas pessoas das imagens de referência. " + final_prompt
 
-            response = gemini_client.models.generate_images(
+            response = call_provider("gemini", model, lambda _timeout: gemini_client.models.generate_images(
                 model=model,
                 prompt=final_prompt,
                 config=types.GenerateImagesConfig(
                     number_of_images=1,
                     aspect_ratio=config_map["aspectRatio"],
                 )
-            )
+            ))
             generated_image = response.generated_images[0].image
             generated_image.save(save_path)
             final_ratio = config_map["aspectRatio"]
-            
+
+        if cache_key and cached is None:
+            response_cache.put(cache_key, {"file_path": save_path, "ratio": final_ratio})
+
         # Salva no banco
         generated = GeneratedImageContent(
             user_id=user.id,
@@ -1102,9 +1836,14 @@ def generate_image():
 
         return jsonify({
             "message": "Imagem gerada com sucesso",
-            "content": generated.to_dict()
+            "content": generated.to_dict(),
+            "cached": cached is not None
         }), 201
 
+    except ProviderBusyError as e:
+        db.session.rollback()
+        refund_current_request()
+        return busy_response(e)
     except Exception as e:
         db.session.rollback()
         error_msg = str(e)
@@ -10,6 +10,11 @@ from flask_jwt_extended import jwt_required, get_jwt_identity
 from extensions import db
 from models.generated_content import GeneratedVideoContent
 from models.user import User
+from utils import cost_limited, idempotent, scheduled, admission_controlled
+from utils.admission import degraded_model
+from utils.retry import call_provider, set_request_deadline
+from utils.provider_limits import ProviderBusyError, busy_response
+from utils.rate_limit import refund_current_request
 from google import genai
 from google.genai import types
 from dotenv import load_dotenv
@@ -47,10 +52,10 @@ def _describe_reference_image(client, image_path: str) -> str:
             types.Part.from_bytes(data=image_bytes, mime_type=mime_type),
             prompt,
         ]
-        resp = client.models.generate_content(
+        resp = call_provider("gemini", "gemini-2.5-flash", lambda _timeout: client.models.generate_content(
             model="gemini-2.5-flash",
             contents=contents,
-        )
+        ))
         return (resp.text or "").strip()
     except Exception as e:
         print(f"[WARN] Falha ao descrever imagem de referência: {e}")
@@ -58,7 +63,12 @@ def _describe_reference_image(client, image_path: str) -> str:
 
 @ai_generation_video_api.route("/generate-video", methods=["POST"])
 @jwt_required()
+@admission_controlled("video")
+@idempotent("video")
+@cost_limited("video")
+@scheduled("video")
 def generate_video():
+    set_request_deadline()
     current_user_id = get_jwt_identity()
     user = User.query.get(current_user_id)
     if not user:
@@ -98,6 +108,9 @@ def generate_video():
         model_used = data.get("model_used", "veo-3.0-fast-generate-001")
         aspect_ratio = data.get("ratio", "16:9")
 
+    # sobrecarga: plano Grátis vai para o modelo rápido (utils/admission.py)
+    model_used = degraded_model("video", model_used)
+
     if not prompt and not reference_image_path:
         return jsonify({"error": "Campo 'prompt' ou imagem de referência é obrigatório"}), 400
 
@@ -130,11 +143,11 @@ def generate_video():
         print(f"[DEBUG] Gerando vídeo com modelo {model_used}, ratio {aspect_ratio}...")
 
         # Cria operação assíncrona (API não aceita reference_image direto)
-        operation = client_gemini.models.generate_videos(
+        operation = call_provider("gemini", model_used, lambda _timeout: client_gemini.models.generate_videos(
             model=model_used,
             prompt=final_prompt,
             config=types.GenerateVideosConfig(aspect_ratio=aspect_ratio),
-        )
+        ))
 
         # Aguarda conclusão da operação
         while not operation.done:
@@ -164,6 +177,10 @@ def generate_video():
             "video": video_entry.to_dict()
         }), 201
 
+    except ProviderBusyError as e:
+        db.session.rollback()
+        refund_current_request()
+        return busy_response(e)
     except Exception as e:
         db.session.rollback()
         print("Erro ao gerar vídeo:", str(e))
@@ -0,0 +1,156 @@
+import os
+from flask import Blueprint, request, jsonify, current_app
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from extensions import db
+from models import User, PlanFeature, Feature, BatchJob, BatchItem
+from utils import idempotent, admission_controlled
+from utils.rate_limit import charge_batch
+from utils.batch_jobs import MAX_ITEMS, ACTIVE_STATUSES, parse_prompts, create_job, cancel_job, start_batch_worker
+from routes.ai_generation_api import plan_allows_model
+
+batch_api = Blueprint("batch_api", __name__)
+
+IMAGE_MODELS = ("gpt-image-1", "dall-e-2", "dall-e-3", "imagen-4.0-generate-001", "imagen-4.0-fast-generate-001")
+# Lotes ainda em andamento por usuário
+MAX_ACTIVE_JOBS = int(os.getenv("BATCH_MAX_ACTIVE_JOBS", 3))
+
+@batch_api.before_request
+def skip_jwt_for_options():
+    if request.method == "OPTIONS":
+        return "", 200
+
+def plan_feature(user, key):
+    if not user or not user.plan_id:
+        return None
+    return (
+        db.session.query(PlanFeature.value)
+        .join(Feature, Feature.id == PlanFeature.feature_id)
+        .filter(PlanFeature.plan_id == user.plan_id, Feature.key == key)
+        .scalar()
+    )
+
+def plan_batch_limit(user):
+    """Itens por lote permitidos pelo plano (feature batch_max_items); 0 = sem lotes."""
+    value = plan_feature(user, "batch_max_items")
+    try:
+        return min(int(value), MAX_ITEMS)
+    except (TypeError, ValueError):
+        return 0
+
+# Cria um lote: multipart com "file" (.txt/.csv/.jsonl) ou JSON com "prompts"
+@batch_api.route("/", methods=["POST"])
+@jwt_required()
+@admission_controlled("batch")
+@idempotent("batch")
+def create_batch():
+    user = User.query.get(get_jwt_identity())
+    if not user:
+        return jsonify({"error": "Usuário inválido"}), 403
+
+    if (request.content_type or "").startswith("multipart/form-data"):
+        data = request.form
+        upload = request.files.get("file")
+        if not upload or not upload.filename:
+            return jsonify({"error": "Envie o arquivo de prompts no campo 'file'"}), 400
+        try:
+            prompts = parse_prompts(upload.filename, upload.read())
+        except (ValueError, UnicodeDecodeError) as e:
+            return jsonify({"error": f"Arquivo de prompts inválido: {e}"}), 400
+    else:
+        data = request.get_json(silent=True) or {}
+        prompts = [str(p).strip() for p in (data.get("prompts") or []) if str(p).strip()]
+
+    kind = data.get("kind", "text")
+    model = data.get("model") or ("gpt-4o" if kind == "text" else "gpt-image-1")
+    if kind not in ("text", "image"):
+        return jsonify({"error": "kind deve ser 'text' ou 'image'"}), 400
+    if not prompts:
+        return jsonify({"error": "Nenhum prompt encontrado"}), 400
+
+    limit = plan_batch_limit(user)
+    if limit <= 0:
+        return jsonify({"error": "Seu plano não permite geração em lote"}), 403
+    if len(prompts) > limit:
+        return jsonify({"error": f"Máximo de {limit} prompts por lote no seu plano", "limit": limit}), 400
+
+    plan_name = (user.plan.name if user.plan else "").strip().lower()
+    if kind == "text" and not plan_allows_model(plan_name, model):
+        return jsonify({"error": "Modelo não disponível no seu plano"}), 403
+    if kind == "image" and model not in IMAGE_MODELS:
+        return jsonify({"error": "Modelo de imagem não suportado em lote", "allowed_models": list(IMAGE_MODELS)}), 400
+    # mesmas regras de /generate-image
+    if kind == "image" and (plan_name == "bot" or str(plan_feature(user, "generate_image")).lower() != "true"):
+        return jsonify({"error": "Seu plano não permite geração de imagem"}), 403
+
+    active = BatchJob.query.filter(BatchJob.user_id == user.id, BatchJob.status.in_(ACTIVE_STATUSES)).count()
+    if active >= MAX_ACTIVE_JOBS:
+        return jsonify({
+            "error": f"Máximo de {MAX_ACTIVE_JOBS} lotes em andamento. Aguarde a conclusão ou cancele um lote.",
+            "limit": MAX_ACTIVE_JOBS,
+        }), 429
+
+    try:
+        temperature = float(data.get("temperature", 0.7))
+    except (TypeError, ValueError):
+        temperature = 0.7
+    params = {"temperature": temperature} if kind == "text" else {
+        "style": data.get("style", "auto"),
+        "ratio": data.get("ratio", "1024x1024"),
+        "quality": data.get("quality", "auto"),
+    }
+
+    # custo ponderado pelos itens, na janela de lotes do rate limit (utils/rate_limit.py)
+    limited = charge_batch(user, kind, len(prompts))
+    if limited is not None:
+        return limited
+
+    job = create_job(user.id, kind, model, prompts, params)
+    return jsonify(job.to_dict()), 202
+
+@batch_api.route("/", methods=["GET"])
+@jwt_required()
+def list_batches():
+    jobs = (
+        BatchJob.query.filter_by(user_id=get_jwt_identity())
+        .order_by(BatchJob.created_at.desc())
+        .limit(100)
+        .all()
+    )
+    return jsonify([j.to_dict() for j in jobs]), 200
+
+# Status do lote; ?items=1 inclui os itens paginados (page/per_page) com o id do conteúdo gerado
+@batch_api.route("/<string:job_id>", methods=["GET"])
+@jwt_required()
+def get_batch(job_id):
+    job = BatchJob.query.filter_by(id=job_id, user_id=get_jwt_identity()).first()
+    if not job:
+        return jsonify({"error": "Lote não encontrado"}), 404
+    # o worker sobe com o app (main.py); aqui só garante que continua vivo
+    start_batch_worker(current_app._get_current_object())
+
+    data = job.to_dict()
+    if request.args.get("items"):
+        try:
+            page = max(int(request.args.get("page", 1)), 1)
+            per_page = min(max(int(request.args.get("per_page", 100)), 1), 500)
+        except ValueError:
+            return jsonify({"error": "page/per_page inválidos"}), 400
+        items = (
+            BatchItem.query.filter_by(job_id=job.id)
+            .order_by(BatchItem.position)
+            .offset((page - 1) * per_page)
+            .limit(per_page)
+            .all()
+        )
+        data.update({"items": [it.to_dict() for it in items], "page": page, "per_page": per_page})
+    return jsonify(data), 200
+
+@batch_api.route("/<string:job_id>/cancel", methods=["POST"])
+@jwt_required()
+def cancel_batch(job_id):
+    job = BatchJob.query.filter_by(id=job_id, user_id=get_jwt_identity()).first()
+    if not job:
+        return jsonify({"error": "Lote não encontrado"}), 404
+    if not cancel_job(job):
+        return jsonify({"error": "Lote já finalizado", "status": job.status}), 409
+    return jsonify(job.to_dict()), 200
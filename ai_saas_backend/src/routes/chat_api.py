@@ -2,6 +2,8 @@ from flask import Blueprint, request, jsonify, send_file
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from extensions import db
 from models.chat import Chat, ChatMessage, ChatAttachment
+from utils import delete_chats
+from utils.chat_titles import title_pending
 from datetime import datetime
 from sqlalchemy.orm import joinedload
 import os
@@ -78,6 +80,19 @@ def get_chat(chat_id):
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@chat_api.route("/<string:chat_id>/title", methods=["GET"])
+@jwt_required()
+def get_chat_title(chat_id):
+    # polling do título definitivo gerado em segundo plano após a criação do chat
+    try:
+        user_id = get_jwt_identity()
+        chat = Chat.query.filter_by(id=chat_id, user_id=user_id).first()
+        if not chat:
+            return jsonify({"error": "Chat não encontrado"}), 404
+        return jsonify({"chat_id": chat.id, "title": chat.title, "pending": title_pending(chat.id)})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 @chat_api.route("/<string:chat_id>", methods=["PUT"])
 @jwt_required()
 def update_chat(chat_id):
@@ -133,11 +148,9 @@ def unarchive_chat(chat_id):
 def delete_chat(chat_id):
     try:
         user_id = get_jwt_identity()
-        chat = Chat.query.filter_by(id=chat_id, user_id=user_id).first()
-        if not chat:
+        # DELETEs em lote (anexos -> mensagens -> chat), sem carregar o histórico no ORM
+        if not delete_chats(user_id, [chat_id]):
             return jsonify({"error": "Chat não encontrado"}), 404
-        db.session.delete(chat)
-        db.session.commit()
         return jsonify({"message": "Chat deletado com sucesso"})
     except Exception as e:
         db.session.rollback()
@@ -1,6 +1,7 @@
 from flask import Blueprint, request, jsonify
 from extensions import jwt_required, get_jwt_identity
 from models.user import User
+from utils import cost_limited
 import asyncio
 import sys
 from pathlib import Path
@@ -218,6 +219,7 @@ def get_status():
 
 @download_api.route("/process", methods=["POST"])
 @jwt_required()
+@cost_limited("download")
 def process_download():
     """
     Processa um link do Freepik/Envato e retorna o link do Google Drive
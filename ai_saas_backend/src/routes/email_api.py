@@ -3,37 +3,19 @@ from extensions import (
     jwt_required, get_jwt_identity, redis_client
 )
 from models import User
-from dotenv import load_dotenv
-import uuid, re, os, smtplib
+from utils.email_outbox import enqueue_email
+import uuid, re
 from datetime import timedelta
-from email.mime.text import MIMEText
 
 email_api = Blueprint("email_api", __name__)
 
-load_dotenv()
-
-EMAIL_USER = os.getenv("EMAIL_USER")
-EMAIL_PASS = os.getenv("EMAIL_PASS")
-SMTP_SERVER = os.getenv("SMTP_SERVER", "smtp.gmail.com")
-SMTP_PORT = int(os.getenv("SMTP_PORT", 465))
-
+# Os envios vão para a outbox (utils/email_outbox.py); um worker entrega via SMTP
 def send_verification_email(email, code):
-    if not EMAIL_USER or not EMAIL_PASS:
-        print("Erro ao enviar email: credenciais SMTP não configuradas")
-        return False
-    msg = MIMEText(f"Seu código de verificação é: {code}")
-    msg["Subject"] = "Código de verificação - AI SaaS"
-    msg["From"] = EMAIL_USER
-    msg["To"] = email
-
-    try:
-        with smtplib.SMTP_SSL(SMTP_SERVER, SMTP_PORT) as server:
-            server.login(EMAIL_USER, EMAIL_PASS)
-            server.sendmail(EMAIL_USER, [email], msg.as_string())
-        return True
-    except Exception as e:
-        print("Erro ao enviar email:", e)
-        return False
+    return enqueue_email(
+        email,
+        "Código de verificação - AI SaaS",
+        f"Seu código de verificação é: {code}",
+    )
 
 # Rota para solicitar código de verificação de email (para cadastro)
 @email_api.route("/request-email-code", methods=["POST"])
@@ -119,22 +101,9 @@ def verify_security_code():
     return jsonify({"message": "Código verificado com sucesso"}), 200
 
 def send_reset_password_email(to_email, link):
-    if not EMAIL_USER or not EMAIL_PASS:
-        print("Erro ao enviar email de redefinição: credenciais SMTP não configuradas")
-        return False
-    msg = MIMEText(
+    return enqueue_email(
+        to_email,
+        "Redefinição de Senha",
         f"Olá,\n\nClique no link abaixo para redefinir sua senha. Esse link expira em 1 hora.\n\n{link}\n\n"
-        "Se você não solicitou essa redefinição, ignore esse email."
+        "Se você não solicitou essa redefinição, ignore esse email.",
     )
-    msg["Subject"] = "Redefinição de Senha"
-    msg["From"] = EMAIL_USER
-    msg["To"] = to_email
-
-    try:
-        with smtplib.SMTP_SSL(SMTP_SERVER, SMTP_PORT) as server:
-            server.login(EMAIL_USER, EMAIL_PASS)
-            server.send_message(msg)
-        return True
-    except Exception as e:
-        print(f"Erro ao enviar email de redefinição: {e}")
-        return False
\ No newline at end of file
@@ -7,6 +7,7 @@ from models import (
     GeneratedVideoContent,
     User
 )
+from utils import delete_contents
 import os
 
 generated_content_api = Blueprint("generated_content_api", __name__)
@@ -124,15 +125,14 @@ def get_generated_content(content_id):
 @jwt_required()
 def delete_generated_content(content_id):
     current_user_id = get_jwt_identity()
-    content = GeneratedContent.query.get(content_id)
+    owner_id = db.session.query(GeneratedContent.user_id).filter_by(id=content_id).scalar()
 
-    if not content:
+    if not owner_id:
         return jsonify({"error": "Conteúdo não encontrado"}), 404
-    if content.user_id != current_user_id:
+    if owner_id != current_user_id:
         return jsonify({"error": "Acesso negado"}), 403
 
-    db.session.delete(content)
-    db.session.commit()
+    delete_contents(current_user_id, [content_id])
     return jsonify({"message": "Conteúdo deletado com sucesso"}), 200
 
 @generated_content_api.route("/batch", methods=["DELETE"])
@@ -144,19 +144,13 @@ def delete_batch_contents():
     if not ids:
         return jsonify({"error": "Nenhum ID enviado"}), 400
 
-    contents = GeneratedContent.query.filter(
-        GeneratedContent.id.in_(ids),
-        GeneratedContent.user_id == current_user_id
-    ).all()
+    # DELETE em lote direto no banco; arquivos vão para a fila de remoção assíncrona
+    deleted = delete_contents(current_user_id, ids)
 
-    if not contents:
+    if not deleted:
         return jsonify({"error": "Nenhum conteúdo válido encontrado"}), 404
 
-    for c in contents:
-        db.session.delete(c)
-
-    db.session.commit()
-    return jsonify({"message": f"{len(contents)} conteúdos deletados com sucesso"}), 200
+    return jsonify({"message": f"{deleted} conteúdos deletados com sucesso"}), 200
 
 @generated_content_api.route("/images/<string:content_id>", methods=["GET"])
 @jwt_required()
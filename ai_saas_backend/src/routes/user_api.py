@@ -1,9 +1,7 @@
 from flask import Blueprint, request, jsonify
 from extensions import bcrypt, db, jwt_required, get_jwt_identity
-from models import (
-    User, Chat, ChatMessage, ChatAttachment,
-    Project, GeneratedContent, Notification
-)
+from models import User
+from utils import delete_user_account, get_deletion_job
 from dotenv import load_dotenv
 import re
 
@@ -108,48 +106,31 @@ def delete_user(user_id):
         return jsonify({"error": "Usuário não encontrado"}), 404
 
     try:
-        # ============================
-        # Deletar chats, mensagens e attachments
-        # ============================
-        for chat in user.chats:
-            for message in chat.messages:
-                for attachment in message.attachments:
-                    db.session.delete(attachment)
-                db.session.delete(message)
-            db.session.delete(chat)
-
-        # ============================
-        # Deletar projects e associações com generated contents
-        # ============================
-        for project in user.projects:
-            project.contents = []  # remove associações
-            db.session.delete(project)
-
-        # ============================
-        # Deletar generated contents
-        # ============================
-        for content in user.generated_contents:
-            content.projects = []  # remove associações
-            db.session.delete(content)
-
-        # ============================
-        # Deletar notifications
-        # ============================
-        for notification in user.notifications:
-            db.session.delete(notification)
-
-        # ============================
-        # Deletar usuário
-        # ============================
-        db.session.delete(user)
-        db.session.commit()
-
-        return jsonify({"message": "Usuário excluído com sucesso"}), 200
-
+        # DELETEs em lote, em ordem de dependência; contas grandes viram job em segundo plano
+        job_id = delete_user_account(user.id)
     except Exception as e:
         db.session.rollback()
         return jsonify({"error": "Erro ao excluir usuário", "details": str(e)}), 500
 
+    if job_id:
+        return jsonify({
+            "message": "Exclusão do usuário agendada",
+            "job_id": job_id
+        }), 202
+    return jsonify({"message": "Usuário excluído com sucesso"}), 200
+
+# Status de um job de exclusão de conta
+@user_api.route("/deletion-jobs/<job_id>", methods=["GET"])
+@jwt_required()
+def get_user_deletion_job(job_id):
+    current_user = User.query.get(get_jwt_identity())
+    job = get_deletion_job(job_id)
+    if not job:
+        return jsonify({"error": "Job não encontrado"}), 404
+    if current_user and current_user.role != "admin" and job.get("user_id") != current_user.id:
+        return jsonify({"error": "Acesso negado"}), 403
+    return jsonify({"job_id": job_id, **job}), 200
+
 # Dados do usuário logado
 @user_api.route("/me", methods=["GET"])
 @jwt_required()
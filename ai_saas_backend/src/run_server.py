@@ -1,6 +1,10 @@
 from waitress import serve
 from main import app  # importa seu Flask app
+from utils.admission import SERVER_THREADS
 
 if __name__ == "__main__":
-    # Serve em 0.0.0.0 para aceitar conexões externas
-    serve(app, host="0.0.0.0", port=8000)
+    # Serve em 0.0.0.0 para aceitar conexões externas.
+    # channel_request_lookahead habilita environ["waitress.client_disconnected"],
+    # usado para cancelar gerações quando o cliente fecha a conexão.
+    # threads: parte fica reservada para health/CRUD (ver utils/admission.py)
+    serve(app, host="0.0.0.0", port=8000, channel_request_lookahead=5, threads=SERVER_THREADS)
@@ -1,9 +1,26 @@
 from .decorators import admin_required
 from .utils import add_token_to_blacklist, check_if_token_revoked, create_default_plans
+from .usage import record_usage, rebuild_usage_rollups
+from .deletion import delete_user_account, delete_chats, delete_messages, delete_contents, get_deletion_job
+from .rate_limit import cost_limited
+from .idempotency import idempotent
+from .scheduler import scheduled
+from .admission import admission_controlled
 
 __all__ = [
     "admin_required",
     "add_token_to_blacklist",
     "check_if_token_revoked",
-    "create_default_plans"
+    "create_default_plans",
+    "record_usage",
+    "rebuild_usage_rollups",
+    "delete_user_account",
+    "delete_chats",
+    "delete_messages",
+    "delete_contents",
+    "get_deletion_job",
+    "cost_limited",
+    "idempotent",
+    "scheduled",
+    "admission_controlled",
 ]
\ No newline at end of file
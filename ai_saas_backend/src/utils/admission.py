@@ -0,0 +1,155 @@
+import os, json, time, threading
+from functools import wraps
+from flask import jsonify, make_response, g, has_app_context, Response
+from flask_jwt_extended import get_jwt_identity
+from models import User
+from utils.metrics import incr
+
+# Threads do waitress (run_server.py). As RESERVED_THREADS nunca são ocupadas por geração,
+# então health e CRUD continuam respondendo mesmo com os provedores lentos.
+SERVER_THREADS = int(os.getenv("WAITRESS_THREADS", 16))
+RESERVED_THREADS = int(os.getenv("RESERVED_THREADS", 4))
+MAX_IN_FLIGHT = int(os.getenv("GENERATION_MAX_IN_FLIGHT", max(1, SERVER_THREADS - RESERVED_THREADS)))
+
+# Acima disso o plano Grátis vai para modelos mais baratos/rápidos
+DEGRADE_IN_FLIGHT = int(os.getenv("GENERATION_DEGRADE_IN_FLIGHT", max(1, int(MAX_IN_FLIGHT * 0.6))))
+DEGRADE_QUEUE_SECONDS = float(os.getenv("GENERATION_DEGRADE_QUEUE_SECONDS", 3))
+# Espera média na fila de geração a partir da qual novas gerações são recusadas
+REJECT_QUEUE_SECONDS = float(os.getenv("GENERATION_REJECT_QUEUE_SECONDS", 10))
+RETRY_AFTER_SECONDS = int(os.getenv("GENERATION_RETRY_AFTER", 10))
+# Suavização da média móvel da espera na fila (0..1, maior = reage mais rápido).
+# Sem novas amostras (ex.: tudo sendo recusado) ela decai pela metade a cada HALF_LIFE.
+QUEUE_WAIT_ALPHA = 0.2
+QUEUE_WAIT_HALF_LIFE = float(os.getenv("GENERATION_QUEUE_WAIT_HALF_LIFE", 5))
+
+# Operações que só seguram uma thread (leitores SSE de /generations/<id>/stream): contam no
+# mesmo orçamento MAX_IN_FLIGHT, mas não são recusadas pela fila lenta nem degradadas
+THREAD_ONLY_OPERATIONS = ("stream",)
+
+# Modelo usado para o plano Grátis em degradação (imagem também cai para qualidade "low")
+DEFAULT_DEGRADED_MODELS = {
+    "text": "claude-haiku-4-5",
+    "image": "gpt-image-1",
+    "video": "veo-3.0-fast-generate-001",
+}
+DEGRADED_MODELS = {**DEFAULT_DEGRADED_MODELS, **json.loads(os.getenv("DEGRADED_MODELS", "{}") or "{}")}
+
+FREE_PLAN_NAMES = ("grátis", "gratis")
+
+_lock = threading.Lock()
+_in_flight = 0
+_queue_wait = 0.0
+_queue_wait_at = time.monotonic()
+
+
+def _decayed_queue_wait(now):
+    return _queue_wait * 0.5 ** ((now - _queue_wait_at) / QUEUE_WAIT_HALF_LIFE)
+
+
+def record_queue_wait(seconds):
+    """Alimenta a média móvel da espera na fila de geração (chamado pelo scheduler)."""
+    global _queue_wait, _queue_wait_at
+    with _lock:
+        now = time.monotonic()
+        current = _decayed_queue_wait(now)
+        _queue_wait = current + QUEUE_WAIT_ALPHA * (seconds - current)
+        _queue_wait_at = now
+
+
+def admission_state():
+    with _lock:
+        in_flight, queue_wait = _in_flight, _decayed_queue_wait(time.monotonic())
+    if in_flight >= MAX_IN_FLIGHT or queue_wait >= REJECT_QUEUE_SECONDS:
+        level = "shed"
+    elif in_flight >= DEGRADE_IN_FLIGHT or queue_wait >= DEGRADE_QUEUE_SECONDS:
+        level = "degrade"
+    else:
+        level = "ok"
+    return {
+        "level": level,
+        "in_flight": in_flight,
+        "max_in_flight": MAX_IN_FLIGHT,
+        "queue_wait_seconds": round(queue_wait, 2),
+    }
+
+
+def _try_enter():
+    global _in_flight
+    with _lock:
+        if _in_flight >= MAX_IN_FLIGHT:
+            return False
+        _in_flight += 1
+        return True
+
+
+def _leave():
+    global _in_flight
+    with _lock:
+        _in_flight -= 1
+
+
+def is_degraded():
+    return has_app_context() and bool(getattr(g, "admission_degraded", False))
+
+
+def degraded_model(operation, model):
+    """Modelo a usar nesta requisição: o pedido, ou o substituto barato se degradada."""
+    if is_degraded() and DEGRADED_MODELS.get(operation):
+        replacement = DEGRADED_MODELS[operation]
+        if replacement != model:
+            print(f"[INFO] Admissão degradada: {model} -> {replacement}")
+        return replacement
+    return model
+
+
+def hold_until_closed(resp, callback):
+    """
+    Respostas em stream continuam gerando depois que a view retorna: nesse caso `callback`
+    (liberar vaga/contador) só roda quando o stream fecha. Retorna True se adiou.
+    """
+    if isinstance(resp, Response) and resp.is_streamed:
+        resp.call_on_close(callback)
+        return True
+    return False
+
+
+def _overloaded():
+    resp = make_response(jsonify({
+        "error": "Serviço sobrecarregado. Tente novamente em instantes.",
+        "retry_after": RETRY_AFTER_SECONDS,
+    }), 503)
+    resp.headers["Retry-After"] = str(RETRY_AFTER_SECONDS)
+    return resp
+
+
+def admission_controlled(operation):
+    """
+    Controle de admissão das rotas de geração (por processo): recusa cedo com 503 quando
+    há gerações demais em andamento ou a fila está lenta, e degrada o plano Grátis antes disso.
+    Usar logo abaixo de @jwt_required().
+    """
+
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            state = admission_state()
+            thread_only = operation in THREAD_ONLY_OPERATIONS
+            if (state["level"] == "shed" and not thread_only) or not _try_enter():
+                incr("admission_rejected", operation=operation)
+                return _overloaded()
+            deferred = False
+            try:
+                if state["level"] == "degrade" and not thread_only:
+                    user = User.query.get(get_jwt_identity())
+                    plan_name = (user.plan.name if user and user.plan else "").strip().lower()
+                    if plan_name in FREE_PLAN_NAMES:
+                        g.admission_degraded = True
+                        incr("admission_degraded", operation=operation)
+                resp = fn(*args, **kwargs)
+                deferred = hold_until_closed(resp, _leave)
+                return resp
+            finally:
+                if not deferred:
+                    _leave()
+        return wrapper
+    return decorator
@@ -0,0 +1,30 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from extensions import db
+
+# Pool compartilhado para trabalho fora do ciclo da requisição (jobs, filas, limpezas)
+_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("BACKGROUND_WORKERS", 4)),
+    thread_name_prefix="background",
+)
+
+
+def run_in_background(fn, *args, **kwargs):
+    """
+    Agenda fn(*args, **kwargs) no pool de fundo, dentro do app context da aplicação atual.
+    Deve ser chamada de dentro de uma requisição ou app context. Retorna o Future.
+    """
+    app = current_app._get_current_object()
+
+    def runner():
+        with app.app_context():
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                print(f"[BACKGROUND] Falha em {getattr(fn, '__name__', fn)}: {e}")
+                raise
+            finally:
+                db.session.remove()
+
+    return _executor.submit(runner)
@@ -0,0 +1,578 @@
+import os, io, csv, json, uuid, threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+import redis
+import requests
+from flask import current_app
+from sqlalchemy import insert, update
+from extensions import db, redis_client
+from models import User, BatchJob, BatchItem, GeneratedContent, GeneratedTextContent, GeneratedImageContent
+from utils.retry import call_provider
+from utils.model_router import provider_of
+from utils.usage import record_usage
+from utils import prompt_cache
+
+# Limite absoluto de itens por lote (o plano define o seu via feature batch_max_items)
+MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", 1000))
+# Intervalo entre consultas aos lotes enviados aos provedores
+POLL_SECONDS = float(os.getenv("BATCH_POLL_SECONDS", 30))
+# Itens simultâneos no modo pool (cada chamada ainda passa pelo provider_slot/token bucket)
+POOL_WORKERS = int(os.getenv("BATCH_POOL_WORKERS", 4))
+# Jobs do modo pool rodando ao mesmo tempo neste processo (fora do laço de consulta)
+POOL_JOBS = int(os.getenv("BATCH_POOL_JOBS", 2))
+# Resultados gravados por commit (INSERT/UPDATE em lote)
+WRITE_CHUNK = 100
+MAX_TOKENS = int(os.getenv("BATCH_MAX_TOKENS", 1024))
+# Bases configuráveis: apontar para um stand-in local em testes/homologação
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com").rstrip("/")
+ANTHROPIC_BASE_URL = os.getenv("ANTHROPIC_BASE_URL", "https://api.anthropic.com").rstrip("/")
+
+LOCK_KEY = "batch:lock:{}"
+LOCK_SECONDS = 300
+# O dono renova o lock nesse intervalo enquanto o job roda (qualquer que seja a duração dos itens)
+HEARTBEAT_SECONDS = LOCK_SECONDS / 5
+ACTIVE_STATUSES = ("queued", "submitted", "running")
+
+
+class BatchFailed(Exception):
+    """O provedor recusou/perdeu o lote inteiro."""
+
+
+def parse_prompts(filename, raw):
+    """
+    Prompts de um arquivo: .jsonl ({"prompt": ...} ou string por linha), .csv (coluna
+    "prompt" ou a primeira) ou texto com um prompt por linha.
+    """
+    text = raw.decode("utf-8-sig") if isinstance(raw, bytes) else raw
+    name = (filename or "").lower()
+    if name.endswith(".jsonl"):
+        prompts = []
+        for line in text.splitlines():
+            if not line.strip():
+                continue
+            value = json.loads(line)
+            prompts.append(value.get("prompt", "") if isinstance(value, dict) else str(value))
+    elif name.endswith(".csv"):
+        rows = list(csv.reader(io.StringIO(text)))
+        column = 0
+        if rows and "prompt" in [c.strip().lower() for c in rows[0]]:
+            column = [c.strip().lower() for c in rows[0]].index("prompt")
+            rows = rows[1:]
+        prompts = [r[column] for r in rows if len(r) > column]
+    else:
+        prompts = text.splitlines()
+    return [p.strip() for p in prompts if p and p.strip()]
+
+
+def batch_mode(kind, model):
+    """API de lote do provedor quando existe para o modelo; senão pool com rate limit."""
+    if kind == "text":
+        provider = provider_of(model)
+        if provider == "openai":
+            return "openai_batch"
+        if provider == "anthropic":
+            return "anthropic_batch"
+    return "pool"
+
+
+def create_job(user_id, kind, model, prompts, params=None):
+    """Grava o lote e os itens (INSERT em lote) e acorda o worker. Retorna o BatchJob."""
+    job = BatchJob(
+        user_id=user_id,
+        kind=kind,
+        model=model,
+        mode=batch_mode(kind, model),
+        params=json.dumps(params or {}),
+        total_items=len(prompts),
+    )
+    db.session.add(job)
+    db.session.flush()
+    db.session.execute(insert(BatchItem), [
+        {"id": str(uuid.uuid4()), "job_id": job.id, "position": i, "prompt": prompt, "status": "pending"}
+        for i, prompt in enumerate(prompts)
+    ])
+    db.session.commit()
+    start_batch_worker(current_app._get_current_object())
+    _wake.set()
+    return job
+
+
+# =========================
+# APIs de lote dos provedores
+# =========================
+def _check(resp):
+    if resp.status_code == 429 or resp.status_code >= 500:
+        # temporário (já passou pelas retentativas): o worker tenta de novo na próxima volta
+        raise requests.exceptions.HTTPError(f"{resp.status_code}: {(resp.text or '')[:300]}")
+    if resp.status_code >= 300:
+        raise BatchFailed(f"{resp.status_code}: {(resp.text or '')[:300]}")
+    return resp
+
+
+def _jsonl(text):
+    return [json.loads(line) for line in (text or "").splitlines() if line.strip()]
+
+
+class OpenAIBatch:
+    """POST /v1/files + /v1/batches (chat/completions); resultados no output/error file."""
+
+    endpoint = "/v1/chat/completions"
+
+    def __init__(self, base_url=None, api_key=None):
+        self.base_url = base_url or OPENAI_BASE_URL
+        self.api_key = api_key if api_key is not None else (os.getenv("API_KEY") or "").strip()
+
+    def _call(self, model, method, path, **kwargs):
+        headers = {"Authorization": f"Bearer {self.api_key}"}
+        url = self.base_url + path
+        return _check(call_provider(
+            "openai", model,
+            lambda timeout: requests.request(method, url, headers=headers, timeout=min(120, timeout), **kwargs),
+        ))
+
+    @staticmethod
+    def body(model, prompt, params):
+        body = {"model": model, "messages": [{"role": "user", "content": prompt}]}
+        # o*/gpt-5 não aceitam temperatura
+        if not model.startswith(("o", "gpt-5")):
+            body["temperature"] = params.get("temperature", 0.7)
+        return body
+
+    def submit(self, job, items):
+        params = job.params_dict
+        lines = "\n".join(
+            json.dumps({"custom_id": it.id, "method": "POST", "url": self.endpoint, "body": self.body(job.model, it.prompt, params)})
+            for it in items
+        )
+        uploaded = self._call(job.model, "POST", "/v1/files", data={"purpose": "batch"},
+                              files={"file": (f"batch_{job.id}.jsonl", lines.encode("utf-8"))}).json()
+        batch = self._call(job.model, "POST", "/v1/batches", json={
+            "input_file_id": uploaded["id"],
+            "endpoint": self.endpoint,
+            "completion_window": "24h",
+            "metadata": {"job_id": job.id},
+        }).json()
+        return batch["id"]
+
+    def poll(self, job):
+        """None enquanto o lote roda; depois {custom_id: {"text", "usage", "error"}}."""
+        batch = self._call(job.model, "GET", f"/v1/batches/{job.provider_batch_id}").json()
+        status = batch.get("status")
+        if status in ("validating", "in_progress", "finalizing", "cancelling"):
+            return None
+        files = [batch.get("output_file_id"), batch.get("error_file_id")]
+        if not any(files):
+            raise BatchFailed(f"Lote {status}: {batch.get('errors')}")
+
+        results = {}
+        for file_id in filter(None, files):
+            content = self._call(job.model, "GET", f"/v1/files/{file_id}/content").text
+            for row in _jsonl(content):
+                response = row.get("response") or {}
+                body = response.get("body") or {}
+                if response.get("status_code") == 200:
+                    u = body.get("usage") or {}
+                    results[row["custom_id"]] = {
+                        "text": body["choices"][0]["message"]["content"],
+                        "usage": (u.get("prompt_tokens"), u.get("completion_tokens"), u.get("total_tokens")),
+                    }
+                else:
+                    error = row.get("error") or body.get("error") or {}
+                    results[row["custom_id"]] = {"error": str(error.get("message") or error or status)}
+        return results
+
+    def cancel(self, job):
+        self._call(job.model, "POST", f"/v1/batches/{job.provider_batch_id}/cancel")
+
+
+class AnthropicBatch:
+    """POST /v1/messages/batches; resultados em JSONL no results_url."""
+
+    def __init__(self, base_url=None, api_key=None):
+        self.base_url = base_url or ANTHROPIC_BASE_URL
+        self.api_key = api_key if api_key is not None else (os.getenv("ANTHROPIC_API_KEY") or "").strip()
+
+    def _call(self, model, method, url, **kwargs):
+        headers = {"x-api-key": self.api_key, "anthropic-version": "2023-06-01"}
+        url = url if url.startswith("http") else self.base_url + url
+        return _check(call_provider(
+            "anthropic", model,
+            lambda timeout: requests.request(method, url, headers=headers, timeout=min(120, timeout), **kwargs),
+        ))
+
+    @staticmethod
+    def body(model, prompt, params):
+        return {
+            "model": model,
+            "max_tokens": MAX_TOKENS,
+            "temperature": params.get("temperature", 0.7),
+            "messages": [{"role": "user", "content": prompt}],
+        }
+
+    def submit(self, job, items):
+        params = job.params_dict
+        batch = self._call(job.model, "POST", "/v1/messages/batches", json={
+            "requests": [{"custom_id": it.id, "params": self.body(job.model, it.prompt, params)} for it in items],
+        }).json()
+        return batch["id"]
+
+    def poll(self, job):
+        batch = self._call(job.model, "GET", f"/v1/messages/batches/{job.provider_batch_id}").json()
+        if batch.get("processing_status") != "ended":
+            return None
+        if not batch.get("results_url"):
+            raise BatchFailed("Lote encerrado sem resultados")
+
+        results = {}
+        for row in _jsonl(self._call(job.model, "GET", batch["results_url"]).text):
+            result = row.get("result") or {}
+            if result.get("type") == "succeeded":
+                message = result.get("message") or {}
+                text = "\n".join(b.get("text", "") for b in message.get("content", []) if b.get("type") == "text")
+                results[row["custom_id"]] = {"text": text, "usage": prompt_cache.anthropic_usage(message.get("usage"))[:3]}
+            else:
+                error = (result.get("error") or {}).get("error") or result.get("error") or result.get("type")
+                results[row["custom_id"]] = {"error": str(error)}
+        return results
+
+    def cancel(self, job):
+        self._call(job.model, "POST", f"/v1/messages/batches/{job.provider_batch_id}/cancel")
+
+
+PROVIDER_BATCHES = {"openai_batch": OpenAIBatch, "anthropic_batch": AnthropicBatch}
+
+
+# =========================
+# Materialização (em lote)
+# =========================
+def materialize(job, outcomes):
+    """
+    Grava os resultados de uma leva de itens: conteúdos gerados via INSERT em lote,
+    status dos itens via UPDATE em lote e contadores do job. outcomes = {item_id: (prompt, resultado)}.
+    """
+    now = datetime.utcnow()
+    params = job.params_dict
+    base_rows, child_rows, item_rows = [], [], []
+    succeeded = failed = 0
+    for item_id, (prompt, outcome) in outcomes.items():
+        if outcome.get("error") is not None:
+            failed += 1
+            item_rows.append({"id": item_id, "status": "failed", "error": outcome["error"][:2000]})
+            continue
+        succeeded += 1
+        content_id = str(uuid.uuid4())
+        base_rows.append({
+            "id": content_id,
+            "user_id": job.user_id,
+            "content_type": job.kind,
+            "prompt": prompt,
+            "model_used": outcome.get("model") or job.model,
+            "content_data": outcome.get("text"),
+            "file_path": outcome.get("file_path"),
+            "created_at": now,
+        })
+        if job.kind == "text":
+            child_rows.append({"id": content_id, "temperature": params.get("temperature")})
+        else:
+            child_rows.append({"id": content_id, "style": params.get("style"), "ratio": outcome.get("ratio")})
+        item_rows.append({"id": item_id, "status": "succeeded", "content_id": content_id, "error": None})
+        if outcome.get("usage"):
+            record_usage(job.user_id, outcome.get("model") or job.model, *outcome["usage"], at=now)
+
+    child_table = GeneratedTextContent.__table__ if job.kind == "text" else GeneratedImageContent.__table__
+    if base_rows:
+        db.session.execute(insert(GeneratedContent.__table__), base_rows)
+        db.session.execute(insert(child_table), child_rows)
+    if item_rows:
+        db.session.execute(update(BatchItem), item_rows)
+    db.session.execute(
+        update(BatchJob)
+        .where(BatchJob.id == job.id)
+        .values(
+            succeeded_items=BatchJob.succeeded_items + succeeded,
+            failed_items=BatchJob.failed_items + failed,
+            updated_at=now,
+        )
+    )
+    db.session.commit()
+    return succeeded, failed
+
+
+def _pending_items(job):
+    return BatchItem.query.filter_by(job_id=job.id, status="pending").order_by(BatchItem.position).all()
+
+
+def _finish(job, status, error=None):
+    # o que sobrou pendente (lote cancelado/perdido) é marcado como falha
+    leftovers = _pending_items(job)
+    for start in range(0, len(leftovers), WRITE_CHUNK):
+        chunk = leftovers[start:start + WRITE_CHUNK]
+        materialize(job, {it.id: (it.prompt, {"error": error or "Item não processado"}) for it in chunk})
+    job.status = status
+    job.error = error
+    job.completed_at = datetime.utcnow()
+    db.session.commit()
+
+
+# =========================
+# Execução
+# =========================
+def _run_item(job, plan_name, prompt):
+    # geração reaproveitada da rota (mesma cadeia de fallback e chamadas aos provedores)
+    from routes.ai_generation_api import complete_text, render_image
+
+    params = job.params_dict
+    if job.kind == "text":
+        messages = [{"role": "user", "content": prompt, "attachments": []}]
+        used_model, text, usage = complete_text(job.model, messages, params.get("temperature", 0.7), _env_keys(), plan_name)
+        return {"text": text, "usage": usage, "model": used_model}
+    final_prompt = prompt if params.get("style", "auto") == "auto" else f"O estilo da imagem deve ser: {params['style']}. {prompt}"
+    path, ratio = render_image(job.model, final_prompt, params.get("ratio", "1024x1024"), params.get("quality", "auto"))
+    return {"file_path": path, "ratio": ratio}
+
+
+def _env_keys():
+    from routes.ai_generation_api import _get_env_keys
+    return _get_env_keys()
+
+
+def _run_pool(job, lost=None):
+    """
+    Processa os itens pendentes com POOL_WORKERS chamadas simultâneas, gravando a cada leva.
+    Se o lock do job for perdido (`lost`), para de iniciar itens: outro nó assumiu o job.
+    """
+    lost = lost or threading.Event()
+    user = User.query.get(job.user_id)
+    plan_name = (user.plan.name if user and user.plan else "").strip().lower()
+    if job.status == "queued":
+        job.status = "running"
+        db.session.commit()
+
+    items = _pending_items(job)
+    with ThreadPoolExecutor(max_workers=POOL_WORKERS, thread_name_prefix="batch") as pool:
+        for start in range(0, len(items), WRITE_CHUNK):
+            db.session.refresh(job)
+            if job.status == "cancelled":
+                _finish(job, "cancelled", "Cancelado pelo usuário")
+                return
+            chunk = items[start:start + WRITE_CHUNK]
+            futures = {pool.submit(_run_item, job, plan_name, it.prompt): it for it in chunk}
+            outcomes = {}
+            for future in as_completed(futures):
+                if lost.is_set():
+                    # itens ainda não iniciados ficam para o novo dono
+                    for f in futures:
+                        f.cancel()
+                if future.cancelled():
+                    continue
+                item = futures[future]
+                try:
+                    outcomes[item.id] = (item.prompt, future.result())
+                except Exception as e:
+                    outcomes[item.id] = (item.prompt, {"error": str(e)})
+            materialize(job, outcomes)
+            if lost.is_set():
+                print(f"[WARN] Lote {job.id}: lock perdido, interrompendo o processamento neste nó")
+                return
+    _finish(job, "completed")
+
+
+def _advance_provider_batch(job):
+    provider = PROVIDER_BATCHES[job.mode]()
+    if job.status == "queued":
+        items = _pending_items(job)
+        job.provider_batch_id = provider.submit(job, items)
+        job.status = "submitted"
+        db.session.commit()
+        print(f"[BATCH] Lote {job.id} enviado ao provedor ({job.provider_batch_id}, {len(items)} itens)")
+        return
+
+    results = provider.poll(job)
+    if results is None:
+        return
+    items = _pending_items(job)
+    for start in range(0, len(items), WRITE_CHUNK):
+        chunk = items[start:start + WRITE_CHUNK]
+        materialize(job, {
+            it.id: (it.prompt, results.get(it.id, {"error": "Sem resultado do provedor"}))
+            for it in chunk
+        })
+    _finish(job, "completed")
+
+
+def advance_job(job, lost=None):
+    """Um passo do job: envia/consulta o lote no provedor ou roda o pool."""
+    try:
+        if job.mode == "pool":
+            _run_pool(job, lost)
+        else:
+            _advance_provider_batch(job)
+    except BatchFailed as e:
+        db.session.rollback()
+        print(f"[BATCH] Lote {job.id} falhou: {e}")
+        _finish(job, "failed", str(e))
+    except requests.exceptions.RequestException as e:
+        # rede/provedor instável: tenta de novo na próxima volta
+        db.session.rollback()
+        print(f"[WARN] Lote {job.id}: falha temporária no provedor: {e}")
+
+
+def cancel_job(job):
+    if job.status not in ACTIVE_STATUSES:
+        return False
+    if job.mode == "pool" and job.status == "running":
+        # o worker do pool encerra entre uma leva e outra
+        job.status = "cancelled"
+        db.session.commit()
+        return True
+    if job.mode in PROVIDER_BATCHES and job.provider_batch_id:
+        try:
+            PROVIDER_BATCHES[job.mode]().cancel(job)
+        except Exception as e:
+            print(f"[WARN] Falha ao cancelar lote {job.id} no provedor: {e}")
+    _finish(job, "cancelled", "Cancelado pelo usuário")
+    return True
+
+
+# =========================
+# Worker
+# =========================
+# Só o dono (token) renova ou apaga o lock: ARGV[2] = 0 apaga, senão renova por ARGV[2] segundos
+_LOCK_LUA = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+    return 0
+end
+if tonumber(ARGV[2]) == 0 then
+    return redis.call('DEL', KEYS[1])
+end
+return redis.call('EXPIRE', KEYS[1], ARGV[2])
+"""
+
+_lock_script = None
+
+
+def _owned_lock(job_id, token, seconds):
+    global _lock_script
+    if _lock_script is None:
+        _lock_script = redis_client.register_script(_LOCK_LUA)
+    return bool(_lock_script(keys=[LOCK_KEY.format(job_id)], args=[token, seconds]))
+
+
+def _take_lock(job_id):
+    """Token do lock do job, ou None se outro nó o detém."""
+    token = uuid.uuid4().hex
+    try:
+        return token if redis_client.set(LOCK_KEY.format(job_id), token, nx=True, ex=LOCK_SECONDS) else None
+    except redis.exceptions.RedisError:
+        # sem Redis não há coordenação entre nós: segue (um worker por processo)
+        return token
+
+
+def _refresh_lock(job_id, token):
+    """Renova o lock se ainda for nosso. False: expirou e outro nó pode tê-lo assumido."""
+    try:
+        return _owned_lock(job_id, token, LOCK_SECONDS)
+    except redis.exceptions.RedisError:
+        return True
+
+
+def _release_lock(job_id, token):
+    try:
+        _owned_lock(job_id, token, 0)
+    except redis.exceptions.RedisError:
+        pass
+
+
+def _heartbeat(job_id, token, stop, lost):
+    while not stop.wait(HEARTBEAT_SECONDS):
+        if not _refresh_lock(job_id, token):
+            lost.set()
+            return
+
+
+def _advance_locked(app, job_id, token):
+    """Avança o job com o lock renovado em segundo plano; libera o lock no fim."""
+    stop, lost = threading.Event(), threading.Event()
+    beat = threading.Thread(target=_heartbeat, args=(job_id, token, stop, lost), name=f"batch-lock-{job_id}", daemon=True)
+    beat.start()
+    try:
+        with app.app_context():
+            try:
+                job = db.session.get(BatchJob, job_id)
+                if job and job.status in ACTIVE_STATUSES:
+                    advance_job(job, lost)
+            finally:
+                db.session.remove()
+    except Exception as e:
+        print(f"[BATCH] Falha no lote {job_id}: {e}")
+    finally:
+        stop.set()
+        _release_lock(job_id, token)
+        with _running_lock:
+            _running.discard(job_id)
+
+
+# Jobs do modo pool rodam aqui, para um lote grande não atrasar a consulta dos lotes nos provedores
+_pool_jobs = ThreadPoolExecutor(max_workers=POOL_JOBS, thread_name_prefix="batch-job")
+_running = set()
+_running_lock = threading.Lock()
+
+
+def process_jobs():
+    """
+    Avança os jobs ativos: lotes de provedor são enviados/consultados aqui mesmo; jobs do
+    pool vão para _pool_jobs (até POOL_JOBS por processo). Retorna quantos foram tocados.
+    """
+    app = current_app._get_current_object()
+    jobs = (
+        BatchJob.query.filter(BatchJob.status.in_(ACTIVE_STATUSES))
+        .order_by(BatchJob.created_at)
+        .limit(20)
+        .all()
+    )
+    touched = 0
+    for job in jobs:
+        with _running_lock:
+            # o lock só é tomado com vaga livre: job parado na fila do executor não renova o lock
+            if job.id in _running or (job.mode == "pool" and len(_running) >= POOL_JOBS):
+                continue
+            token = _take_lock(job.id)
+            if not token:
+                continue
+            _running.add(job.id)
+        if job.mode == "pool":
+            _pool_jobs.submit(_advance_locked, app, job.id, token)
+        else:
+            _advance_locked(app, job.id, token)
+        touched += 1
+    return touched
+
+
+_wake = threading.Event()
+
+
+def _worker_loop(app):
+    while True:
+        try:
+            with app.app_context():
+                try:
+                    process_jobs()
+                finally:
+                    db.session.remove()
+        except Exception as e:
+            print(f"[BATCH] Falha no worker de lotes: {e}")
+        _wake.wait(POLL_SECONDS)
+        _wake.clear()
+
+
+_worker_lock = threading.Lock()
+_worker_thread = None
+
+
+def start_batch_worker(app):
+    """Inicia (uma vez por processo) a thread que envia, consulta e processa os lotes."""
+    global _worker_thread
+    with _worker_lock:
+        if _worker_thread is None or not _worker_thread.is_alive():
+            _worker_thread = threading.Thread(target=_worker_loop, args=(app,), name="batch-jobs", daemon=True)
+            _worker_thread.start()
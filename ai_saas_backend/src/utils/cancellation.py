@@ -0,0 +1,167 @@
+import os, time, uuid, threading
+from concurrent.futures import TimeoutError as FutureTimeout
+import redis
+from extensions import redis_client
+from utils.metrics import incr
+
+# Frequência com que o vigia confere cancelamentos (Redis) e desconexões do cliente
+WATCH_INTERVAL = float(os.getenv("CANCEL_WATCH_INTERVAL", 0.3))
+GENERATION_TTL = 900
+
+_OWNER_KEY = "gen:owner:{}"
+_CANCEL_KEY = "gen:cancel:{}"
+
+
+class GenerationCancelled(Exception):
+    """A geração foi cancelada (endpoint de cancelamento ou cliente desconectado)."""
+
+    def __init__(self, reason, partial_text=""):
+        super().__init__(f"Geração cancelada: {reason}")
+        self.reason = reason
+        self.partial_text = partial_text
+
+
+class CancelToken:
+    """Sinal de cancelamento de uma geração, compartilhado entre as threads do turno."""
+
+    def __init__(self, generation_id, user_id, client_disconnected=None):
+        self.generation_id = generation_id
+        self.user_id = user_id
+        self.reason = None
+        self.partial_text = ""
+        self._event = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+        self._client_disconnected = client_disconnected
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def cancel(self, reason):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self.reason = reason
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for cb in callbacks:
+            try:
+                cb()
+            except Exception as e:
+                print(f"[WARN] Falha ao abortar chamada cancelada: {e}")
+
+    def on_cancel(self, callback):
+        """Registra callback (ex.: fechar a conexão HTTP); roda na hora se já cancelado."""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return lambda: self._discard(callback)
+        callback()
+        return lambda: None
+
+    def _discard(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def raise_if_cancelled(self):
+        if self.cancelled:
+            raise GenerationCancelled(self.reason, self.partial_text)
+
+    def keep_partial(self, text):
+        """Guarda o texto produzido até agora (o maior, se houver chamadas concorrentes)."""
+        if len(text) > len(self.partial_text):
+            self.partial_text = text
+
+
+_active = {}
+_active_lock = threading.Lock()
+_watcher = None
+
+
+def _watch_loop():
+    while True:
+        time.sleep(WATCH_INTERVAL)
+        with _active_lock:
+            tokens = list(_active.values())
+        if not tokens:
+            continue
+        for token in tokens:
+            check = token._client_disconnected
+            try:
+                if check and check():
+                    token.cancel("client_disconnected")
+            except Exception:
+                pass
+        try:
+            flags = redis_client.mget([_CANCEL_KEY.format(t.generation_id) for t in tokens])
+        except redis.exceptions.RedisError:
+            continue
+        for token, flag in zip(tokens, flags):
+            if flag:
+                token.cancel("user_cancelled")
+
+
+def _ensure_watcher():
+    global _watcher
+    with _active_lock:
+        if _watcher is None or not _watcher.is_alive():
+            _watcher = threading.Thread(target=_watch_loop, name="generation-cancel", daemon=True)
+            _watcher.start()
+
+
+def start_generation(user_id, generation_id=None, environ=None):
+    """
+    Registra uma geração cancelável e devolve seu CancelToken.
+    environ: o WSGI environ da requisição (waitress expõe a detecção de desconexão).
+    """
+    generation_id = generation_id or uuid.uuid4().hex
+    disconnected = (environ or {}).get("waitress.client_disconnected")
+    token = CancelToken(generation_id, user_id, disconnected if callable(disconnected) else None)
+    with _active_lock:
+        _active[generation_id] = token
+    try:
+        redis_client.setex(_OWNER_KEY.format(generation_id), GENERATION_TTL, user_id)
+    except redis.exceptions.RedisError as e:
+        print(f"[WARN] Cancelamento entre nós indisponível (Redis): {e}")
+    _ensure_watcher()
+    return token
+
+
+def wait(future, token, poll=0.2):
+    """Espera o Future, mas retorna assim que a geração for cancelada (a chamada fica órfã)."""
+    while True:
+        token.raise_if_cancelled()
+        try:
+            return future.result(timeout=poll)
+        except FutureTimeout:
+            continue
+
+
+def finish_generation(token):
+    with _active_lock:
+        _active.pop(token.generation_id, None)
+    try:
+        redis_client.delete(_OWNER_KEY.format(token.generation_id), _CANCEL_KEY.format(token.generation_id))
+    except redis.exceptions.RedisError:
+        pass
+    if token.cancelled:
+        incr("generation_cancelled", reason=token.reason)
+
+
+def request_cancel(generation_id, user_id):
+    """Pede o cancelamento (qualquer nó). Retorna False se a geração não existe ou é de outro usuário."""
+    local = _active.get(generation_id)
+    if local is not None and local.user_id == user_id:
+        local.cancel("user_cancelled")
+        return True
+    try:
+        owner = redis_client.get(_OWNER_KEY.format(generation_id))
+        if owner != user_id:
+            return False
+        redis_client.setex(_CANCEL_KEY.format(generation_id), GENERATION_TTL, 1)
+    except redis.exceptions.RedisError as e:
+        print(f"[WARN] Cancelamento indisponível (Redis): {e}")
+        return False
+    return True
@@ -0,0 +1,231 @@
+import os, time, uuid
+import redis
+from extensions import redis_client
+
+# Janela deslizante de WINDOW_SECONDS dividida em buckets de BUCKET_SECONDS
+WINDOW_SECONDS = int(os.getenv("CIRCUIT_WINDOW_SECONDS", 60))
+BUCKET_SECONDS = 10
+# Só avalia abertura com um mínimo de chamadas na janela
+MIN_CALLS = int(os.getenv("CIRCUIT_MIN_CALLS", 10))
+ERROR_RATE_THRESHOLD = float(os.getenv("CIRCUIT_ERROR_RATE", 0.5))
+# Latência média acima disso também abre o circuito do modelo (provedor "vivo" mas inutilizável).
+# Só no escopo do modelo: no do provedor a média misturaria chat, imagem e raciocínio longo
+LATENCY_THRESHOLD_MS = float(os.getenv("CIRCUIT_LATENCY_MS", 60000))
+# Tempo aberto antes de liberar uma sonda (half-open)
+OPEN_SECONDS = int(os.getenv("CIRCUIT_OPEN_SECONDS", 30))
+PROBE_TTL = 60
+# Amostras recentes de latência por escopo (para p50/p95 do roteador)
+LATENCY_SAMPLES = 100
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+_KEY = "cb:{}:{}"
+_SCOPES_KEY = "cb:scopes"
+
+
+class CircuitOpenError(Exception):
+    """Circuito aberto para o provedor/modelo: falha rápida sem chamar a API."""
+
+    def __init__(self, scope, retry_after):
+        super().__init__(f"Circuito aberto para {scope}; nova tentativa em {retry_after}s")
+        self.scope = scope
+        self.retry_after = retry_after
+
+
+def scopes_for(provider, model=None):
+    return [provider] + ([f"{provider}:{model}"] if model else [])
+
+
+def _bucket_keys(scope, now):
+    current = int(now // BUCKET_SECONDS)
+    count = WINDOW_SECONDS // BUCKET_SECONDS
+    return [_KEY.format(scope, f"w:{b}") for b in range(current - count + 1, current + 1)]
+
+
+def window_stats(scope, now=None):
+    pipe = redis_client.pipeline(transaction=False)
+    for key in _bucket_keys(scope, now or time.time()):
+        pipe.hgetall(key)
+    ok = err = 0
+    latency = 0.0
+    for bucket in pipe.execute():
+        ok += int(bucket.get("ok", 0))
+        err += int(bucket.get("err", 0))
+        latency += float(bucket.get("lat", 0))
+    calls = ok + err
+    return {
+        "calls": calls,
+        "errors": err,
+        "error_rate": round(err / calls, 3) if calls else 0.0,
+        "avg_latency_ms": round(latency / calls, 1) if calls else 0.0,
+    }
+
+
+def latency_percentile(scope, q, samples=None):
+    """Percentil q (0..1) em ms das últimas LATENCY_SAMPLES chamadas do escopo; None sem amostras."""
+    if samples is None:
+        samples = sorted(int(v) for v in redis_client.lrange(_KEY.format(scope, "lat"), 0, -1))
+    if not samples:
+        return None
+    return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+
+def latency_percentiles(scope):
+    """(p50, p95) em ms; (0, 0) sem amostras."""
+    samples = sorted(int(v) for v in redis_client.lrange(_KEY.format(scope, "lat"), 0, -1))
+    if not samples:
+        return 0, 0
+    return latency_percentile(scope, 0.5, samples), latency_percentile(scope, 0.95, samples)
+
+
+def health_score(stats):
+    """0..1: taxa de sucesso penalizada pela latência relativa ao limite."""
+    if not stats["calls"]:
+        return 1.0
+    latency_factor = max(0.0, 1 - stats["avg_latency_ms"] / LATENCY_THRESHOLD_MS)
+    return round((1 - stats["error_rate"]) * (0.5 + 0.5 * latency_factor), 3)
+
+
+def _state(scope):
+    return redis_client.hgetall(_KEY.format(scope, "state")) or {"state": CLOSED}
+
+
+def _open(scope, now, reason):
+    redis_client.hset(_KEY.format(scope, "state"), mapping={"state": OPEN, "opened_at": now, "reason": reason})
+    redis_client.delete(_KEY.format(scope, "probe"))
+    print(f"[CIRCUIT] {scope} aberto: {reason}")
+
+
+def _close(scope):
+    pipe = redis_client.pipeline()
+    pipe.delete(_KEY.format(scope, "state"), _KEY.format(scope, "probe"))
+    for key in _bucket_keys(scope, time.time()):
+        pipe.delete(key)
+    pipe.execute()
+    print(f"[CIRCUIT] {scope} fechado")
+
+
+# apaga a sonda só se ainda for a nossa
+_RELEASE_PROBE_LUA = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+  return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+def _gate(scope, now):
+    """(retry_after se aberto, precisa de sonda?) sem efeitos colaterais."""
+    st = _state(scope)
+    if st["state"] == CLOSED:
+        return None, False
+    opened_at = float(st.get("opened_at", now))
+    if st["state"] == OPEN and now < opened_at + OPEN_SECONDS:
+        return int(opened_at + OPEN_SECONDS - now) + 1, False
+    return None, True
+
+
+def _claim_probe(scope, token):
+    # half-open: apenas uma sonda por vez entre todos os nós
+    if redis_client.set(_KEY.format(scope, "probe"), token, nx=True, ex=PROBE_TTL):
+        redis_client.hset(_KEY.format(scope, "state"), "state", HALF_OPEN)
+        return True
+    return False
+
+
+def _release_probe(scope, token):
+    redis_client.eval(_RELEASE_PROBE_LUA, 1, _KEY.format(scope, "probe"), token)
+
+
+def check(provider, model=None):
+    """
+    Levanta CircuitOpenError se algum escopo (provedor ou modelo) estiver aberto. Sem Redis, libera.
+    As sondas do half-open só são reservadas depois que nenhum escopo está aberto; se a de um
+    escopo já estiver com outra chamada, as reservadas aqui são devolvidas.
+    """
+    now = time.time()
+    try:
+        probes = []
+        for scope in scopes_for(provider, model):
+            retry_after, probe = _gate(scope, now)
+            if retry_after is not None:
+                raise CircuitOpenError(scope, retry_after)
+            if probe:
+                probes.append(scope)
+
+        token = uuid.uuid4().hex
+        claimed = []
+        for scope in probes:
+            if not _claim_probe(scope, token):
+                for taken in claimed:
+                    _release_probe(taken, token)
+                raise CircuitOpenError(scope, OPEN_SECONDS)
+            claimed.append(scope)
+    except redis.exceptions.RedisError:
+        return
+
+
+def current_state(provider, model=None, now=None):
+    """Estado efetivo sem efeitos colaterais (não reserva a sonda do half-open)."""
+    now = now or time.time()
+    effective = CLOSED
+    for scope in scopes_for(provider, model):
+        st = _state(scope)
+        if st["state"] == OPEN and now < float(st.get("opened_at", now)) + OPEN_SECONDS:
+            return OPEN
+        if st["state"] != CLOSED:
+            effective = HALF_OPEN
+    return effective
+
+
+def record(provider, model, ok, latency_ms):
+    """Registra o resultado de uma chamada e transiciona os circuitos afetados."""
+    now = time.time()
+    try:
+        for scope in scopes_for(provider, model):
+            pipe = redis_client.pipeline(transaction=False)
+            key = _bucket_keys(scope, now)[-1]
+            pipe.hincrby(key, "ok" if ok else "err", 1)
+            pipe.hincrbyfloat(key, "lat", float(latency_ms))
+            pipe.expire(key, WINDOW_SECONDS + BUCKET_SECONDS)
+            pipe.sadd(_SCOPES_KEY, scope)
+            pipe.lpush(_KEY.format(scope, "lat"), int(latency_ms))
+            pipe.ltrim(_KEY.format(scope, "lat"), 0, LATENCY_SAMPLES - 1)
+            pipe.expire(_KEY.format(scope, "lat"), 3600)
+            pipe.execute()
+
+            st = _state(scope)["state"]
+            if st == HALF_OPEN:
+                if ok:
+                    _close(scope)
+                else:
+                    _open(scope, now, "sonda falhou")
+            elif st == CLOSED:
+                stats = window_stats(scope, now)
+                if stats["calls"] >= MIN_CALLS:
+                    if stats["error_rate"] >= ERROR_RATE_THRESHOLD:
+                        _open(scope, now, f"taxa de erro {stats['error_rate']:.0%}")
+                    elif ":" in scope and stats["avg_latency_ms"] >= LATENCY_THRESHOLD_MS:
+                        _open(scope, now, f"latência média {stats['avg_latency_ms']:.0f}ms")
+    except redis.exceptions.RedisError as e:
+        print(f"[WARN] Circuit breaker sem Redis: {e}")
+
+
+def breaker_status():
+    result = {}
+    for scope in sorted(redis_client.smembers(_SCOPES_KEY)):
+        stats = window_stats(scope)
+        st = _state(scope)
+        result[scope] = {
+            **stats,
+            "state": st["state"],
+            "opened_at": float(st["opened_at"]) if st.get("opened_at") else None,
+            "reason": st.get("reason"),
+            "health": health_score(stats),
+        }
+    return result
+
+
+def reset(scope):
+    """Fecha o circuito manualmente (admin)."""
+    _close(scope)
@@ -0,0 +1,59 @@
+import os
+from datetime import datetime, timedelta
+from utils.metrics import incr
+
+# Estado da conversa no provedor (opt-in por requisição, "server_state"): em vez de reenviar
+# o histórico inteiro, cada turno manda só a mensagem nova e o id da resposta anterior
+# (OpenAI Responses: previous_response_id; Gemini Interactions: previous_interaction_id).
+# O estado só vale se cobre exatamente o histórico local até a mensagem anterior à atual;
+# qualquer divergência (outro modelo respondeu, comparação, estado expirado) reconstrói.
+
+# Por quanto tempo o provedor guarda o estado (OpenAI: 30 dias; Gemini: 1 dia no plano gratuito)
+STATE_TTL = {
+    "openai": timedelta(hours=float(os.getenv("OPENAI_STATE_TTL_HOURS", 24 * 30))),
+    "gemini": timedelta(hours=float(os.getenv("GEMINI_STATE_TTL_HOURS", 24))),
+}
+# margem para não usar um estado prestes a expirar
+TTL_MARGIN = timedelta(hours=1)
+
+
+def previous_id(chat, provider, prior_message_id):
+    """
+    Id do estado a continuar, ou None para reconstruir. prior_message_id é a última mensagem
+    do histórico antes da mensagem atual do usuário.
+    """
+    if not chat.state_id or chat.state_provider != provider:
+        return None
+    if not prior_message_id or chat.state_message_id != prior_message_id:
+        note_rebuild(provider, "history")
+        return None
+    ttl = STATE_TTL.get(provider)
+    if ttl is None or not chat.state_updated_at or datetime.utcnow() - chat.state_updated_at > ttl - TTL_MARGIN:
+        note_rebuild(provider, "expired")
+        return None
+    incr("conversation_state.continued", provider=provider)
+    return chat.state_id
+
+
+def note_rebuild(provider, reason):
+    incr("conversation_state.rebuild", provider=provider, reason=reason)
+
+
+def save(chat, provider, state_id, message_id):
+    """Guarda o estado após a resposta (sem commit: vai junto da mensagem da IA)."""
+    chat.state_provider = provider if state_id else None
+    chat.state_id = state_id
+    chat.state_message_id = message_id if state_id else None
+    chat.state_updated_at = datetime.utcnow() if state_id else None
+
+
+def clear(chat):
+    save(chat, None, None, None)
+
+
+def is_missing_state_error(status=None, text=""):
+    """O provedor não conhece mais o estado (expirou ou foi apagado): reconstruir com o histórico."""
+    text = (text or "").lower()
+    if status not in (None, 400, 404):
+        return False
+    return "not found" in text or "not_found" in text or ("previous" in text and "invalid" in text)
@@ -0,0 +1,245 @@
+import os, json, uuid
+from datetime import datetime
+import redis
+from sqlalchemy import select, delete, func
+from extensions import db, redis_client
+from models import (
+    User, Chat, ChatMessage, ChatAttachment, DocumentChunk, Project, Notification, UsageDaily,
+    BatchJob, BatchItem,
+    GeneratedContent, GeneratedTextContent, GeneratedImageContent, GeneratedVideoContent,
+    project_content_association,
+)
+from utils.background import run_in_background
+
+# Quantidade de linhas apagadas por DELETE/commit (mantém transações curtas)
+BATCH_SIZE = int(os.getenv("DELETION_BATCH_SIZE", 500))
+# Acima desse número de mensagens a exclusão de conta vira job em segundo plano
+SYNC_MESSAGE_LIMIT = int(os.getenv("DELETION_SYNC_MESSAGE_LIMIT", 2000))
+
+FILE_QUEUE_KEY = "deletion:files"
+JOB_KEY = "deletion_job:{}"
+JOB_TTL = 60 * 60 * 24
+
+_CONTENT_CHILD_TABLES = (
+    GeneratedTextContent.__table__,
+    GeneratedImageContent.__table__,
+    GeneratedVideoContent.__table__,
+)
+
+
+def _purge(table, id_column, *where, path_column=None, before=()):
+    """
+    Apaga em lotes de BATCH_SIZE as linhas de `table` que satisfazem `where`.
+    `before` são funções ids -> statement executadas antes (tabelas dependentes).
+    Caminhos de arquivo em `path_column` vão para a fila de remoção assíncrona.
+    """
+    columns = [id_column] + ([path_column] if path_column is not None else [])
+    deleted = 0
+    while True:
+        rows = db.session.execute(select(*columns).where(*where).limit(BATCH_SIZE)).all()
+        if not rows:
+            return deleted
+        ids = [r[0] for r in rows]
+        for stmt in before:
+            db.session.execute(stmt(ids))
+        db.session.execute(delete(table).where(id_column.in_(ids)))
+        db.session.commit()
+        if path_column is not None:
+            enqueue_file_removal([r[1] for r in rows if r[1]])
+        deleted += len(ids)
+
+
+def _purge_chats(chat_filter):
+    chat_ids = select(Chat.id).where(chat_filter)
+    message_ids = select(ChatMessage.id).where(ChatMessage.chat_id.in_(chat_ids))
+    # ordem de dependência: trechos de PDF -> anexos -> mensagens -> chats
+    _purge(DocumentChunk.__table__, DocumentChunk.id, DocumentChunk.chat_id.in_(chat_ids))
+    _purge(
+        ChatAttachment.__table__, ChatAttachment.id,
+        ChatAttachment.message_id.in_(message_ids),
+        path_column=ChatAttachment.path,
+    )
+    _purge(ChatMessage.__table__, ChatMessage.id, ChatMessage.chat_id.in_(chat_ids))
+    return _purge(Chat.__table__, Chat.id, chat_filter)
+
+
+def _purge_batches(job_filter):
+    job_ids = select(BatchJob.id).where(job_filter)
+    # itens -> lotes
+    _purge(BatchItem.__table__, BatchItem.id, BatchItem.job_id.in_(job_ids))
+    return _purge(BatchJob.__table__, BatchJob.id, job_filter)
+
+
+def _purge_contents(content_filter):
+    def unlink_projects(ids):
+        return delete(project_content_association).where(project_content_association.c.content_id.in_(ids))
+
+    def child_delete(table):
+        return lambda ids: delete(table).where(table.c.id.in_(ids))
+
+    return _purge(
+        GeneratedContent.__table__, GeneratedContent.id,
+        content_filter,
+        path_column=GeneratedContent.file_path,
+        before=[unlink_projects] + [child_delete(t) for t in _CONTENT_CHILD_TABLES],
+    )
+
+
+def delete_chats(user_id, chat_ids):
+    """Apaga chats do usuário (com mensagens e anexos) via DELETEs em lote. Retorna o total de chats."""
+    if not chat_ids:
+        return 0
+    return _purge_chats((Chat.user_id == user_id) & Chat.id.in_(list(chat_ids)))
+
+
+def delete_messages(chat_id, message_ids):
+    """Apaga mensagens de um chat com seus anexos (e trechos de PDF). Retorna o total apagado."""
+    if not message_ids:
+        return 0
+    message_filter = (ChatMessage.chat_id == chat_id) & ChatMessage.id.in_(list(message_ids))
+    attachment_ids = select(ChatAttachment.id).where(ChatAttachment.message_id.in_(select(ChatMessage.id).where(message_filter)))
+    _purge(DocumentChunk.__table__, DocumentChunk.id, DocumentChunk.attachment_id.in_(attachment_ids))
+    _purge(
+        ChatAttachment.__table__, ChatAttachment.id,
+        ChatAttachment.message_id.in_(select(ChatMessage.id).where(message_filter)),
+        path_column=ChatAttachment.path,
+    )
+    return _purge(ChatMessage.__table__, ChatMessage.id, message_filter)
+
+
+def delete_contents(user_id, content_ids):
+    """Apaga conteúdos gerados do usuário sem carregá-los no ORM. Retorna o total apagado."""
+    if not content_ids:
+        return 0
+    return _purge_contents((GeneratedContent.user_id == user_id) & GeneratedContent.id.in_(list(content_ids)))
+
+
+def delete_user_data(user_id, job_id=None):
+    """Apaga a conta e todos os dados do usuário, em ordem de dependência e em lotes."""
+    steps = (
+        ("chats", lambda: _purge_chats(Chat.user_id == user_id)),
+        ("messages", lambda: _purge(ChatMessage.__table__, ChatMessage.id, ChatMessage.user_id == user_id)),
+        ("projects", lambda: _purge(
+            Project.__table__, Project.id, Project.user_id == user_id,
+            before=[lambda ids: delete(project_content_association).where(
+                project_content_association.c.project_id.in_(ids))],
+        )),
+        ("batches", lambda: _purge_batches(BatchJob.user_id == user_id)),
+        ("contents", lambda: _purge_contents(GeneratedContent.user_id == user_id)),
+        ("notifications", lambda: _purge(Notification.__table__, Notification.id, Notification.user_id == user_id)),
+        ("usage", lambda: _purge(UsageDaily.__table__, UsageDaily.id, UsageDaily.user_id == user_id)),
+    )
+    progress = {}
+    for name, step in steps:
+        progress[name] = step()
+        if job_id:
+            _set_job(job_id, status="running", progress=progress)
+
+    db.session.execute(delete(User.__table__).where(User.__table__.c.id == user_id))
+    db.session.commit()
+    if job_id:
+        _set_job(job_id, status="done", progress=progress, finished_at=datetime.utcnow().isoformat())
+    return progress
+
+
+def _set_job(job_id, **fields):
+    try:
+        key = JOB_KEY.format(job_id)
+        redis_client.hset(key, mapping={k: json.dumps(v) for k, v in fields.items()})
+        redis_client.expire(key, JOB_TTL)
+    except redis.exceptions.RedisError as e:
+        print(f"[WARN] Falha ao registrar job de exclusão {job_id}: {e}")
+
+
+def get_deletion_job(job_id):
+    try:
+        raw = redis_client.hgetall(JOB_KEY.format(job_id))
+    except redis.exceptions.RedisError:
+        return None
+    return {k: json.loads(v) for k, v in raw.items()} if raw else None
+
+
+def _run_user_deletion_job(user_id, job_id):
+    try:
+        delete_user_data(user_id, job_id=job_id)
+    except Exception as e:
+        db.session.rollback()
+        _set_job(job_id, status="failed", error=str(e))
+        raise
+
+
+def delete_user_account(user_id):
+    """
+    Exclui o usuário. Contas pequenas são apagadas na própria requisição;
+    contas grandes são desativadas e apagadas por um job em segundo plano.
+    Retorna None (exclusão concluída) ou o id do job.
+    """
+    message_count = db.session.execute(
+        select(func.count(ChatMessage.id)).join(Chat, Chat.id == ChatMessage.chat_id).where(Chat.user_id == user_id)
+    ).scalar() or 0
+
+    if message_count <= SYNC_MESSAGE_LIMIT:
+        delete_user_data(user_id)
+        return None
+
+    # bloqueia o acesso imediatamente; o restante roda fora da requisição
+    db.session.execute(
+        User.__table__.update().where(User.__table__.c.id == user_id).values(is_active=False)
+    )
+    db.session.commit()
+
+    job_id = uuid.uuid4().hex
+    _set_job(job_id, status="queued", user_id=user_id, created_at=datetime.utcnow().isoformat())
+    run_in_background(_run_user_deletion_job, user_id, job_id)
+    return job_id
+
+
+# =========================
+# Remoção assíncrona de arquivos
+# =========================
+def enqueue_file_removal(paths):
+    """
+    Agenda a remoção dos arquivos em disco após a exclusão das linhas que os referenciam.
+    A checagem de referências roda aqui, na sessão de quem chamou: a tarefa de fundo só mexe no disco.
+    """
+    paths = unreferenced_paths(paths)
+    if not paths:
+        return
+    try:
+        redis_client.rpush(FILE_QUEUE_KEY, *paths)
+        run_in_background(drain_file_queue)
+    except redis.exceptions.RedisError:
+        # sem Redis: remove direto em segundo plano
+        run_in_background(remove_files, paths)
+
+
+def unreferenced_paths(paths):
+    """Caminhos que nenhuma linha referencia mais (um mesmo arquivo pode ser anexo de chat e conteúdo gerado)."""
+    paths = list(dict.fromkeys(p for p in paths if p))
+    if not paths:
+        return []
+    used = set(db.session.execute(select(ChatAttachment.path).where(ChatAttachment.path.in_(paths))).scalars())
+    used.update(db.session.execute(select(GeneratedContent.file_path).where(GeneratedContent.file_path.in_(paths))).scalars())
+    return [p for p in paths if p not in used]
+
+
+def remove_files(paths):
+    removed = 0
+    for path in paths:
+        try:
+            if os.path.isfile(path):
+                os.remove(path)
+                removed += 1
+        except OSError as e:
+            print(f"[WARN] Falha ao remover arquivo {path}: {e}")
+    return removed
+
+
+def drain_file_queue(batch=100):
+    """Consome a fila de arquivos pendentes (pode ser chamada por qualquer nó ou job periódico)."""
+    removed = 0
+    while True:
+        paths = redis_client.lpop(FILE_QUEUE_KEY, batch)
+        if not paths:
+            return removed
+        removed += remove_files(paths)
@@ -0,0 +1,229 @@
+import os, re, math, threading, unicodedata
+from collections import Counter, OrderedDict
+from sqlalchemy import insert, func
+from pypdf import PdfReader
+from extensions import db
+from models import ChatAttachment, DocumentChunk
+from utils.metrics import incr
+
+# PDFs anexados viram trechos de texto no upload (uma vez só). A cada turno vão para o modelo
+# apenas os trechos mais relevantes para a pergunta (BM25 por chat), dentro de um orçamento
+# de tokens, em vez do PDF inteiro em base64. Modelos sem visão passam a ver o conteúdo também.
+
+# Tamanho dos trechos (em tokens estimados) e sobreposição entre trechos vizinhos
+CHUNK_TOKENS = int(os.getenv("DOC_CHUNK_TOKENS", 300))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("DOC_CHUNK_OVERLAP_TOKENS", 40))
+# Orçamento de contexto por turno e máximo de trechos
+CONTEXT_TOKENS = int(os.getenv("DOC_CONTEXT_TOKENS", 3000))
+TOP_K = int(os.getenv("DOC_TOP_K", 8))
+# PDFs maiores que isso não são extraídos (seguem como arquivo, quando o modelo aceita)
+MAX_PAGES = int(os.getenv("DOC_MAX_PAGES", 500))
+# Índices BM25 em memória (por chat), reconstruídos quando os trechos do chat mudam
+INDEX_CACHE_SIZE = 64
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+STOPWORDS = frozenset((
+    "a", "o", "as", "os", "um", "uma", "uns", "umas", "de", "do", "da", "dos", "das", "em", "no", "na", "nos",
+    "nas", "por", "para", "pra", "com", "sem", "e", "ou", "que", "se", "como", "mais", "mas", "ao", "aos",
+    "the", "an", "of", "to", "in", "on", "for", "and", "or", "is", "are", "be", "with", "this", "that", "it",
+))
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+def estimate_tokens(text):
+    # aproximação usual de ~4 caracteres por token
+    return max(1, len(text) // 4)
+
+
+def tokenize(text):
+    """Termos para o BM25: minúsculas, sem acentos, sem stopwords."""
+    text = unicodedata.normalize("NFKD", (text or "").lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return [w for w in _WORD.findall(text) if w not in STOPWORDS and len(w) > 1]
+
+
+def split_chunks(pages):
+    """
+    [(página, texto)] -> [(página, trecho)]. Cada trecho tem ~CHUNK_TOKENS, cortado em
+    fronteira de palavra, com CHUNK_OVERLAP_TOKENS repetidos do trecho anterior.
+    """
+    size, overlap = CHUNK_TOKENS * 4, CHUNK_OVERLAP_TOKENS * 4
+    chunks = []
+    for page, text in pages:
+        text = re.sub(r"\s+", " ", text or "").strip()
+        start = 0
+        while start < len(text):
+            end = min(len(text), start + size)
+            if end < len(text):
+                cut = text.rfind(" ", start + size // 2, end)
+                end = cut if cut > start else end
+            chunks.append((page, text[start:end].strip()))
+            if end >= len(text):
+                break
+            start = max(end - overlap, start + 1)
+            # começa o próximo trecho numa palavra inteira
+            space = text.find(" ", start, end)
+            start = space + 1 if space != -1 else start
+    return [(p, t) for p, t in chunks if t]
+
+
+def extract_pdf_pages(path):
+    reader = PdfReader(path)
+    if len(reader.pages) > MAX_PAGES:
+        raise ValueError(f"PDF com {len(reader.pages)} páginas (máximo {MAX_PAGES})")
+    return [(i + 1, page.extract_text() or "") for i, page in enumerate(reader.pages)]
+
+
+def index_attachment(attachment, chat_id):
+    """
+    Extrai o texto de um PDF anexado e grava os trechos (INSERT em lote). Define
+    attachment.text_status; não faz commit. Retorna o número de trechos.
+    """
+    if attachment.mimetype != "application/pdf" or attachment.text_status is not None:
+        return 0
+    try:
+        chunks = split_chunks(extract_pdf_pages(attachment.path))
+    except Exception as e:
+        print(f"[WARN] Falha ao extrair texto do PDF {attachment.name}: {e}")
+        attachment.text_status = "error"
+        incr("documents.extract", status="error")
+        return 0
+    if not chunks:
+        # PDF digitalizado (só imagem): continua indo como arquivo para modelos com visão
+        attachment.text_status = "empty"
+        incr("documents.extract", status="empty")
+        return 0
+    db.session.execute(insert(DocumentChunk), [
+        {
+            "id": f"{attachment.id}:{i}",
+            "attachment_id": attachment.id,
+            "chat_id": chat_id,
+            "position": i,
+            "page": page,
+            "text": text,
+            "tokens": estimate_tokens(text),
+        }
+        for i, (page, text) in enumerate(chunks)
+    ])
+    attachment.text_status = "indexed"
+    incr("documents.extract", status="indexed")
+    return len(chunks)
+
+
+class ChatIndex:
+    """Índice BM25 dos trechos de PDF de um chat."""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.terms = [Counter(tokenize(c.text)) for c in chunks]
+        self.lengths = [sum(t.values()) for t in self.terms]
+        self.avg_length = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0
+        df = Counter()
+        for t in self.terms:
+            df.update(t.keys())
+        n = len(chunks)
+        self.idf = {term: math.log(1 + (n - freq + 0.5) / (freq + 0.5)) for term, freq in df.items()}
+
+    def scores(self, query):
+        query_terms = set(tokenize(query))
+        result = []
+        for i, terms in enumerate(self.terms):
+            score = 0.0
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[i] / (self.avg_length or 1))
+            for term in query_terms:
+                tf = terms.get(term)
+                if tf:
+                    score += self.idf[term] * tf * (BM25_K1 + 1) / (tf + norm)
+            result.append(score)
+        return result
+
+    def top(self, query, budget_tokens=CONTEXT_TOKENS, k=TOP_K):
+        """
+        Melhores trechos para a consulta que cabem no orçamento, na ordem do documento.
+        Sem nenhum termo em comum (ex.: "resuma"), usa o começo do documento mais recente.
+        """
+        scores = self.scores(query)
+        ranked = sorted((i for i, s in enumerate(scores) if s > 0), key=lambda i: -scores[i])
+        if not ranked:
+            latest = self.chunks[-1].attachment_id if self.chunks else None
+            ranked = [i for i, c in enumerate(self.chunks) if c.attachment_id == latest]
+        chosen, used = [], 0
+        for i in ranked:
+            if len(chosen) >= k:
+                break
+            if used + self.chunks[i].tokens > budget_tokens:
+                continue
+            chosen.append(i)
+            used += self.chunks[i].tokens
+        return [self.chunks[i] for i in sorted(chosen)]
+
+
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def chat_index(chat_id):
+    """Índice do chat (cacheado em memória enquanto os trechos não mudam); None sem PDFs."""
+    count = db.session.query(func.count(DocumentChunk.id)).filter(DocumentChunk.chat_id == chat_id).scalar() or 0
+    if not count:
+        return None
+    with _indexes_lock:
+        cached = _indexes.get(chat_id)
+        if cached and cached[0] == count:
+            _indexes.move_to_end(chat_id)
+            return cached[1]
+    chunks = (
+        DocumentChunk.query.filter_by(chat_id=chat_id)
+        .join(ChatAttachment, ChatAttachment.id == DocumentChunk.attachment_id)
+        .order_by(ChatAttachment.created_at, DocumentChunk.position)
+        .all()
+    )
+    for c in chunks:
+        db.session.expunge(c)
+    index = ChatIndex(chunks)
+    with _indexes_lock:
+        _indexes[chat_id] = (count, index)
+        _indexes.move_to_end(chat_id)
+        while len(_indexes) > INDEX_CACHE_SIZE:
+            _indexes.popitem(last=False)
+    return index
+
+
+def index_pending(chat_id, attachments):
+    """Extrai PDFs ainda não processados (uploads novos ou anteriores a esta feature)."""
+    pending = [a for a in attachments if a.mimetype == "application/pdf" and a.text_status is None]
+    for attachment in pending:
+        index_attachment(attachment, chat_id)
+    if pending:
+        db.session.commit()
+
+
+def document_context(chat_id, query, names, budget_tokens=CONTEXT_TOKENS, k=TOP_K):
+    """Bloco de texto com os trechos relevantes dos PDFs do chat, ou "" se não houver."""
+    index = chat_index(chat_id)
+    if index is None:
+        return ""
+    chunks = index.top(query, budget_tokens, k)
+    if not chunks:
+        return ""
+    incr("documents.context_chunks", len(chunks))
+    blocks = [
+        f"[{names.get(c.attachment_id, 'PDF')}, p. {c.page}]\n{c.text}" if c.page else f"[{names.get(c.attachment_id, 'PDF')}]\n{c.text}"
+        for c in chunks
+    ]
+    return "Trechos relevantes dos PDFs anexados a esta conversa:\n\n" + "\n\n".join(blocks)
+
+
+def with_context(session_messages, context):
+    """
+    Acrescenta o bloco de trechos à última mensagem. Só a mensagem atual recebe o bloco:
+    o histórico anterior continua idêntico entre turnos (cache de prompt).
+    """
+    if not context or not session_messages:
+        return session_messages
+    last = dict(session_messages[-1])
+    last["content"] = ((last.get("content") or "") + "\n\n" + context).strip()
+    return session_messages[:-1] + [last]
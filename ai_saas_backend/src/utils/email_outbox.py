@@ -0,0 +1,268 @@
+import os, json, time, uuid, smtplib, threading
+from email.mime.text import MIMEText
+import redis
+from dotenv import load_dotenv
+from extensions import redis_client
+from utils import reliable_queue
+
+load_dotenv()
+
+EMAIL_USER = os.getenv("EMAIL_USER")
+EMAIL_PASS = os.getenv("EMAIL_PASS")
+EMAIL_FROM = os.getenv("EMAIL_FROM") or EMAIL_USER
+SMTP_SERVER = os.getenv("SMTP_SERVER", "smtp.gmail.com")
+SMTP_PORT = int(os.getenv("SMTP_PORT", 465))
+# "ssl" (SMTP_SSL, padrão na 465), "starttls" ou "none" (ex.: servidor local de testes)
+SMTP_SECURITY = os.getenv("SMTP_SECURITY", "ssl").lower()
+# Conexão ociosa por mais que isso é fechada pelo worker
+SMTP_IDLE_TIMEOUT = int(os.getenv("SMTP_IDLE_TIMEOUT", 60))
+
+OUTBOX_KEY = "email:outbox"
+RETRY_KEY = "email:outbox:retry"   # ZSET: score = horário da próxima tentativa
+DEAD_KEY = "email:outbox:dead"
+OUTBOX_BATCH = int(os.getenv("EMAIL_OUTBOX_BATCH", 20))
+MAX_ATTEMPTS = int(os.getenv("EMAIL_MAX_ATTEMPTS", 5))
+RETRY_BASE_DELAY = 5
+DEAD_LETTER_LIMIT = 1000
+
+
+def smtp_configured():
+    return SMTP_SECURITY == "none" or bool(EMAIL_USER and EMAIL_PASS)
+
+
+def build_email(to, subject, body):
+    return {
+        "id": uuid.uuid4().hex,
+        "to": to,
+        "subject": subject,
+        "body": body,
+        "attempts": 0,
+        "created_at": time.time(),
+    }
+
+
+class SMTPSender:
+    """Mantém uma conexão SMTP aberta e a reutiliza entre envios (reconecta se cair)."""
+
+    def __init__(self, host=None, port=None, security=None, user=None, password=None, sender=None, timeout=30):
+        self.host = host or SMTP_SERVER
+        self.port = port or SMTP_PORT
+        self.security = (security or SMTP_SECURITY).lower()
+        self.user = EMAIL_USER if user is None else user
+        self.password = EMAIL_PASS if password is None else password
+        self.sender = sender or EMAIL_FROM or self.user
+        self.timeout = timeout
+        self.connections_opened = 0
+        self.last_used = 0.0
+        self._conn = None
+
+    def _connect(self):
+        if self.security == "ssl":
+            conn = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout)
+        else:
+            conn = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            if self.security == "starttls":
+                conn.starttls()
+        if self.user and self.password:
+            conn.login(self.user, self.password)
+        self.connections_opened += 1
+        return conn
+
+    def close(self):
+        if self._conn is not None:
+            try:
+                self._conn.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._conn = None
+
+    def send(self, payload):
+        msg = MIMEText(payload["body"])
+        msg["Subject"] = payload["subject"]
+        msg["From"] = self.sender
+        msg["To"] = payload["to"]
+
+        # uma reconexão se o servidor derrubou a conexão reaproveitada
+        for attempt in range(2):
+            if self._conn is None:
+                self._conn = self._connect()
+            try:
+                self._conn.send_message(msg, from_addr=self.sender, to_addrs=[payload["to"]])
+                self.last_used = time.time()
+                return
+            except (smtplib.SMTPServerDisconnected, ConnectionError):
+                self._conn = None
+                if attempt:
+                    raise
+
+
+def is_permanent_failure(exc):
+    """Respostas 5xx (destinatário recusado, remetente inválido...) não adianta repetir."""
+    if isinstance(exc, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in exc.recipients.values())
+    if isinstance(exc, smtplib.SMTPResponseException):
+        return exc.smtp_code >= 500 and not isinstance(exc, smtplib.SMTPAuthenticationError)
+    return False
+
+
+def deliver_batch(sender, payloads, on_sent=None):
+    """
+    Envia um lote pela mesma conexão. on_sent(payload) é chamado logo após cada envio.
+    Retorna (enviados, falhas) com falhas = [(payload, permanente, erro)].
+    """
+    sent, failed = [], []
+    for payload in payloads:
+        try:
+            sender.send(payload)
+            sent.append(payload)
+            if on_sent:
+                on_sent(payload)
+        except (smtplib.SMTPException, OSError) as e:
+            # recusas do servidor mantêm a conexão; erros de transporte a descartam
+            if isinstance(e, smtplib.SMTPServerDisconnected) or not isinstance(e, smtplib.SMTPException):
+                sender.close()
+            failed.append((payload, is_permanent_failure(e), str(e)))
+    return sent, failed
+
+
+# =========================
+# Fila (Redis)
+# =========================
+def _schedule_retry_or_dead(payload, permanent, error):
+    payload["attempts"] = payload.get("attempts", 0) + 1
+    payload["last_error"] = error
+    if permanent or payload["attempts"] >= MAX_ATTEMPTS:
+        redis_client.lpush(DEAD_KEY, json.dumps(payload))
+        redis_client.ltrim(DEAD_KEY, 0, DEAD_LETTER_LIMIT - 1)
+        print(f"[EMAIL] Mensagem {payload['id']} para {payload['to']} movida para dead-letter: {error}")
+        return
+    due = time.time() + RETRY_BASE_DELAY * (2 ** (payload["attempts"] - 1))
+    redis_client.zadd(RETRY_KEY, {json.dumps(payload): due})
+
+
+def _promote_due_retries(now=None):
+    due = redis_client.zrangebyscore(RETRY_KEY, "-inf", now or time.time(), start=0, num=OUTBOX_BATCH)
+    for raw in due:
+        # zrem garante que só um worker promove a mesma mensagem
+        if redis_client.zrem(RETRY_KEY, raw):
+            redis_client.rpush(OUTBOX_KEY, raw)
+
+
+def process_outbox(sender, block_timeout=1):
+    """
+    Processa um lote da fila. Retorna o número de mensagens enviadas.
+    As mensagens ficam na lista de processamento do worker até serem enviadas ou reagendadas:
+    uma queda no meio do lote não as perde (reliable_queue.recover as devolve).
+    """
+    _promote_due_retries()
+    raws = reliable_queue.take(redis_client, OUTBOX_KEY, OUTBOX_BATCH, block_timeout)
+    if not raws:
+        return 0
+    payloads = [json.loads(r) for r in raws]
+    raw_of = {id(p): r for p, r in zip(payloads, raws)}
+
+    sent, failed = deliver_batch(
+        sender, payloads, on_sent=lambda p: reliable_queue.ack(redis_client, OUTBOX_KEY, raw_of[id(p)]),
+    )
+    for payload, permanent, error in failed:
+        _schedule_retry_or_dead(payload, permanent, error)
+        reliable_queue.ack(redis_client, OUTBOX_KEY, raw_of[id(payload)])
+    return len(sent)
+
+
+def _fail_in_flight(error):
+    """Erro inesperado no meio do lote: o que sobrou conta como uma tentativa falha."""
+    try:
+        for raw in reliable_queue.in_flight(redis_client, OUTBOX_KEY):
+            try:
+                _schedule_retry_or_dead(json.loads(raw), False, error)
+            except ValueError:
+                redis_client.lpush(DEAD_KEY, raw)
+            reliable_queue.ack(redis_client, OUTBOX_KEY, raw)
+    except redis.exceptions.RedisError:
+        pass
+
+
+def _worker_loop():
+    sender = SMTPSender()
+    recovered = False
+    while True:
+        try:
+            if not recovered:
+                reliable_queue.recover(redis_client, OUTBOX_KEY)
+                recovered = True
+            process_outbox(sender)
+            if sender.last_used and time.time() - sender.last_used > SMTP_IDLE_TIMEOUT:
+                sender.close()
+                sender.last_used = 0.0
+        except redis.exceptions.RedisError as e:
+            print(f"[WARN] Outbox de email sem Redis: {e}")
+            sender.close()
+            recovered = False
+            time.sleep(5)
+        except Exception as e:
+            print(f"[EMAIL] Falha no worker de email: {e}")
+            _fail_in_flight(str(e))
+            time.sleep(1)
+
+
+_worker_lock = threading.Lock()
+_worker_thread = None
+
+
+def start_email_worker():
+    """Inicia (uma vez por processo) a thread que consome a outbox."""
+    global _worker_thread
+    with _worker_lock:
+        if _worker_thread is None or not _worker_thread.is_alive():
+            _worker_thread = threading.Thread(target=_worker_loop, name="email-outbox", daemon=True)
+            _worker_thread.start()
+
+
+def enqueue_email(to, subject, body):
+    """
+    Coloca o email na outbox e retorna imediatamente.
+    Sem Redis, envia na hora (comportamento antigo). Retorna False se não foi possível.
+    """
+    if not smtp_configured():
+        print("Erro ao enviar email: credenciais SMTP não configuradas")
+        return False
+
+    payload = build_email(to, subject, body)
+    try:
+        redis_client.rpush(OUTBOX_KEY, json.dumps(payload))
+    except redis.exceptions.RedisError as e:
+        print(f"[WARN] Outbox indisponível, enviando direto: {e}")
+        sender = SMTPSender()
+        try:
+            sent, _ = deliver_batch(sender, [payload])
+        finally:
+            sender.close()
+        return bool(sent)
+
+    start_email_worker()
+    return True
+
+
+def outbox_stats(dead_limit=50):
+    return {
+        "queued": redis_client.llen(OUTBOX_KEY),
+        "retrying": redis_client.zcard(RETRY_KEY),
+        "dead": redis_client.llen(DEAD_KEY),
+        "dead_letters": [json.loads(r) for r in redis_client.lrange(DEAD_KEY, 0, dead_limit - 1)],
+    }
+
+
+def requeue_dead_letters():
+    """Devolve as mensagens da dead-letter para a outbox (ex.: após corrigir o SMTP)."""
+    moved = 0
+    while True:
+        raw = redis_client.rpop(DEAD_KEY)
+        if raw is None:
+            if moved:
+                start_email_worker()
+            return moved
+        payload = json.loads(raw)
+        payload["attempts"] = 0
+        redis_client.rpush(OUTBOX_KEY, json.dumps(payload))
+        moved += 1
@@ -0,0 +1,216 @@
+import os, json, time, threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import redis
+from extensions import redis_client
+from utils import circuit_breaker
+from utils.cancellation import CancelToken
+from utils.metrics import incr
+from utils.model_router import provider_of
+from utils.retry import RetryPolicy, remaining_budget
+
+# Hedging é opt-in por modelo:
+# HEDGED_MODELS='{"deepseek/deepseek-r1-0528:free": {"backup": "gpt-4o-mini", "percentile": 0.9}}'
+HEDGED_MODELS = json.loads(os.getenv("HEDGED_MODELS", "{}") or "{}")
+DEFAULT_PERCENTILE = 0.95
+# Sem amostras suficientes de latência, dispara o hedge após este atraso
+DEFAULT_DELAY_SECONDS = float(os.getenv("HEDGE_DEFAULT_DELAY_SECONDS", 8))
+MIN_DELAY_SECONDS = 1.0
+MIN_SAMPLES = 20
+# Teto de gasto: no máximo MAX_PER_MINUTE hedges e MAX_RATIO das chamadas com hedge por minuto
+MAX_PER_MINUTE = int(os.getenv("HEDGE_MAX_PER_MINUTE", 30))
+MAX_RATIO = float(os.getenv("HEDGE_MAX_RATIO", 0.1))
+
+_pool = ThreadPoolExecutor(max_workers=int(os.getenv("HEDGE_WORKERS", 16)), thread_name_prefix="hedge")
+
+
+def hedge_config(model, providers=None):
+    """Configuração de hedge do modelo, se houver (e se o backup for de um dos `providers`)."""
+    cfg = HEDGED_MODELS.get(model)
+    if not cfg or not cfg.get("backup"):
+        return None
+    if providers is not None and provider_of(cfg["backup"]) not in providers:
+        return None
+    return cfg
+
+
+def hedge_delay(model, percentile):
+    """Atraso (s) antes do hedge: percentil de latência observado pelo circuit breaker."""
+    scope = f"{provider_of(model)}:{model}"
+    try:
+        samples = sorted(int(v) for v in redis_client.lrange(circuit_breaker._KEY.format(scope, "lat"), 0, -1))
+    except redis.exceptions.RedisError:
+        return DEFAULT_DELAY_SECONDS
+    if len(samples) < MIN_SAMPLES:
+        return DEFAULT_DELAY_SECONDS
+    return max(MIN_DELAY_SECONDS, circuit_breaker.latency_percentile(scope, percentile, samples) / 1000)
+
+
+def _backup_available(backup):
+    try:
+        return circuit_breaker.current_state(provider_of(backup), backup) != circuit_breaker.OPEN
+    except redis.exceptions.RedisError:
+        return False
+
+
+def _minute_keys():
+    minute = int(time.time() // 60)
+    return f"hedge:calls:{minute}", f"hedge:fired:{minute}"
+
+
+def _count_call():
+    calls_key, _ = _minute_keys()
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.incr(calls_key)
+        pipe.expire(calls_key, 120)
+        pipe.execute()
+    except redis.exceptions.RedisError:
+        pass
+
+
+def _take_budget():
+    """Reserva um hedge dentro dos tetos; sem Redis não faz hedge (não arrisca gasto dobrado)."""
+    calls_key, fired_key = _minute_keys()
+    try:
+        calls = int(redis_client.get(calls_key) or 0)
+        fired = redis_client.incr(fired_key)
+        redis_client.expire(fired_key, 120)
+    except redis.exceptions.RedisError:
+        return False
+    if fired > MAX_PER_MINUTE or fired > max(1, int(calls * MAX_RATIO)):
+        try:
+            redis_client.decr(fired_key)
+        except redis.exceptions.RedisError:
+            pass
+        return False
+    return True
+
+
+class _LegSink:
+    """Deltas de uma perna: repassados ao stream da geração enquanto `live`, senão guardados."""
+
+    def __init__(self, target, live):
+        self.target = target
+        self.live = live
+        self.parts = []
+        self._lock = threading.Lock()
+
+    def write(self, delta):
+        with self._lock:
+            self.parts.append(delta)
+            if self.live and self.target is not None:
+                self.target.write(delta)
+
+    def restart(self):
+        with self._lock:
+            self.parts = []
+            if self.live and self.target is not None:
+                self.target.restart()
+
+    def hold(self):
+        with self._lock:
+            self.live = False
+
+    def publish(self):
+        """A perna venceu: o stream passa a ter só o texto dela."""
+        with self._lock:
+            if self.live:
+                return
+            self.live = True
+            if self.target is not None:
+                self.target.restart()
+                for delta in self.parts:
+                    self.target.write(delta)
+
+
+class HedgeLeg:
+    """
+    Uma das chamadas de um hedge. Cada perna tem o próprio CancelToken (a perdedora é abortada
+    e o cancelamento da geração chega às duas), o próprio buffer de deltas e o prazo da
+    requisição, já que as threads do pool não têm o flask.g.
+    """
+
+    def __init__(self, model, parent=None, sink=None, deadline=None, live=True):
+        self.model = model
+        self.cancel = CancelToken(f"hedge:{model}", getattr(parent, "user_id", None))
+        self.sink = _LegSink(sink, live)
+        self.deadline = deadline
+        self.first_byte = threading.Event()
+        self._parent = parent
+        self._unlink = parent.on_cancel(lambda: self.cancel.cancel(parent.reason)) if parent else (lambda: None)
+
+    def responded(self):
+        """Chamado quando o provedor começa a responder (o timer do hedge é o primeiro byte)."""
+        self.first_byte.set()
+
+    def policy(self):
+        return RetryPolicy(deadline=max(1.0, self.deadline - time.monotonic()))
+
+    def abort(self):
+        self.cancel.cancel("hedge_lost")
+
+    def close(self):
+        self._unlink()
+        # geração cancelada: o parcial é o da perna que estava sendo publicada
+        if self._parent is not None and self._parent.cancelled and self.sink.live:
+            self._parent.keep_partial(self.cancel.partial_text)
+
+
+def _succeeded(future):
+    if future.exception() is not None:
+        return False
+    status = getattr(future.result(), "status_code", 200)
+    return 200 <= status < 300
+
+
+def hedged_call(model, call_for_model, providers=None, cancel=None, sink=None):
+    """
+    Executa call_for_model(model, leg). Se o modelo tem hedge configurado e o primeiro byte
+    da resposta não chegou até o percentil de latência configurado, dispara
+    call_for_model(backup, leg) em paralelo (respeitando o orçamento) e devolve a primeira
+    resposta bem-sucedida; a perdedora é abortada pelo CancelToken da sua perna.
+    Sem hedge, leg é None e a chamada usa `cancel`/`sink` diretamente.
+    Retorna (modelo_vencedor, resposta).
+    """
+    cfg = hedge_config(model, providers)
+    if not cfg:
+        return model, call_for_model(model, None)
+
+    backup = cfg["backup"]
+    _count_call()
+    incr("hedge_eligible", model=model)
+    deadline = time.monotonic() + remaining_budget()
+    legs = {}
+    primary_leg = HedgeLeg(model, cancel, sink, deadline)
+    primary = _pool.submit(call_for_model, model, primary_leg)
+    primary.add_done_callback(lambda _f: primary_leg.responded())
+    legs[primary] = primary_leg
+    try:
+        responded = primary_leg.first_byte.wait(hedge_delay(model, float(cfg.get("percentile", DEFAULT_PERCENTILE))))
+        if responded or not _backup_available(backup) or not _take_budget():
+            return model, primary.result()
+
+        incr("hedge_fired", model=model, backup=backup)
+        primary_leg.sink.hold()
+        backup_leg = HedgeLeg(backup, cancel, sink, deadline, live=False)
+        secondary = _pool.submit(call_for_model, backup, backup_leg)
+        legs[secondary] = backup_leg
+        pending = set(legs)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if _succeeded(future):
+                    leg = legs[future]
+                    leg.sink.publish()
+                    for loser in pending:
+                        legs[loser].abort()
+                    incr("hedge_won", model=model, winner="backup" if leg is backup_leg else "primary")
+                    return leg.model, future.result()
+
+        # nenhuma deu certo: devolve o resultado (ou erro) da principal, como sem hedge
+        incr("hedge_both_failed", model=model)
+        primary_leg.sink.publish()
+        return model, primary.result()
+    finally:
+        for leg in legs.values():
+            leg.close()
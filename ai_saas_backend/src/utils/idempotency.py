@@ -0,0 +1,165 @@
+import os, json, time, hashlib, threading
+from functools import wraps
+import redis
+from flask import request, jsonify, make_response
+from flask_jwt_extended import get_jwt_identity
+from extensions import redis_client
+from utils.metrics import incr
+
+HEADER = "Idempotency-Key"
+# Resultado guardado para repetições (s)
+RESULT_TTL = int(os.getenv("IDEMPOTENCY_TTL", 24 * 3600))
+# Reserva enquanto a primeira requisição está em andamento: renovada a cada IN_PROGRESS_TTL/3
+# enquanto ela roda (vídeo, imagem na fila com retentativas) e expira só se o processo morrer
+IN_PROGRESS_TTL = int(os.getenv("IDEMPOTENCY_IN_PROGRESS_TTL", 300))
+# Quanto uma repetição espera pela requisição em andamento antes de responder 409
+WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", 120))
+POLL_SECONDS = 0.25
+MAX_KEY_LENGTH = 255
+# Respostas que não são guardadas: a repetição deve poder tentar de novo
+_RETRYABLE_STATUS = {409, 429}
+
+_KEY = "idem:{}:{}:{}"
+
+
+def request_fingerprint():
+    """Hash do corpo da requisição, para recusar a mesma chave com outro conteúdo."""
+    digest = hashlib.sha256()
+    if request.mimetype == "multipart/form-data":
+        for k in sorted(request.form):
+            digest.update(f"{k}={request.form.getlist(k)}".encode("utf-8"))
+        for k in sorted(request.files):
+            for f in request.files.getlist(k):
+                digest.update(f"{k}:{f.filename}:{_file_hash(f)}".encode("utf-8"))
+    else:
+        digest.update(request.get_data(cache=True))
+    return digest.hexdigest()
+
+
+def _file_hash(upload):
+    """Hash do conteúdo do arquivo enviado; o stream volta ao início para a rota salvá-lo."""
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: upload.stream.read(64 * 1024), b""):
+        digest.update(chunk)
+    upload.stream.seek(0)
+    return digest.hexdigest()
+
+
+def _replay(stored):
+    resp = make_response(stored["body"], stored["status"])
+    resp.mimetype = stored.get("mimetype") or "application/json"
+    resp.headers["Idempotent-Replayed"] = "true"
+    return resp
+
+
+def _in_progress():
+    resp = make_response(jsonify({"error": "Requisição original ainda em andamento"}), 409)
+    resp.headers["Retry-After"] = "5"
+    return resp
+
+
+def _wait_for_result(key):
+    deadline = time.monotonic() + WAIT_SECONDS
+    while time.monotonic() < deadline:
+        time.sleep(POLL_SECONDS)
+        raw = redis_client.get(key)
+        if raw is None:
+            return None
+        stored = json.loads(raw)
+        if stored["state"] == "done":
+            return stored
+    return "pending"
+
+
+def idempotent(operation):
+    """
+    Suporte ao cabeçalho Idempotency-Key. Usar abaixo de @jwt_required() e acima de @cost_limited.
+    A primeira requisição reserva a chave e guarda a resposta; repetições recebem a resposta
+    guardada (ou esperam a que está em andamento) sem chamar o provedor de novo.
+    Sem o cabeçalho ou sem Redis, a rota segue normalmente.
+    """
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            client_key = (request.headers.get(HEADER) or "").strip()
+            if not client_key:
+                return fn(*args, **kwargs)
+            if len(client_key) > MAX_KEY_LENGTH:
+                return jsonify({"error": f"{HEADER} muito longa (máx. {MAX_KEY_LENGTH})"}), 400
+
+            key = _KEY.format(get_jwt_identity(), operation, client_key)
+            fingerprint = request_fingerprint()
+            try:
+                reserved = redis_client.set(
+                    key, json.dumps({"state": "in_progress", "fingerprint": fingerprint}),
+                    nx=True, ex=IN_PROGRESS_TTL,
+                )
+                if not reserved:
+                    raw = redis_client.get(key)
+                    stored = json.loads(raw) if raw else None
+                    if stored and stored["fingerprint"] != fingerprint:
+                        incr("idempotency", operation=operation, result="mismatch")
+                        return jsonify({"error": f"{HEADER} já usada com outra requisição"}), 422
+                    if stored and stored["state"] == "in_progress":
+                        incr("idempotency", operation=operation, result="wait")
+                        stored = _wait_for_result(key)
+                        if stored == "pending":
+                            return _in_progress()
+                    if stored:
+                        incr("idempotency", operation=operation, result="replay")
+                        return _replay(stored)
+                    # a original falhou e liberou a chave: esta assume
+                    reserved = redis_client.set(
+                        key, json.dumps({"state": "in_progress", "fingerprint": fingerprint}),
+                        nx=True, ex=IN_PROGRESS_TTL,
+                    )
+                    if not reserved:
+                        return _in_progress()
+            except redis.exceptions.RedisError as e:
+                print(f"[WARN] Idempotência indisponível (Redis): {e}")
+                return fn(*args, **kwargs)
+
+            stop = threading.Event()
+            renewer = threading.Thread(target=_keep_reserved, args=(key, stop), name="idempotency-renew", daemon=True)
+            renewer.start()
+            try:
+                resp = make_response(fn(*args, **kwargs))
+            except Exception:
+                _release(key)
+                raise
+            finally:
+                # parado antes de gravar o resultado: um EXPIRE atrasado encurtaria o RESULT_TTL
+                stop.set()
+                renewer.join()
+
+            if resp.status_code >= 500 or resp.status_code in _RETRYABLE_STATUS or resp.is_streamed:
+                _release(key)
+                return resp
+            try:
+                redis_client.set(key, json.dumps({
+                    "state": "done",
+                    "fingerprint": fingerprint,
+                    "status": resp.status_code,
+                    "mimetype": resp.mimetype,
+                    "body": resp.get_data(as_text=True),
+                }), ex=RESULT_TTL)
+            except redis.exceptions.RedisError as e:
+                print(f"[WARN] Falha ao guardar resposta idempotente: {e}")
+            return resp
+        return wrapper
+    return decorator
+
+
+def _keep_reserved(key, stop):
+    while not stop.wait(IN_PROGRESS_TTL / 3):
+        try:
+            redis_client.expire(key, IN_PROGRESS_TTL)
+        except redis.exceptions.RedisError:
+            pass
+
+
+def _release(key):
+    try:
+        redis_client.delete(key)
+    except redis.exceptions.RedisError:
+        pass
@@ -0,0 +1,104 @@
+import re, math, unicodedata
+from functools import lru_cache
+from utils.metrics import incr
+
+# Detector local de intenção de imagem: evita uma chamada extra ao provedor em todo turno.
+# Palavras-chave dão o atalho (sem nenhuma → não é pedido de imagem); um classificador
+# linear pequeno sobre sinais do texto decide os casos ambíguos.
+
+IMAGE_NOUNS = (
+    "imagem", "imagens", "foto", "fotos", "fotografia", "desenho", "ilustracao", "ilustracoes",
+    "logotipo", "wallpaper", "papel de parede", "avatar", "retrato", "pintura", "icone",
+    "banner", "thumbnail", "poster", "cartaz", "meme", "sticker", "figurinha",
+    "image", "picture", "photo", "drawing", "illustration", "painting", "artwork", "icon",
+)
+CREATE_VERBS = (
+    "gere", "gera", "gerar", "gerando", "crie", "cria", "criar", "faca", "fazer", "desenhe", "desenha",
+    "desenhar", "pinte", "pintar", "ilustre", "ilustrar", "produza", "produzir", "monte", "renderize",
+    "generate", "create", "draw", "paint", "render", "design",
+)
+# Substantivos com outros sentidos comuns ("logo" advérbio, "arte moderna", "figura 3"):
+# só contam quando vêm logo após um verbo de criação ("faça um logo", "crie uma arte")
+AMBIGUOUS_NOUNS = ("logo", "arte", "figura")
+_AMBIGUOUS_REQUEST = re.compile(
+    rf"\b(?:{'|'.join(map(re.escape, CREATE_VERBS))}) (?:(?:um|uma|o|a|meu|minha|novo|nova|an|the|new) )?"
+    rf"(?:{'|'.join(AMBIGUOUS_NOUNS)})\b"
+)
+# Verbos que, isolados, já indicam imagem ("desenhe um gato")
+STRONG_VERBS = ("desenhe", "desenha", "desenhar", "pinte", "pintar", "ilustre", "ilustrar", "renderize", "draw", "paint", "render")
+# Perguntas sobre a capacidade, não pedidos ("você consegue gerar imagens?"):
+# pergunta curta que termina no substantivo, sem descrever o que desenhar
+CAPABILITY_PATTERNS = (
+    r"^(voce |vc |tu )?(consegue|pode|podes|sabe|e capaz de|gera|cria|faz)\b.{0,30}\b(imagem|imagens|fotos?|desenhos?|figuras?)\s*\?$",
+    r"\b(da|dá) (pra|para) (gerar|criar|fazer) (imagem|imagens|fotos?|desenhos?)\s*\?$",
+    r"^(can|could|do) you\b.{0,30}\b(images?|pictures?|photos?|drawings?)\s*\?$",
+    r"\bis it possible to\b",
+)
+# Pedidos sobre uma imagem existente (descrever/analisar), não de geração
+ANALYSIS_WORDS = (
+    "descreva", "descrever", "analise", "analisar", "explique", "o que tem", "o que ha", "leia", "extraia",
+    "resuma", "resumir", "resumo", "enviei", "mandei", "anexei",
+    "nesta imagem", "nessa imagem", "na imagem", "da imagem", "describe", "analyze", "in this image",
+    "summary", "summarize", "uploaded",
+)
+
+# Pesos do classificador (bias + sinais)
+WEIGHTS = {
+    "bias": -2.0,
+    "noun": 1.6,
+    "verb": 1.2,
+    "strong_verb": 2.6,
+    "verb_near_noun": 1.8,
+    "imperative_start": 0.8,
+    "capability": -3.0,
+    "analysis": -2.8,
+    "question": -0.7,
+    "long_text": -0.8,
+}
+THRESHOLD = 0.5
+
+
+def normalize(prompt):
+    text = unicodedata.normalize("NFKD", prompt or "")
+    text = "".join(c for c in text if not unicodedata.combining(c)).lower()
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def _find(text, words):
+    return [m.start() for w in words for m in re.finditer(rf"\b{re.escape(w)}\b", text)]
+
+
+def features(text):
+    nouns = _find(text, IMAGE_NOUNS)
+    verbs = _find(text, CREATE_VERBS)
+    return {
+        "noun": bool(nouns),
+        "verb": bool(verbs),
+        "strong_verb": bool(_find(text, STRONG_VERBS)),
+        "verb_near_noun": any(0 < n - v <= 40 for v in verbs for n in nouns) or bool(_AMBIGUOUS_REQUEST.search(text)),
+        "imperative_start": any(text.startswith(v) for v in CREATE_VERBS),
+        "capability": any(re.search(p, text) for p in CAPABILITY_PATTERNS),
+        "analysis": bool(_find(text, ANALYSIS_WORDS)),
+        "question": text.endswith("?"),
+        "long_text": len(text) > 600,
+    }
+
+
+def score(text):
+    feats = features(text)
+    z = WEIGHTS["bias"] + sum(WEIGHTS[k] for k, on in feats.items() if on)
+    return 1 / (1 + math.exp(-z))
+
+
+@lru_cache(maxsize=4096)
+def _wants_image_normalized(text):
+    if not text or not (_find(text, IMAGE_NOUNS) or _find(text, STRONG_VERBS) or _AMBIGUOUS_REQUEST.search(text)):
+        return False
+    return score(text) >= THRESHOLD
+
+
+def wants_image(prompt):
+    """True se o prompt pede a geração de uma imagem. Local e com cache por prompt normalizado."""
+    result = _wants_image_normalized(normalize(prompt))
+    incr("image_intent", result="yes" if result else "no")
+    return result
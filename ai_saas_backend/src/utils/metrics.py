@@ -0,0 +1,73 @@
+import redis
+from extensions import redis_client
+
+# Métricas simples agregadas no Redis (compartilhadas entre nós), lidas em /api/admin/metrics
+COUNTERS_KEY = "metrics:counters"
+TIMINGS_KEY = "metrics:timings"
+# Limites (ms) do histograma de tempos; o último bucket é +Inf
+TIMING_BUCKETS = (50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+
+def _field(name, labels):
+    if not labels:
+        return name
+    return name + "{" + ",".join(f"{k}={labels[k]}" for k in sorted(labels)) + "}"
+
+
+def incr(name, amount=1, **labels):
+    try:
+        redis_client.hincrby(COUNTERS_KEY, _field(name, labels), amount)
+    except redis.exceptions.RedisError:
+        pass
+
+
+def observe(name, value_ms, **labels):
+    """Registra uma duração (ms): contagem, soma e bucket do histograma."""
+    field = _field(name, labels)
+    bucket = next((b for b in TIMING_BUCKETS if value_ms <= b), "inf")
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.hincrby(TIMINGS_KEY, f"{field}|count", 1)
+        pipe.hincrbyfloat(TIMINGS_KEY, f"{field}|sum", float(value_ms))
+        pipe.hincrby(TIMINGS_KEY, f"{field}|le_{bucket}", 1)
+        pipe.execute()
+    except redis.exceptions.RedisError:
+        pass
+
+
+def _percentile(buckets, count, q):
+    target = count * q
+    seen = 0
+    for bound in list(TIMING_BUCKETS) + ["inf"]:
+        seen += buckets.get(str(bound), 0)
+        if seen >= target:
+            return bound
+    return "inf"
+
+
+def snapshot():
+    counters = {k: int(v) for k, v in redis_client.hgetall(COUNTERS_KEY).items()}
+
+    raw = redis_client.hgetall(TIMINGS_KEY)
+    timings = {}
+    for key, value in raw.items():
+        field, _, part = key.rpartition("|")
+        entry = timings.setdefault(field, {"count": 0, "sum_ms": 0.0, "buckets": {}})
+        if part == "count":
+            entry["count"] = int(value)
+        elif part == "sum":
+            entry["sum_ms"] = float(value)
+        elif part.startswith("le_"):
+            entry["buckets"][part[3:]] = int(value)
+
+    for entry in timings.values():
+        count = entry["count"]
+        entry["avg_ms"] = round(entry["sum_ms"] / count, 1) if count else 0
+        entry["p50_ms"] = _percentile(entry["buckets"], count, 0.5) if count else 0
+        entry["p95_ms"] = _percentile(entry["buckets"], count, 0.95) if count else 0
+
+    return {"counters": counters, "timings": timings}
+
+
+def reset():
+    redis_client.delete(COUNTERS_KEY, TIMINGS_KEY)
@@ -0,0 +1,169 @@
+import os, json, time
+import redis
+from extensions import redis_client
+from utils import circuit_breaker
+
+GEMINI_MODELS = ("gemini-2.5-pro", "gemini-2.5-flash", "gemini-2.5-flash-lite", "gemini-3-pro-preview")
+OPENROUTER_PREFIXES = ("deepseek/", "google/", "tngtech/", "qwen/", "z-ai/")
+OPENROUTER_SUFFIX = ":free"
+
+
+def is_gemini_model(model: str) -> bool:
+    return model in GEMINI_MODELS
+
+def is_openrouter_model(model: str) -> bool:
+    return bool(model) and ("/" in model or model.endswith(OPENROUTER_SUFFIX) or model.startswith(OPENROUTER_PREFIXES))
+
+def is_anthropic_model(model: str) -> bool:
+    return bool(model) and model.startswith("claude-")
+
+def is_perplexity_model(model: str) -> bool:
+    return bool(model) and model.startswith("sonar")
+
+def provider_of(model: str) -> str:
+    if is_gemini_model(model):
+        return "gemini"
+    if is_openrouter_model(model):
+        return "openrouter"
+    if is_anthropic_model(model):
+        return "anthropic"
+    if is_perplexity_model(model):
+        return "perplexity"
+    return "openai"
+
+
+# Roteamento declarativo: fallbacks em ordem de preferência para cada modelo pedido.
+# Sobrescreva/complemente com MODEL_ROUTING='{"chains": {...}, "disabled": [...]}'
+DEFAULT_ROUTING = {
+    "chains": {
+        "gemini-2.5-pro": ["gemini-2.5-flash"],
+        "gemini-3-pro-preview": ["gemini-2.5-flash"],
+        "claude-opus-4-5": ["claude-sonnet-4-5", "claude-haiku-4-5"],
+        "sonar-reasoning-pro": ["sonar-reasoning", "sonar"],
+        "sonar-reasoning": ["sonar"],
+        # deep-research pode exigir superfície/endpoint diferentes
+        "sonar-deep-research": ["sonar-reasoning", "sonar"],
+    },
+    # fora de rotação (ex.: sem quota): o roteador vai direto para o fallback
+    "disabled": ["gemini-2.5-pro", "gemini-3-pro-preview"],
+}
+
+
+def _load_routing():
+    override = json.loads(os.getenv("MODEL_ROUTING", "{}") or "{}")
+    return {
+        "chains": {**DEFAULT_ROUTING["chains"], **override.get("chains", {})},
+        "disabled": override.get("disabled", DEFAULT_ROUTING["disabled"]),
+    }
+
+
+ROUTING = _load_routing()
+
+# Acima disso o modelo é considerado degradado e vai para o fim da fila
+MAX_P95_MS = float(os.getenv("ROUTER_MAX_P95_MS", 30000))
+MAX_ERROR_RATE = float(os.getenv("ROUTER_MAX_ERROR_RATE", 0.25))
+MIN_HEADROOM = float(os.getenv("ROUTER_MIN_HEADROOM", 0.05))
+QUOTA_TTL = 120
+
+_QUOTA_KEY = "router:quota:{}"
+
+# (limite, restante) de requisições/tokens por família de cabeçalhos
+_QUOTA_HEADERS = (
+    ("x-ratelimit-limit-requests", "x-ratelimit-remaining-requests"),
+    ("x-ratelimit-limit-tokens", "x-ratelimit-remaining-tokens"),
+    ("anthropic-ratelimit-requests-limit", "anthropic-ratelimit-requests-remaining"),
+    ("anthropic-ratelimit-tokens-limit", "anthropic-ratelimit-tokens-remaining"),
+)
+
+
+def fallback_chain(model):
+    return [model] + [m for m in ROUTING["chains"].get(model, []) if m != model]
+
+
+def record_quota(provider, model, status, headers):
+    """Guarda a folga de cota informada pelo provedor (cabeçalhos de rate limit / 429)."""
+    if not model:
+        return
+    headroom = None
+    if status == 429:
+        headroom = 0.0
+    elif headers:
+        ratios = []
+        for limit_h, remaining_h in _QUOTA_HEADERS:
+            try:
+                limit, remaining = float(headers.get(limit_h)), float(headers.get(remaining_h))
+            except (TypeError, ValueError):
+                continue
+            if limit > 0:
+                ratios.append(max(0.0, remaining / limit))
+        headroom = min(ratios) if ratios else None
+    if headroom is None:
+        return
+    try:
+        redis_client.setex(_QUOTA_KEY.format(f"{provider}:{model}"), QUOTA_TTL, headroom)
+    except redis.exceptions.RedisError:
+        pass
+
+
+def model_health(model):
+    provider = provider_of(model)
+    scope = f"{provider}:{model}"
+    stats = circuit_breaker.window_stats(scope)
+    p50, p95 = circuit_breaker.latency_percentiles(scope)
+    state = circuit_breaker.current_state(provider, model)
+    headroom = redis_client.get(_QUOTA_KEY.format(scope))
+    return {
+        **stats,
+        "provider": provider,
+        "state": state,
+        "p50_ms": p50,
+        "p95_ms": p95,
+        "headroom": float(headroom) if headroom is not None else 1.0,
+        "health": circuit_breaker.health_score(stats),
+    }
+
+
+class ModelUnavailableError(Exception):
+    """Todos os modelos da cadeia estão desativados pelo operador (as rotas respondem 503)."""
+
+
+def route(model, allowed=None):
+    """
+    Ordem em que os modelos devem ser tentados para atender `model`.
+    Segue a cadeia declarativa, filtra o que o plano não permite (`allowed`) e o que está
+    desativado, pula circuitos abertos e manda para o fim os degradados
+    (p95, taxa de erro ou folga de cota), ordenados pela saúde.
+    Levanta ModelUnavailableError se a cadeia inteira estiver desativada.
+    """
+    chain = [m for m in fallback_chain(model) if m == model or allowed is None or allowed(m)]
+    candidates = [m for m in chain if m not in ROUTING["disabled"]]
+    if not candidates:
+        raise ModelUnavailableError(f"Modelo {model} indisponível no momento")
+
+    healthy, degraded = [], []
+    for m in candidates:
+        try:
+            h = model_health(m)
+        except redis.exceptions.RedisError:
+            healthy.append(m)
+            continue
+        if h["state"] == circuit_breaker.OPEN:
+            continue
+        if h["p95_ms"] > MAX_P95_MS or h["error_rate"] > MAX_ERROR_RATE or h["headroom"] < MIN_HEADROOM:
+            degraded.append((h["health"] * max(h["headroom"], 0.01), m))
+        else:
+            healthy.append(m)
+
+    ordered = healthy + [m for _, m in sorted(degraded, key=lambda x: -x[0])]
+    # tudo com circuito aberto: devolve a cadeia para falhar rápido com o erro do provedor
+    return ordered or candidates
+
+
+def routing_table():
+    models = sorted({m for k, v in ROUTING["chains"].items() for m in [k, *v]})
+    return {
+        "chains": ROUTING["chains"],
+        "disabled": ROUTING["disabled"],
+        "models": {m: model_health(m) for m in models},
+        "generated_at": time.time(),
+    }
@@ -0,0 +1,73 @@
+import copy
+from utils.metrics import incr
+
+# Cache de prompt nos provedores. Todo turno reenvia o mesmo system e o mesmo histórico;
+# com o prefixo estável primeiro e idêntico byte a byte entre turnos, o provedor cobra
+# (e processa) só a parte nova:
+# - Anthropic: breakpoints explícitos (cache_control) no system e no fim do histórico
+# - OpenAI: cache automático de prefixo; prompt_cache_key mantém o chat no mesmo nó de cache
+# - Gemini: cache implícito de prefixo (2.5+); basta não mudar os bytes do histórico
+#   (anexos inline em vez de re-upload, que gera uma URI nova a cada turno)
+
+EPHEMERAL = {"type": "ephemeral"}
+
+
+def anthropic_system(text):
+    """System da Anthropic em bloco, com breakpoint: é o prefixo comum a todos os turnos."""
+    return [{"type": "text", "text": text, "cache_control": dict(EPHEMERAL)}]
+
+
+def mark_anthropic_history(messages):
+    """
+    Breakpoints no último bloco do histórico antigo (penúltima mensagem) e da mensagem atual.
+    O do fim grava o prompt inteiro para o próximo turno; o do histórico lê o que o turno
+    anterior gravou. Com o do system são 3 dos 4 permitidos pela API.
+    """
+    marked = copy.deepcopy(messages)
+    for idx in sorted({len(marked) - 2, len(marked) - 1}):
+        if idx >= 0 and marked[idx].get("content"):
+            marked[idx]["content"][-1]["cache_control"] = dict(EPHEMERAL)
+    return marked
+
+
+def openai_cache_key(chat_id):
+    """prompt_cache_key por chat: turnos do mesmo chat compartilham o prefixo mais longo."""
+    return f"chat:{chat_id}" if chat_id else None
+
+
+def anthropic_usage(usage):
+    """
+    (prompt, completion, total, cached) do usage da Anthropic. input_tokens não inclui o
+    que foi lido/gravado no cache; somamos para prompt_tokens seguir o significado da OpenAI.
+    """
+    usage = usage or {}
+    fields = ("input_tokens", "cache_read_input_tokens", "cache_creation_input_tokens")
+    if all(usage.get(f) is None for f in fields) and usage.get("output_tokens") is None:
+        return None, None, None, None
+    prompt = sum(usage.get(f) or 0 for f in fields)
+    completion = usage.get("output_tokens")
+    return prompt, completion, prompt + (completion or 0), usage.get("cache_read_input_tokens")
+
+
+def openai_cached_tokens(usage):
+    """Tokens do prompt servidos do cache (chat/completions; OpenRouter repassa o mesmo campo)."""
+    return ((usage or {}).get("prompt_tokens_details") or {}).get("cached_tokens")
+
+
+def gemini_usage(meta):
+    """(prompt, completion, total, cached) do usage_metadata do Gemini."""
+    if meta is None:
+        return None, None, None, None
+    return (
+        getattr(meta, "prompt_token_count", None),
+        getattr(meta, "candidates_token_count", None),
+        getattr(meta, "total_token_count", None),
+        getattr(meta, "cached_content_token_count", None),
+    )
+
+
+def record(model, prompt_tokens, cached_tokens):
+    """Contadores para acompanhar a taxa de acerto em /api/admin/metrics."""
+    if prompt_tokens:
+        incr("prompt_cache.prompt_tokens", prompt_tokens, model=model)
+        incr("prompt_cache.cached_tokens", cached_tokens or 0, model=model)
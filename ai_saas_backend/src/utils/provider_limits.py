@@ -0,0 +1,250 @@
+import os, json, time, uuid, random
+from contextlib import contextmanager
+from urllib.parse import urlparse
+import redis
+from flask import jsonify, make_response
+from extensions import redis_client
+from utils.metrics import incr, observe
+
+# Limites por provedor e, opcionalmente, por modelo ("provedor:modelo").
+# concurrency = chamadas simultâneas em todos os nós; rps = taxa do token bucket; burst = capacidade.
+DEFAULT_PROVIDER_LIMITS = {
+    "openai": {"concurrency": 50, "rps": 30},
+    "openrouter": {"concurrency": 20, "rps": 10},
+    "anthropic": {"concurrency": 20, "rps": 10},
+    "perplexity": {"concurrency": 10, "rps": 5},
+    "gemini": {"concurrency": 20, "rps": 10},
+    "openai:gpt-image-1": {"concurrency": 5, "rps": 1},
+    "gemini:veo-3.0-generate-001": {"concurrency": 2, "rps": 0.2},
+    "gemini:veo-3.0-fast-generate-001": {"concurrency": 4, "rps": 0.5},
+}
+# Sobrescreve/complementa via JSON, ex.: {"openai:gpt-4o": {"concurrency": 10, "rps": 5}}
+PROVIDER_LIMITS = {**DEFAULT_PROVIDER_LIMITS, **json.loads(os.getenv("PROVIDER_LIMITS", "{}") or "{}")}
+
+# Tempo máximo na fila antes de desistir
+QUEUE_TIMEOUT = float(os.getenv("PROVIDER_QUEUE_TIMEOUT", 30))
+# Retry-After (s) sugerido ao cliente quando não houve vaga
+BUSY_RETRY_AFTER = int(os.getenv("PROVIDER_BUSY_RETRY_AFTER", 10))
+# Lease do slot: protege contra processos que morrem segurando a vaga
+LEASE_SECONDS = int(os.getenv("PROVIDER_LEASE_SECONDS", 180))
+# Quem parou de consultar a fila por mais que isso é removido dela
+WAITER_STALE_MS = 10_000
+
+_KEY = "plimit:{}:{}"
+_SEQ_KEY = "plimit:seq"
+
+_PROVIDER_HOSTS = {
+    "api.openai.com": "openai",
+    "openrouter.ai": "openrouter",
+    "api.anthropic.com": "anthropic",
+    "api.perplexity.ai": "perplexity",
+    "generativelanguage.googleapis.com": "gemini",
+}
+
+
+class ProviderBusyError(Exception):
+    """Não houve vaga para o provedor/modelo dentro de QUEUE_TIMEOUT."""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = BUSY_RETRY_AFTER if retry_after is None else retry_after
+
+
+def busy_response(exc):
+    """503 + Retry-After para ProviderBusyError (mesmo formato do scheduler e do admission control)."""
+    resp = make_response(jsonify({"error": str(exc), "retry_after": exc.retry_after}), 503)
+    resp.headers["Retry-After"] = str(exc.retry_after)
+    return resp
+
+
+# KEYS: por escopo [holders, waiting, waiting_ts, bucket]
+# ARGV: now_ms, token, lease_ms, stale_ms, depois por escopo [concurrency, rps, burst]
+# Retorno: {1, 0} concedido | {0, posição} aguardando | {-1, 0} saiu da fila (reenfileirar)
+_ACQUIRE_LUA = """
+local now = tonumber(ARGV[1])
+local token = ARGV[2]
+local lease = tonumber(ARGV[3])
+local stale = tonumber(ARGV[4])
+local scopes = #KEYS / 4
+local granted = true
+local position = 0
+local buckets = {}
+
+for i = 0, scopes - 1 do
+    local holders, waiting, waiting_ts, bucket = KEYS[i*4+1], KEYS[i*4+2], KEYS[i*4+3], KEYS[i*4+4]
+    local limit = tonumber(ARGV[5 + i*3])
+    local rate = tonumber(ARGV[6 + i*3])
+    local burst = tonumber(ARGV[7 + i*3])
+
+    redis.call('ZREMRANGEBYSCORE', holders, '-inf', now)
+    local gone = redis.call('ZRANGEBYSCORE', waiting_ts, '-inf', now - stale)
+    for _, w in ipairs(gone) do
+        redis.call('ZREM', waiting, w)
+        redis.call('ZREM', waiting_ts, w)
+    end
+
+    local rank = redis.call('ZRANK', waiting, token)
+    if not rank then
+        return {-1, 0}
+    end
+    redis.call('ZADD', waiting_ts, now, token)
+    redis.call('PEXPIRE', waiting, stale * 6)
+    redis.call('PEXPIRE', waiting_ts, stale * 6)
+    if rank > position then position = rank end
+
+    -- fila justa: só os primeiros `livres` da fila podem ocupar vagas
+    local free = limit - redis.call('ZCARD', holders)
+    if rank >= free then granted = false end
+
+    local state = redis.call('HMGET', bucket, 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or burst
+    local ts = tonumber(state[2]) or now
+    tokens = math.min(burst, tokens + (now - ts) * rate / 1000)
+    if tokens < 1 then granted = false end
+    buckets[i] = tokens
+end
+
+if not granted then
+    return {0, position}
+end
+
+for i = 0, scopes - 1 do
+    local holders, waiting, waiting_ts, bucket = KEYS[i*4+1], KEYS[i*4+2], KEYS[i*4+3], KEYS[i*4+4]
+    redis.call('ZADD', holders, now + lease, token)
+    redis.call('PEXPIRE', holders, lease)
+    redis.call('ZREM', waiting, token)
+    redis.call('ZREM', waiting_ts, token)
+    redis.call('HSET', bucket, 'tokens', buckets[i] - 1, 'ts', now)
+    redis.call('PEXPIRE', bucket, 60000)
+end
+return {1, 0}
+"""
+
+_script = None
+
+
+def _acquire_script():
+    global _script
+    if _script is None:
+        _script = redis_client.register_script(_ACQUIRE_LUA)
+    return _script
+
+
+def provider_for_url(url):
+    return _PROVIDER_HOSTS.get(urlparse(url).hostname or "", "other")
+
+
+def _scopes(provider, model):
+    scopes = []
+    for name in (provider, f"{provider}:{model}" if model else None):
+        cfg = PROVIDER_LIMITS.get(name) if name else None
+        if cfg:
+            rps = float(cfg.get("rps", 1000))
+            scopes.append((name, int(cfg.get("concurrency", 1000)), rps, float(cfg.get("burst", max(1.0, rps)))))
+    return scopes
+
+
+def _keys(scopes):
+    keys = []
+    for name, *_ in scopes:
+        keys += [_KEY.format(name, "holders"), _KEY.format(name, "waiting"),
+                 _KEY.format(name, "waiting_ts"), _KEY.format(name, "bucket")]
+    return keys
+
+
+def _enqueue(scopes, token):
+    ticket = redis_client.incr(_SEQ_KEY)
+    now_ms = int(time.time() * 1000)
+    pipe = redis_client.pipeline()
+    for name, *_ in scopes:
+        pipe.zadd(_KEY.format(name, "waiting"), {token: ticket}, nx=True)
+        pipe.zadd(_KEY.format(name, "waiting_ts"), {token: now_ms})
+    pipe.execute()
+
+
+def _leave(scopes, token):
+    pipe = redis_client.pipeline()
+    for name, *_ in scopes:
+        pipe.zrem(_KEY.format(name, "holders"), token)
+        pipe.zrem(_KEY.format(name, "waiting"), token)
+        pipe.zrem(_KEY.format(name, "waiting_ts"), token)
+    pipe.execute()
+
+
+def acquire(provider, model=None, timeout=None):
+    """
+    Entra na fila do provedor/modelo e espera por vaga (semáforo + token bucket).
+    Retorna (token, escopos) para release(); token None quando não há limite/Redis.
+    """
+    scopes = _scopes(provider, model)
+    if not scopes:
+        return None, scopes
+    token = uuid.uuid4().hex
+    keys = _keys(scopes)
+    args_tail = [v for _, limit, rps, burst in scopes for v in (limit, rps, burst)]
+    deadline = time.time() + (QUEUE_TIMEOUT if timeout is None else timeout)
+    started = time.time()
+
+    try:
+        _enqueue(scopes, token)
+        while True:
+            status, position = _acquire_script()(
+                keys=keys,
+                args=[int(time.time() * 1000), token, LEASE_SECONDS * 1000, WAITER_STALE_MS, *args_tail],
+            )
+            if status == 1:
+                break
+            if status == -1:
+                _enqueue(scopes, token)
+            if time.time() >= deadline:
+                _leave(scopes, token)
+                incr("provider_queue_timeouts", provider=provider, model=model or "")
+                raise ProviderBusyError(f"Provedor {provider} ocupado, tente novamente em instantes")
+            # quanto mais atrás na fila, mais espaçadas as consultas
+            time.sleep(min(0.5, 0.05 * (1 + int(position) / 4)) * random.uniform(0.8, 1.2))
+    except redis.exceptions.RedisError as e:
+        print(f"[WARN] Limitador de provedor indisponível (Redis): {e}")
+        return None, scopes
+
+    waited_ms = (time.time() - started) * 1000
+    observe("provider_wait_ms", waited_ms, provider=provider)
+    incr("provider_calls", provider=provider, model=model or "")
+    return token, scopes
+
+
+def release(token, scopes):
+    if not token:
+        return
+    try:
+        _leave(scopes, token)
+    except redis.exceptions.RedisError as e:
+        print(f"[WARN] Falha ao liberar vaga do provedor: {e}")
+
+
+@contextmanager
+def provider_slot(provider, model=None, timeout=None):
+    """with provider_slot("openai", "gpt-4o"): ... — segura uma vaga durante a chamada."""
+    token, scopes = acquire(provider, model, timeout=timeout)
+    try:
+        yield
+    finally:
+        release(token, scopes)
+
+
+def queue_depths():
+    """Fila e vagas em uso por escopo configurado."""
+    pipe = redis_client.pipeline(transaction=False)
+    names = list(PROVIDER_LIMITS)
+    for name in names:
+        pipe.zcard(_KEY.format(name, "waiting"))
+        pipe.zcount(_KEY.format(name, "holders"), int(time.time() * 1000), "+inf")
+    values = pipe.execute()
+    return {
+        name: {
+            "waiting": values[i * 2],
+            "in_flight": values[i * 2 + 1],
+            "concurrency": PROVIDER_LIMITS[name].get("concurrency"),
+            "rps": PROVIDER_LIMITS[name].get("rps"),
+        }
+        for i, name in enumerate(names)
+    }
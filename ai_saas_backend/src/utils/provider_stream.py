@@ -0,0 +1,114 @@
+import json
+import requests
+from utils.cancellation import GenerationCancelled
+
+
+class StreamedResponse:
+    """
+    Resposta montada a partir de um stream SSE do provedor, com a mesma interface usada
+    pelas rotas para requests.Response (status_code, headers, json(), text).
+    """
+
+    def __init__(self, status_code, headers, payload):
+        self.status_code = status_code
+        self.headers = headers
+        self._payload = payload
+        # tempo até o primeiro byte (ms), usado como latência pelo circuit breaker
+        self.latency_ms = None
+
+    def json(self):
+        return self._payload
+
+    @property
+    def text(self):
+        return json.dumps(self._payload, ensure_ascii=False)
+
+
+def iter_sse(resp):
+    """Eventos JSON de um stream SSE ("data: {...}"), até o [DONE]."""
+    for line in resp.iter_lines(decode_unicode=True):
+        if not line or not line.startswith("data:"):
+            continue
+        data = line[5:].strip()
+        if data == "[DONE]":
+            return
+        try:
+            yield json.loads(data)
+        except ValueError:
+            continue
+
+
+def _openai_delta(event, usage):
+    if event.get("usage"):
+        usage.update(event["usage"])
+    choices = event.get("choices") or []
+    if not choices:
+        return ""
+    return (choices[0].get("delta") or {}).get("content") or ""
+
+
+def _anthropic_delta(event, usage):
+    kind = event.get("type")
+    if kind == "message_start":
+        usage.update((event.get("message") or {}).get("usage") or {})
+    elif kind == "message_delta":
+        usage.update(event.get("usage") or {})
+    elif kind == "content_block_delta":
+        return (event.get("delta") or {}).get("text") or ""
+    elif kind == "error":
+        raise RuntimeError(f"Erro no stream Anthropic: {event.get('error')}")
+    return ""
+
+
+def _responses_delta(event, state):
+    # OpenAI Responses: o evento final traz a resposta inteira (id, output e usage)
+    kind = event.get("type")
+    if kind == "response.output_text.delta":
+        return event.get("delta") or ""
+    if kind in ("response.completed", "response.incomplete"):
+        state["response"] = event.get("response") or {}
+    elif kind in ("response.failed", "error"):
+        raise RuntimeError(f"Erro no stream Responses: {event.get('response') or event.get('message') or event}")
+    return ""
+
+
+def collect_stream(resp, shape, token=None, on_delta=None):
+    """
+    Lê o stream (shape "openai", "anthropic" ou "responses") e devolve um StreamedResponse no formato
+    da resposta não-stream do provedor. Com `token`, o cancelamento fecha a conexão na hora
+    (o provedor para de gerar) e levanta GenerationCancelled com o texto parcial.
+    """
+    extract = {"anthropic": _anthropic_delta, "responses": _responses_delta}.get(shape, _openai_delta)
+    parts, usage = [], {}
+    unregister = token.on_cancel(resp.close) if token else (lambda: None)
+    try:
+        for event in iter_sse(resp):
+            delta = extract(event, usage)
+            if delta:
+                parts.append(delta)
+                if on_delta:
+                    on_delta(delta)
+            if token and token.cancelled:
+                break
+    except (requests.exceptions.RequestException, OSError, AttributeError, ValueError):
+        # fechar a conexão de outra thread interrompe a leitura com erro de socket
+        if not (token and token.cancelled):
+            raise
+    finally:
+        unregister()
+        resp.close()
+
+    text = "".join(parts)
+    if token and token.cancelled:
+        token.keep_partial(text)
+        raise GenerationCancelled(token.reason, text)
+
+    if shape == "responses":
+        payload = usage.get("response") or {
+            "output": [{"type": "message", "content": [{"type": "output_text", "text": text}]}],
+        }
+    elif shape == "anthropic":
+        payload = {"content": [{"type": "text", "text": text}], "usage": usage}
+    else:
+        payload = {"choices": [{"message": {"role": "assistant", "content": text}}], "usage": usage or None}
+    return StreamedResponse(resp.status_code, resp.headers, payload)
@@ -0,0 +1,174 @@
+import os, time, math, uuid
+from functools import wraps
+import redis
+from flask import jsonify, make_response, g, has_app_context
+from flask_jwt_extended import get_jwt_identity
+from extensions import redis_client, db
+from models import User, PlanFeature, Feature
+
+# Janela deslizante (segundos) compartilhada por todos os nós via Redis
+RATE_LIMIT_WINDOW = int(os.getenv("RATE_LIMIT_WINDOW", 60))
+# Limite usado quando o plano não tem a feature configurada
+DEFAULT_UNITS = int(os.getenv("RATE_LIMIT_DEFAULT_UNITS", 30))
+RATE_KEY = "rate:cost:{}"
+# Lotes (routes/batch_api.py): custo = itens x custo da operação, numa janela longa em que o
+# orçamento do plano vale o mesmo que na janela normal (um lote inteiro não cabe em 60 s)
+BATCH_WINDOW = int(os.getenv("RATE_LIMIT_BATCH_WINDOW", 3600))
+
+# Custo de cada operação em unidades do limite do plano
+OPERATION_COSTS = {
+    "text": 1,
+    "image": 5,
+    "video": 20,
+    # modo comparação: até MAX_COMPARE_MODELS respostas de texto por requisição
+    "compare": 4,
+    "download": 2,
+}
+
+# KEYS[1] = zset do usuário; membros "<id>:<custo>" com score = timestamp (ms)
+# ARGV = agora_ms, janela_ms, limite, custo, id
+_SLIDING_WINDOW_LUA = """
+local key = KEYS[1]
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local limit = tonumber(ARGV[3])
+local cost = tonumber(ARGV[4])
+
+redis.call('ZREMRANGEBYSCORE', key, '-inf', now - window)
+local entries = redis.call('ZRANGE', key, 0, -1, 'WITHSCORES')
+local used = 0
+for i = 1, #entries, 2 do
+    used = used + tonumber(string.match(entries[i], ':(%d+)$'))
+end
+
+if used + cost > limit then
+    if cost > limit then
+        return {0, window, used}
+    end
+    -- espera até que entradas antigas suficientes saiam da janela
+    local to_free = used + cost - limit
+    local freed = 0
+    for i = 1, #entries, 2 do
+        freed = freed + tonumber(string.match(entries[i], ':(%d+)$'))
+        if freed >= to_free then
+            return {0, tonumber(entries[i + 1]) + window - now, used}
+        end
+    end
+    return {0, window, used}
+end
+
+redis.call('ZADD', key, now, ARGV[5] .. ':' .. cost)
+redis.call('PEXPIRE', key, window)
+return {1, 0, used + cost}
+"""
+
+_script = None
+
+
+def _sliding_window():
+    global _script
+    if _script is None:
+        _script = redis_client.register_script(_SLIDING_WINDOW_LUA)
+    return _script
+
+
+def plan_rate_limit(user):
+    """Unidades por janela permitidas pelo plano do usuário (feature rate_limit_units)."""
+    if not user or not user.plan_id:
+        return DEFAULT_UNITS
+    value = (
+        db.session.query(PlanFeature.value)
+        .join(Feature, Feature.id == PlanFeature.feature_id)
+        .filter(PlanFeature.plan_id == user.plan_id, Feature.key == "rate_limit_units")
+        .scalar()
+    )
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return DEFAULT_UNITS
+
+
+def consume(user_id, cost, limit, window=None, entry_id=None):
+    """
+    Tenta consumir `cost` unidades da janela do usuário.
+    Retorna (permitido, retry_after_segundos, usado_na_janela).
+    """
+    window_ms = int((window or RATE_LIMIT_WINDOW) * 1000)
+    now_ms = int(time.time() * 1000)
+    allowed, retry_ms, used = _sliding_window()(
+        keys=[RATE_KEY.format(user_id)],
+        args=[now_ms, window_ms, limit, cost, entry_id or uuid.uuid4().hex],
+    )
+    retry_after = 0 if allowed else max(1, math.ceil(int(retry_ms) / 1000))
+    return bool(allowed), retry_after, int(used)
+
+
+def refund_current_request():
+    """Devolve as unidades consumidas pela requisição atual (ex.: geração cancelada)."""
+    reservation = getattr(g, "rate_limit_reservation", None) if has_app_context() else None
+    if not reservation:
+        return False
+    user_id, member = reservation
+    try:
+        removed = redis_client.zrem(RATE_KEY.format(user_id), member)
+    except redis.exceptions.RedisError as e:
+        print(f"[WARN] Falha ao devolver unidades do rate limit: {e}")
+        return False
+    g.rate_limit_reservation = None
+    return bool(removed)
+
+
+def cost_limited(operation):
+    """
+    Limita a rota por usuário/plano com peso OPERATION_COSTS[operation].
+    Usar abaixo de @jwt_required(). Sem Redis, a requisição segue (fail open).
+    """
+    cost = OPERATION_COSTS[operation]
+
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            user = User.query.get(get_jwt_identity())
+            if user and user.role != "admin":
+                limit = plan_rate_limit(user)
+                entry_id = uuid.uuid4().hex
+                try:
+                    allowed, retry_after, _ = consume(user.id, cost, limit, entry_id=entry_id)
+                except redis.exceptions.RedisError as e:
+                    print(f"[WARN] Rate limit indisponível (Redis): {e}")
+                    allowed, retry_after = True, 0
+                else:
+                    # guardado para refund_current_request()
+                    g.rate_limit_reservation = (user.id, f"{entry_id}:{cost}")
+                if not allowed:
+                    return _too_many_requests(retry_after)
+            return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def charge_batch(user, operation, items):
+    """
+    Cobra um lote de `items` gerações de `operation` na janela de lotes do usuário.
+    Retorna a resposta 429 quando não cabe, ou None. Sem Redis, segue (fail open).
+    """
+    if not user or user.role == "admin":
+        return None
+    window_units = plan_rate_limit(user) * max(1, BATCH_WINDOW // RATE_LIMIT_WINDOW)
+    try:
+        allowed, retry_after, _ = consume(
+            f"batch:{user.id}", OPERATION_COSTS[operation] * items, window_units, window=BATCH_WINDOW,
+        )
+    except redis.exceptions.RedisError as e:
+        print(f"[WARN] Rate limit indisponível (Redis): {e}")
+        return None
+    return None if allowed else _too_many_requests(retry_after)
+
+
+def _too_many_requests(retry_after):
+    resp = make_response(jsonify({
+        "error": "Muitas requisições. Aguarde antes de tentar novamente.",
+        "retry_after": retry_after,
+    }), 429)
+    resp.headers["Retry-After"] = str(retry_after)
+    return resp
@@ -0,0 +1,78 @@
+import os, time, uuid, socket
+
+# Filas Redis com entrega "pelo menos uma vez" (outbox de email, títulos de chat).
+# O worker move os itens para a sua lista de processamento (LMOVE) e só os remove (LREM)
+# depois de tratados; listas de workers que morreram voltam para a fila quando um worker sobe.
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+# Sem sinal de vida por esse tempo, o worker é considerado morto
+ALIVE_TTL = int(os.getenv("QUEUE_WORKER_ALIVE_TTL", 600))
+
+
+def _processing_key(queue_key, worker=WORKER_ID):
+    return f"{queue_key}:processing:{worker}"
+
+
+def _workers_key(queue_key):
+    return f"{queue_key}:workers"
+
+
+def _alive_key(queue_key, worker):
+    return f"{queue_key}:alive:{worker}"
+
+
+def heartbeat(client, queue_key):
+    pipe = client.pipeline(transaction=False)
+    pipe.sadd(_workers_key(queue_key), WORKER_ID)
+    pipe.setex(_alive_key(queue_key, WORKER_ID), ALIVE_TTL, 1)
+    pipe.execute()
+
+
+def recover(client, queue_key):
+    """
+    Devolve para o início da fila, na ordem original, os itens em processamento deste worker
+    e dos workers sem sinal de vida. Chamada quando o worker sobe. Retorna quantos voltaram.
+    """
+    moved = 0
+    for worker in client.smembers(_workers_key(queue_key)):
+        if worker != WORKER_ID and client.exists(_alive_key(queue_key, worker)):
+            continue
+        while client.lmove(_processing_key(queue_key, worker), queue_key, "RIGHT", "LEFT") is not None:
+            moved += 1
+        if worker != WORKER_ID:
+            client.srem(_workers_key(queue_key), worker)
+    if moved:
+        print(f"[WARN] {moved} item(ns) em processamento devolvidos para {queue_key}")
+    return moved
+
+
+def take(client, queue_key, limit, block_timeout=1, window=0):
+    """
+    Move até `limit` itens da fila para a lista de processamento deste worker e os retorna.
+    Bloqueia até block_timeout pelo primeiro; `window` (s) espera mais itens para formar o lote.
+    """
+    heartbeat(client, queue_key)
+    processing = _processing_key(queue_key)
+    first = client.blmove(queue_key, processing, block_timeout, "LEFT", "RIGHT")
+    if first is None:
+        return []
+    raws = [first]
+    deadline = time.monotonic() + window
+    while len(raws) < limit:
+        raw = client.lmove(queue_key, processing, "LEFT", "RIGHT")
+        if raw is not None:
+            raws.append(raw)
+        elif time.monotonic() < deadline:
+            time.sleep(0.2)
+        else:
+            break
+    return raws
+
+
+def in_flight(client, queue_key):
+    """Itens ainda na lista de processamento deste worker."""
+    return client.lrange(_processing_key(queue_key), 0, -1)
+
+
+def ack(client, queue_key, raw):
+    """Item tratado: sai da lista de processamento."""
+    client.lrem(_processing_key(queue_key), 1, raw)
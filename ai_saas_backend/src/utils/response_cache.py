@@ -0,0 +1,104 @@
+import os, json, time, hashlib
+import redis
+from extensions import db, redis_client
+
+# Cache exato de respostas (opt-in por requisição com "cache": true)
+CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", 24 * 3600))
+# LRU: acima de MAX_ENTRIES as entradas menos usadas recentemente são removidas
+MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", 5000))
+MAX_ENTRY_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRY_BYTES", 256 * 1024))
+# temperatura até este valor é considerada determinística
+DETERMINISTIC_TEMPERATURE = 0.0
+# feature de plano que libera o cache também com temperatura > 0
+ANY_TEMPERATURE_FEATURE = "response_cache_any_temperature"
+
+_ENTRY_KEY = "rcache:{}"
+_LRU_KEY = "rcache:lru"
+_STATS_KEY = "rcache:stats"
+
+
+def cache_key(kind, model, messages, temperature=None, tools=None, **extra):
+    """Hash canônico de (tipo, modelo, mensagens, temperatura, ferramentas, parâmetros extras)."""
+    canonical = json.dumps(
+        {"kind": kind, "model": model, "messages": messages, "temperature": temperature, "tools": sorted(tools or []), **extra},
+        sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str,
+    )
+    return f"{kind}:{hashlib.sha256(canonical.encode('utf-8')).hexdigest()}"
+
+
+def plan_allows_any_temperature(user):
+    from models import Feature, PlanFeature
+
+    if not user or not user.plan_id:
+        return False
+    value = (
+        db.session.query(PlanFeature.value)
+        .join(Feature, Feature.id == PlanFeature.feature_id)
+        .filter(PlanFeature.plan_id == user.plan_id, Feature.key == ANY_TEMPERATURE_FEATURE)
+        .scalar()
+    )
+    return str(value).lower() == "true"
+
+
+def should_use(kind, requested, temperature, user):
+    """Cache só quando pedido; com temperatura > 0 apenas se o plano permitir."""
+    if not requested:
+        return False
+    if temperature is not None and temperature > DETERMINISTIC_TEMPERATURE and not plan_allows_any_temperature(user):
+        _count(kind, "bypass")
+        return False
+    return True
+
+
+def _count(kind, result):
+    try:
+        redis_client.hincrby(_STATS_KEY, f"{kind}:{result}", 1)
+    except redis.exceptions.RedisError:
+        pass
+
+
+def get(key):
+    kind = key.split(":", 1)[0]
+    try:
+        raw = redis_client.get(_ENTRY_KEY.format(key))
+        if raw is None:
+            redis_client.zrem(_LRU_KEY, key)
+        else:
+            redis_client.zadd(_LRU_KEY, {key: time.time()})
+    except redis.exceptions.RedisError as e:
+        print(f"[WARN] Cache de respostas sem Redis: {e}")
+        return None
+    _count(kind, "hit" if raw is not None else "miss")
+    return json.loads(raw) if raw is not None else None
+
+
+def put(key, value):
+    raw = json.dumps(value, ensure_ascii=False)
+    if len(raw.encode("utf-8")) > MAX_ENTRY_BYTES:
+        return False
+    try:
+        pipe = redis_client.pipeline()
+        pipe.setex(_ENTRY_KEY.format(key), CACHE_TTL, raw)
+        pipe.zadd(_LRU_KEY, {key: time.time()})
+        pipe.zcard(_LRU_KEY)
+        size = pipe.execute()[-1]
+        if size > MAX_ENTRIES:
+            evicted = redis_client.zpopmin(_LRU_KEY, size - MAX_ENTRIES)
+            if evicted:
+                redis_client.delete(*[_ENTRY_KEY.format(k) for k, _ in evicted])
+    except redis.exceptions.RedisError as e:
+        print(f"[WARN] Cache de respostas sem Redis: {e}")
+        return False
+    return True
+
+
+def cache_stats():
+    raw = {k: int(v) for k, v in redis_client.hgetall(_STATS_KEY).items()}
+    kinds = {}
+    for field, value in raw.items():
+        kind, _, result = field.rpartition(":")
+        kinds.setdefault(kind, {"hit": 0, "miss": 0, "bypass": 0})[result] = value
+    for entry in kinds.values():
+        lookups = entry["hit"] + entry["miss"]
+        entry["hit_rate"] = round(entry["hit"] / lookups, 3) if lookups else 0.0
+    return {"entries": redis_client.zcard(_LRU_KEY), "max_entries": MAX_ENTRIES, "ttl": CACHE_TTL, "kinds": kinds}
@@ -0,0 +1,127 @@
+import os, json, time, threading
+import redis
+from sqlalchemy import update
+from extensions import redis_client
+
+# Deltas da geração ficam num Redis Stream por mensagem; o cliente retoma de um offset
+STREAM_TTL = int(os.getenv("GENERATION_STREAM_TTL", 3600))
+STREAM_MAXLEN = 20000
+# Checkpoint do conteúdo parcial no banco (o chat mostra o parcial mesmo sem o stream)
+CHECKPOINT_SECONDS = float(os.getenv("GENERATION_CHECKPOINT_SECONDS", 2))
+CHECKPOINT_CHARS = int(os.getenv("GENERATION_CHECKPOINT_CHARS", 500))
+READ_BLOCK_MS = 15000
+# Tempo máximo de uma conexão de leitura (o cliente reconecta com Last-Event-ID se precisar)
+READ_DEADLINE_SECONDS = float(os.getenv("GENERATION_STREAM_READ_SECONDS", 600))
+
+_STREAM_KEY = "gen:stream:{}"
+_MESSAGE_KEY = "gen:msg:{}"
+
+
+class GenerationStream:
+    """
+    Destino dos deltas de uma geração retomável. Grava cada delta no Redis Stream
+    e faz checkpoints periódicos de ChatMessage.content (via engine, seguro entre threads).
+    """
+
+    def __init__(self, message_id, generation_id, engine):
+        self.message_id = message_id
+        self.generation_id = generation_id
+        self.key = _STREAM_KEY.format(message_id)
+        self._engine = engine
+        self._parts = []
+        self._lock = threading.Lock()
+        self._redis_ok = True
+        self._last_checkpoint = time.monotonic()
+        self._checkpointed_len = 0
+        self.finished = False
+        try:
+            pipe = redis_client.pipeline()
+            pipe.setex(_MESSAGE_KEY.format(generation_id), STREAM_TTL, message_id)
+            pipe.xadd(self.key, {"event": "start", "generation_id": generation_id}, maxlen=STREAM_MAXLEN)
+            pipe.expire(self.key, STREAM_TTL)
+            pipe.execute()
+        except redis.exceptions.RedisError as e:
+            print(f"[WARN] Stream retomável sem Redis (só checkpoints no banco): {e}")
+            self._redis_ok = False
+
+    @property
+    def text(self):
+        return "".join(self._parts)
+
+    def _xadd(self, fields):
+        if not self._redis_ok:
+            return
+        try:
+            redis_client.xadd(self.key, fields, maxlen=STREAM_MAXLEN)
+        except redis.exceptions.RedisError as e:
+            print(f"[WARN] Falha ao gravar no stream retomável: {e}")
+            self._redis_ok = False
+
+    def restart(self):
+        """Nova tentativa da chamada ao provedor: o cliente descarta o que recebeu."""
+        with self._lock:
+            if self._parts:
+                self._parts = []
+                self._xadd({"event": "reset"})
+
+    def write(self, delta):
+        # chamadas com hedge escrevem pelo buffer da perna vencedora (utils/hedging.py)
+        with self._lock:
+            self._parts.append(delta)
+            self._xadd({"event": "delta", "text": delta})
+            due = time.monotonic() - self._last_checkpoint >= CHECKPOINT_SECONDS
+            if due or len(self.text) - self._checkpointed_len >= CHECKPOINT_CHARS:
+                self.checkpoint()
+
+    def checkpoint(self, **values):
+        from models.chat import ChatMessage
+
+        content = self.text
+        try:
+            with self._engine.begin() as conn:
+                conn.execute(
+                    update(ChatMessage.__table__)
+                    .where(ChatMessage.__table__.c.id == self.message_id)
+                    .values(content=content, **values)
+                )
+        except Exception as e:
+            print(f"[WARN] Falha no checkpoint da mensagem {self.message_id}: {e}")
+            return
+        self._checkpointed_len = len(content)
+        self._last_checkpoint = time.monotonic()
+
+    def finish(self, status, message=None):
+        """Fecha o stream com o estado final (e a mensagem completa, com anexos)."""
+        if self.finished:
+            return
+        self.finished = True
+        if message is None:
+            # a requisição falhou antes de gravar a mensagem: fica o parcial
+            self.checkpoint(status="partial")
+        final_text = (message or {}).get("content")
+        # provedores sem stream (Gemini, cache): o texto chega inteiro no fim
+        if final_text and not self._parts:
+            self._xadd({"event": "delta", "text": final_text})
+        self._xadd({"event": "done", "status": status, "message": json.dumps(message or {}, ensure_ascii=False)})
+        if self._redis_ok:
+            try:
+                redis_client.expire(self.key, STREAM_TTL)
+            except redis.exceptions.RedisError:
+                pass
+
+
+def message_for_generation(generation_id):
+    try:
+        return redis_client.get(_MESSAGE_KEY.format(generation_id))
+    except redis.exceptions.RedisError:
+        return None
+
+
+def read_events(message_id, after="0-0", block_ms=READ_BLOCK_MS):
+    """Eventos [(offset, campos)] depois de `after`; bloqueia até block_ms esperando novos."""
+    result = redis_client.xread({_STREAM_KEY.format(message_id): after}, count=500, block=block_ms)
+    return result[0][1] if result else []
+
+
+def stream_exists(message_id):
+    return bool(redis_client.exists(_STREAM_KEY.format(message_id)))
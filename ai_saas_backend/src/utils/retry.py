@@ -0,0 +1,197 @@
+import os, re, time, random
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+import requests
+from flask import g, has_app_context
+from utils.metrics import incr
+
+# Orçamento total (s) para chamadas a provedores dentro de uma mesma requisição
+DEFAULT_DEADLINE = float(os.getenv("PROVIDER_DEADLINE_SECONDS", 150))
+
+# 529 = Anthropic "overloaded"
+RETRYABLE_STATUS = {408, 425, 429, 500, 502, 503, 504, 529}
+RETRYABLE_EXCEPTIONS = (
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+    ConnectionError,
+    TimeoutError,
+)
+# Exceções de SDK (openai/google-genai) são classificadas pelo status HTTP que carregam
+_SDK_TRANSIENT_NAMES = {"APIConnectionError", "APITimeoutError"}
+
+
+class RetryPolicy:
+    """Backoff exponencial com full jitter, respeitando Retry-After e um prazo total."""
+
+    def __init__(self, max_attempts=5, base_delay=0.5, max_delay=20.0, deadline=None):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+
+    def backoff(self, attempt, retry_after=None):
+        if retry_after is not None:
+            return min(retry_after, self.max_delay * 3)
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+
+DEFAULT_POLICY = RetryPolicy()
+
+
+def set_request_deadline(seconds=None):
+    """Define o prazo das chamadas a provedores para a requisição atual (flask.g)."""
+    g.provider_deadline = time.monotonic() + (seconds or DEFAULT_DEADLINE)
+
+
+def remaining_budget(policy=None, started=None):
+    limits = []
+    if has_app_context() and getattr(g, "provider_deadline", None):
+        limits.append(g.provider_deadline - time.monotonic())
+    if policy is not None and policy.deadline and started is not None:
+        limits.append(started + policy.deadline - time.monotonic())
+    return min(limits) if limits else DEFAULT_DEADLINE
+
+
+def _parse_retry_after(value):
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+        return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+def _retry_after_from_headers(headers):
+    if not headers:
+        return None
+    if headers.get("retry-after-ms"):
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    return _parse_retry_after(headers.get("retry-after"))
+
+
+def status_of(exc):
+    for attr in ("status_code", "code"):
+        value = getattr(exc, attr, None)
+        if isinstance(value, int):
+            return value
+    return None
+
+
+def retry_after_of(exc):
+    response = getattr(exc, "response", None)
+    delay = _retry_after_from_headers(getattr(response, "headers", None))
+    if delay is not None:
+        return delay
+    # google-genai: RetryInfo vem nos detalhes do erro ("retryDelay": "12s")
+    details = getattr(exc, "details", None)
+    match = re.search(r"'retryDelay': '(\d+(?:\.\d+)?)s'", str(details)) if details else None
+    return float(match.group(1)) if match else None
+
+
+def classify(result=None, exc=None):
+    """Retorna (repetir?, retry_after, motivo) para uma resposta HTTP ou exceção."""
+    if exc is not None:
+        status = status_of(exc)
+        if status is not None:
+            return status in RETRYABLE_STATUS, retry_after_of(exc), str(status)
+        if isinstance(exc, RETRYABLE_EXCEPTIONS) or type(exc).__name__ in _SDK_TRANSIENT_NAMES:
+            return True, None, type(exc).__name__
+        return False, None, type(exc).__name__
+    status = getattr(result, "status_code", None)
+    if status in RETRYABLE_STATUS:
+        return True, _retry_after_from_headers(getattr(result, "headers", None)), str(status)
+    return False, None, None
+
+
+def call_with_retry(fn, policy=None, label="provider"):
+    """
+    Executa fn(timeout) com a política de retentativa.
+    fn recebe o tempo restante (s) do orçamento para usar como timeout da chamada.
+    Respostas HTTP com status retentável são devolvidas ao final se as tentativas acabarem;
+    exceções não retentáveis (ou após a última tentativa) são propagadas.
+    """
+    policy = policy or DEFAULT_POLICY
+    started = time.monotonic()
+    attempt = 0
+    while True:
+        remaining = remaining_budget(policy, started)
+        result, error = None, None
+        try:
+            result = fn(max(1.0, remaining))
+        except Exception as e:
+            error = e
+
+        retry, retry_after, reason = classify(result, error)
+        if not retry:
+            if error is not None:
+                raise error
+            return result
+
+        attempt += 1
+        delay = policy.backoff(attempt - 1, retry_after)
+        remaining = remaining_budget(policy, started)
+        # sem tempo para esperar e tentar de novo: falha rápido em vez de segurar a thread
+        if attempt >= policy.max_attempts or delay >= remaining - 1:
+            incr("provider_retry_exhausted", call=label, reason=reason)
+            if error is not None:
+                raise error
+            return result
+
+        incr("provider_retries", call=label, reason=reason)
+        print(f"[RETRY] {label}: {reason}, tentativa {attempt + 1}/{policy.max_attempts} em {delay:.1f}s")
+        time.sleep(delay)
+
+
+def call_provider(provider, model, fn, policy=None):
+    """
+    Chamada a provedor: circuit breaker + uma vaga (provider_slot) por tentativa
+    + a política de retentativa. Com o circuito aberto levanta CircuitOpenError
+    sem chamar a API (não é retentável; cadeias de fallback seguem para o próximo modelo).
+    """
+    from utils import circuit_breaker
+    from utils.model_router import record_quota
+    from utils.provider_limits import provider_slot
+
+    def attempt(timeout):
+        circuit_breaker.check(provider, model)
+        with provider_slot(provider, model):
+            started = time.monotonic()
+            try:
+                result = fn(timeout)
+            except Exception as e:
+                _record_outcome(provider, model, classify(exc=e)[0], status_of(e), started, e)
+                record_quota(provider, model, status_of(e), None)
+                raise
+        status = getattr(result, "status_code", None)
+        _record_outcome(provider, model, classify(result)[0], status, started, result)
+        record_quota(provider, model, status, getattr(result, "headers", None))
+        return result
+
+    return call_with_retry(attempt, policy, label=provider)
+
+
+def _record_outcome(provider, model, failed, status, started, outcome):
+    """
+    Resultado da chamada para o circuit breaker. 429 é cota (record_quota cuida), não falha
+    do provedor, e cancelamento pelo usuário não diz nada sobre ele: nenhum dos dois conta.
+    Respostas de stream trazem latency_ms (tempo até o primeiro byte), não a geração inteira.
+    """
+    from utils import circuit_breaker
+    from utils.cancellation import GenerationCancelled
+
+    if status == 429 or isinstance(outcome, GenerationCancelled):
+        return
+    latency_ms = getattr(outcome, "latency_ms", None)
+    if latency_ms is None:
+        latency_ms = (time.monotonic() - started) * 1000
+    circuit_breaker.record(provider, model, not failed, latency_ms)
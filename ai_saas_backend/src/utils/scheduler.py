@@ -0,0 +1,244 @@
+import os, time, uuid, random
+from functools import wraps
+import redis
+from flask import jsonify, make_response
+from flask_jwt_extended import get_jwt_identity
+from extensions import redis_client, db
+from models import User, PlanFeature, Feature
+from utils.rate_limit import OPERATION_COSTS
+from utils.metrics import incr, observe
+from utils.admission import record_queue_wait, hold_until_closed
+
+# Vagas de geração (texto/imagem/vídeo) em todos os nós, divididas entre planos por peso
+GENERATION_SLOTS = int(os.getenv("GENERATION_SLOTS", 32))
+# Lease da vaga: vídeo pode levar minutos; protege contra processos que morrem segurando a vaga
+LEASE_SECONDS = int(os.getenv("GENERATION_LEASE_SECONDS", 900))
+WAITER_STALE_MS = 10_000
+
+# Usados quando o plano não tem a feature configurada
+DEFAULT_WEIGHT = 1
+DEFAULT_USER_CONCURRENCY = 2
+DEFAULT_MAX_QUEUE_SECONDS = 15
+
+_HOLDERS_KEY = "sched:holders"
+_WAITING_KEY = "sched:waiting"
+_WAITING_TS_KEY = "sched:waiting_ts"
+_VTIME_KEY = "sched:vtime"
+
+
+class GenerationShedError(Exception):
+    """A requisição esperou mais que o máximo do plano na fila de geração."""
+
+
+# Fila justa ponderada (WFQ): cada pedido recebe uma etiqueta de término virtual
+# início = max(tempo virtual global, última etiqueta do plano); término = início + custo/peso.
+# KEYS: waiting, waiting_ts, vtime | ARGV: now_ms, token, tier, custo/peso
+_ENQUEUE_LUA = """
+local vt = tonumber(redis.call('HGET', KEYS[3], 'global')) or 0
+local last = tonumber(redis.call('HGET', KEYS[3], ARGV[3])) or 0
+local finish = math.max(vt, last) + tonumber(ARGV[4])
+redis.call('HSET', KEYS[3], ARGV[3], finish)
+redis.call('ZADD', KEYS[1], 'NX', finish, ARGV[2])
+redis.call('ZADD', KEYS[2], ARGV[1], ARGV[2])
+return tostring(finish)
+"""
+
+# Tokens "<user_id>|<limite do usuário>|<uuid>": o script conta as vagas por usuário.
+# KEYS: holders, waiting, waiting_ts, vtime
+# ARGV: now_ms, token, lease_ms, stale_ms, vagas, custo/peso
+# Retorno: {1, 0} concedido | {0, posição} aguardando | {-1, 0} saiu da fila (reenfileirar)
+_ACQUIRE_LUA = """
+local holders, waiting, waiting_ts, vtime = KEYS[1], KEYS[2], KEYS[3], KEYS[4]
+local now = tonumber(ARGV[1])
+local token = ARGV[2]
+local stale = tonumber(ARGV[4])
+local capacity = tonumber(ARGV[5])
+
+redis.call('ZREMRANGEBYSCORE', holders, '-inf', now)
+local gone = redis.call('ZRANGEBYSCORE', waiting_ts, '-inf', now - stale)
+for _, w in ipairs(gone) do
+    redis.call('ZREM', waiting, w)
+    redis.call('ZREM', waiting_ts, w)
+end
+
+local rank = redis.call('ZRANK', waiting, token)
+if not rank then
+    return {-1, 0}
+end
+redis.call('ZADD', waiting_ts, now, token)
+redis.call('PEXPIRE', waiting, stale * 6)
+redis.call('PEXPIRE', waiting_ts, stale * 6)
+
+local function owner(member)
+    local user, cap = string.match(member, '^(.-)|(%d+)|')
+    return user, tonumber(cap)
+end
+
+local used = {}
+local current = redis.call('ZRANGE', holders, 0, -1)
+for _, h in ipairs(current) do
+    local user = owner(h)
+    used[user] = (used[user] or 0) + 1
+end
+
+local me, my_cap = owner(token)
+if (used[me] or 0) >= my_cap then
+    return {0, rank}
+end
+
+-- só contam à frente os pedidos de usuários que ainda cabem no próprio limite
+local free = capacity - #current
+local ahead = 0
+if rank > 0 then
+    for _, w in ipairs(redis.call('ZRANGE', waiting, 0, rank - 1)) do
+        local user, cap = owner(w)
+        if (used[user] or 0) < cap then
+            used[user] = (used[user] or 0) + 1
+            ahead = ahead + 1
+        end
+    end
+end
+if ahead >= free then
+    return {0, rank}
+end
+
+local tag = tonumber(redis.call('ZSCORE', waiting, token))
+redis.call('ZADD', holders, now + tonumber(ARGV[3]), token)
+redis.call('PEXPIRE', holders, tonumber(ARGV[3]))
+redis.call('ZREM', waiting, token)
+redis.call('ZREM', waiting_ts, token)
+-- o tempo virtual avança até o início do pedido atendido
+local start = tag - tonumber(ARGV[6])
+if start > (tonumber(redis.call('HGET', vtime, 'global')) or 0) then
+    redis.call('HSET', vtime, 'global', start)
+end
+return {1, 0}
+"""
+
+_scripts = {}
+
+
+def _script(name, source):
+    if name not in _scripts:
+        _scripts[name] = redis_client.register_script(source)
+    return _scripts[name]
+
+
+def plan_scheduling(user):
+    """(peso, gerações simultâneas por usuário, espera máxima em segundos) do plano do usuário."""
+    settings = {
+        "scheduler_weight": DEFAULT_WEIGHT,
+        "max_concurrent_generations": DEFAULT_USER_CONCURRENCY,
+        "max_queue_seconds": DEFAULT_MAX_QUEUE_SECONDS,
+    }
+    if user and user.plan_id:
+        rows = (
+            db.session.query(Feature.key, PlanFeature.value)
+            .join(Feature, Feature.id == PlanFeature.feature_id)
+            .filter(PlanFeature.plan_id == user.plan_id, Feature.key.in_(list(settings)))
+            .all()
+        )
+        for key, value in rows:
+            try:
+                settings[key] = max(1, int(value))
+            except (TypeError, ValueError):
+                pass
+    return settings["scheduler_weight"], settings["max_concurrent_generations"], settings["max_queue_seconds"]
+
+
+def acquire(user_id, tier, weight, user_cap, cost, timeout):
+    """
+    Espera vaga de geração na fila justa ponderada. Retorna o token para release()
+    (None sem Redis). Levanta GenerationShedError depois de `timeout` segundos.
+    """
+    token = f"{user_id}|{user_cap}|{uuid.uuid4().hex}"
+    share = cost / weight
+    keys = [_HOLDERS_KEY, _WAITING_KEY, _WAITING_TS_KEY, _VTIME_KEY]
+    enqueue = _script("enqueue", _ENQUEUE_LUA)
+    deadline = time.time() + timeout
+    started = time.time()
+
+    try:
+        enqueue(keys=keys[1:], args=[int(time.time() * 1000), token, tier, share])
+        while True:
+            status, position = _script("acquire", _ACQUIRE_LUA)(
+                keys=keys,
+                args=[int(time.time() * 1000), token, LEASE_SECONDS * 1000, WAITER_STALE_MS, GENERATION_SLOTS, share],
+            )
+            if status == 1:
+                break
+            if status == -1:
+                enqueue(keys=keys[1:], args=[int(time.time() * 1000), token, tier, share])
+            if time.time() >= deadline:
+                _leave(token)
+                record_queue_wait(time.time() - started)
+                incr("generation_shed", tier=tier)
+                raise GenerationShedError("Alta demanda no momento, tente novamente em instantes")
+            time.sleep(min(0.5, 0.05 * (1 + int(position) / 4)) * random.uniform(0.8, 1.2))
+    except redis.exceptions.RedisError as e:
+        print(f"[WARN] Fila de geração indisponível (Redis): {e}")
+        return None
+
+    record_queue_wait(time.time() - started)
+    observe("generation_queue_ms", (time.time() - started) * 1000, tier=tier)
+    return token
+
+
+def _leave(token):
+    pipe = redis_client.pipeline()
+    pipe.zrem(_HOLDERS_KEY, token)
+    pipe.zrem(_WAITING_KEY, token)
+    pipe.zrem(_WAITING_TS_KEY, token)
+    pipe.execute()
+
+
+def release(token):
+    if not token:
+        return
+    try:
+        _leave(token)
+    except redis.exceptions.RedisError as e:
+        print(f"[WARN] Falha ao liberar vaga de geração: {e}")
+
+
+def scheduler_status():
+    """Vagas em uso e fila de geração, para /api/admin/metrics."""
+    now_ms = int(time.time() * 1000)
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.zcount(_HOLDERS_KEY, now_ms, "+inf")
+    pipe.zcard(_WAITING_KEY)
+    in_flight, waiting = pipe.execute()
+    return {"slots": GENERATION_SLOTS, "in_flight": in_flight, "waiting": waiting}
+
+
+def scheduled(operation):
+    """
+    Segura uma vaga de geração durante a rota, com prioridade pelo plano do usuário.
+    Usar abaixo de @cost_limited(). Sem Redis, a requisição segue (fail open).
+    """
+    cost = OPERATION_COSTS[operation]
+
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            user = User.query.get(get_jwt_identity())
+            if not user or user.role == "admin":
+                return fn(*args, **kwargs)
+            weight, user_cap, max_wait = plan_scheduling(user)
+            tier = str(user.plan_id or "none")
+            try:
+                token = acquire(user.id, tier, weight, user_cap, cost, max_wait)
+            except GenerationShedError as e:
+                resp = make_response(jsonify({"error": str(e), "retry_after": max_wait}), 503)
+                resp.headers["Retry-After"] = str(max_wait)
+                return resp
+            deferred = False
+            try:
+                resp = fn(*args, **kwargs)
+                deferred = hold_until_closed(resp, lambda: release(token))
+                return resp
+            finally:
+                if not deferred:
+                    release(token)
+        return wrapper
+    return decorator
@@ -0,0 +1,64 @@
+import os, threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from flask import current_app, g, has_app_context
+from extensions import db
+
+# Pool das chamadas auxiliares de um turno (intenção, geração de imagem, completions)
+_pool = ThreadPoolExecutor(max_workers=int(os.getenv("TURN_WORKERS", 16)), thread_name_prefix="turn")
+
+
+def run_dag(tasks):
+    """
+    Executa um pequeno DAG de chamadas do turno em paralelo.
+    tasks = {nome: (fn, [dependências])}; fn recebe como kwargs os resultados das dependências.
+    Uma tarefa começa assim que suas dependências terminam; se alguma dependência falhar,
+    a tarefa não roda e seu Future carrega a mesma exceção.
+    Retorna {nome: Future}. As tarefas herdam o app context e o prazo de provedores da requisição.
+    """
+    app = current_app._get_current_object() if has_app_context() else None
+    deadline = getattr(g, "provider_deadline", None) if has_app_context() else None
+
+    futures = {name: Future() for name in tasks}
+    waiting = {name: set(deps) for name, (_, deps) in tasks.items()}
+    dependents = {name: [n for n, (_, deps) in tasks.items() if name in deps] for name in tasks}
+    unknown = {d for deps in waiting.values() for d in deps} - set(tasks)
+    if unknown:
+        raise ValueError(f"Dependências desconhecidas: {sorted(unknown)}")
+    lock = threading.Lock()
+
+    def runner(fn, kwargs):
+        if app is None:
+            return fn(**kwargs)
+        with app.app_context():
+            g.provider_deadline = deadline
+            try:
+                return fn(**kwargs)
+            finally:
+                db.session.remove()
+
+    def finished(name, inner):
+        if inner.exception() is not None:
+            futures[name].set_exception(inner.exception())
+        else:
+            futures[name].set_result(inner.result())
+        for child in dependents[name]:
+            with lock:
+                waiting[child].discard(name)
+                ready = not waiting[child]
+            if ready:
+                start(child)
+
+    def start(name):
+        fn, deps = tasks[name]
+        failed = next((futures[d] for d in deps if futures[d].exception() is not None), None)
+        inner = Future()
+        if failed is not None:
+            inner.set_exception(failed.exception())
+        else:
+            inner = _pool.submit(runner, fn, {d: futures[d].result() for d in deps})
+        inner.add_done_callback(lambda f: finished(name, f))
+
+    for name, deps in list(waiting.items()):
+        if not deps:
+            start(name)
+    return futures
@@ -0,0 +1,101 @@
+from datetime import datetime, date, timedelta
+from sqlalchemy import func, update, delete, insert, select
+from sqlalchemy.exc import IntegrityError
+from extensions import db
+from models.chat import Chat, ChatMessage
+from models.usage import UsageDaily
+
+
+def _increment(day, user_id, model, prompt, completion, total):
+    return db.session.execute(
+        update(UsageDaily)
+        .where(
+            UsageDaily.day == day,
+            UsageDaily.user_id == user_id,
+            UsageDaily.model == model,
+        )
+        .values(
+            prompt_tokens=UsageDaily.prompt_tokens + prompt,
+            completion_tokens=UsageDaily.completion_tokens + completion,
+            total_tokens=UsageDaily.total_tokens + total,
+            message_count=UsageDaily.message_count + 1,
+            updated_at=datetime.utcnow(),
+        )
+    ).rowcount
+
+
+def record_usage(user_id, model, prompt_tokens=None, completion_tokens=None, total_tokens=None, at=None):
+    """
+    Soma o uso de uma mensagem da IA no rollup diário (dia, usuário, modelo).
+    Não faz commit: deve ser chamada na mesma transação que grava a ChatMessage.
+    """
+    if not user_id:
+        return
+    day = (at or datetime.utcnow()).date()
+    model = model or ""
+    prompt = int(prompt_tokens or 0)
+    completion = int(completion_tokens or 0)
+    total = int(total_tokens if total_tokens is not None else prompt + completion)
+
+    if _increment(day, user_id, model, prompt, completion, total):
+        return
+
+    # Primeira mensagem do dia para a chave: insere em savepoint para tolerar
+    # a corrida com outro worker que tenha criado a mesma linha.
+    try:
+        with db.session.begin_nested():
+            db.session.execute(insert(UsageDaily).values(
+                day=day,
+                user_id=user_id,
+                model=model,
+                prompt_tokens=prompt,
+                completion_tokens=completion,
+                total_tokens=total,
+                message_count=1,
+                updated_at=datetime.utcnow(),
+            ))
+    except IntegrityError:
+        _increment(day, user_id, model, prompt, completion, total)
+
+
+def rebuild_usage_rollups(start_day: date, end_day: date) -> int:
+    """
+    Recalcula os rollups do intervalo [start_day, end_day] a partir de chat_messages.
+    Usado como job periódico/backfill (ex.: dados anteriores à criação da tabela).
+    Retorna o número de linhas de rollup gravadas.
+    """
+    db.session.execute(
+        delete(UsageDaily).where(UsageDaily.day >= start_day, UsageDaily.day <= end_day)
+    )
+
+    day_col = func.date(ChatMessage.created_at)
+    agg = (
+        select(
+            day_col,
+            Chat.user_id,
+            func.coalesce(ChatMessage.model_used, ""),
+            func.coalesce(func.sum(ChatMessage.prompt_tokens), 0),
+            func.coalesce(func.sum(ChatMessage.completion_tokens), 0),
+            func.coalesce(func.sum(ChatMessage.total_tokens), 0),
+            func.count(ChatMessage.id),
+            func.now(),
+        )
+        .join(Chat, Chat.id == ChatMessage.chat_id)
+        .where(
+            ChatMessage.role == "assistant",
+            ChatMessage.created_at >= datetime.combine(start_day, datetime.min.time()),
+            ChatMessage.created_at < datetime.combine(end_day + timedelta(days=1), datetime.min.time()),
+        )
+        .group_by(day_col, Chat.user_id, func.coalesce(ChatMessage.model_used, ""))
+    )
+    result = db.session.execute(
+        insert(UsageDaily).from_select(
+            [
+                "day", "user_id", "model", "prompt_tokens", "completion_tokens",
+                "total_tokens", "message_count", "updated_at",
+            ],
+            agg,
+        )
+    )
+    db.session.commit()
+    return result.rowcount or 0
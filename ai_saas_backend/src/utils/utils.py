@@ -30,6 +30,16 @@ def create_default_plans():
         "limit_messages": "Limite de mensagens por chat",
         # Cota mensal de tokens por plano (número inteiro em tokens, armazenado como string)
         "token_quota_monthly": "Cota mensal de tokens por usuário",
+        # Unidades de custo por minuto nas rotas de geração (texto=1, imagem=5, vídeo=20)
+        "rate_limit_units": "Limite de requisições ponderado por custo",
+        # Cache exato de respostas também com temperatura > 0
+        "response_cache_any_temperature": "Cache de respostas com qualquer temperatura",
+        # Fila de geração: peso do plano, gerações simultâneas por usuário e espera máxima (s)
+        "scheduler_weight": "Prioridade na fila de geração",
+        "max_concurrent_generations": "Gerações simultâneas por usuário",
+        "max_queue_seconds": "Espera máxima na fila de geração",
+        # Geração em lote (0 = não permitido)
+        "batch_max_items": "Prompts por lote de geração",
         "customization": "Personalização das respostas (temperatura)",
         "generate_image": "Geração de imagem",
         "generate_video": "Geração de vídeo",
@@ -71,7 +81,25 @@ def create_default_plans():
             existing = PlanFeature.query.filter_by(plan_id=plan.id, feature_id=f.id).first()
 
             # Regras por plano (sempre aplicadas, atualizando se já existir)
-            if plan.name == "Bot":
+            if key == "rate_limit_units":
+                value = {"Grátis": "20", "Básico": "60", "Pro": "150", "Premium": "300", "Bot": "60"}.get(plan.name, "30")
+
+            elif key == "response_cache_any_temperature":
+                value = "true" if plan.name in ("Pro", "Premium") else "false"
+
+            elif key == "scheduler_weight":
+                value = {"Grátis": "1", "Básico": "2", "Pro": "4", "Premium": "8", "Bot": "2"}.get(plan.name, "1")
+
+            elif key == "max_concurrent_generations":
+                value = {"Grátis": "1", "Básico": "2", "Pro": "4", "Premium": "6", "Bot": "4"}.get(plan.name, "2")
+
+            elif key == "batch_max_items":
+                value = {"Básico": "100", "Pro": "500", "Premium": "1000"}.get(plan.name, "0")
+
+            elif key == "max_queue_seconds":
+                value = {"Grátis": "10", "Básico": "20", "Pro": "45", "Premium": "60", "Bot": "20"}.get(plan.name, "15")
+
+            elif plan.name == "Bot":
                 if key == "download_bot":
                     value = "true"
                 elif key == "token_quota_monthly":
@@ -0,0 +1,196 @@
+import os, base64, hashlib, threading
+from collections import OrderedDict
+import requests
+from PIL import Image, ImageOps
+from extensions import db
+from models import ChatAttachment
+from utils.background import run_in_background
+from utils.metrics import incr
+from utils.model_router import provider_of
+
+# Imagens de chat antes de ir ao provedor:
+# - redimensionadas/recodificadas para a maior resolução que o modelo aproveita (acima disso
+#   o provedor reduz do lado dele, mas o upload e o processamento já foram pagos); as
+#   derivadas ficam em disco, indexadas pelo hash do conteúdo
+# - imagens de mensagens anteriores aos últimos RECENT_TURNS turnos do usuário viram uma
+#   legenda curta (gerada uma vez em segundo plano), em vez de pixels reenviados a cada turno
+
+# (lado maior, lado menor) máximos por provedor. OpenAI (detail high): cabe em 2048 e o lado
+# menor cai para 768; Anthropic: 1568 no lado maior; Gemini: blocos de 768, até 2x2
+MAX_SIZE = {
+    "openai": (2048, 768),
+    "openrouter": (2048, 768),
+    "perplexity": (2048, 768),
+    "anthropic": (1568, 1568),
+    "gemini": (1536, 1536),
+}
+DEFAULT_MAX_SIZE = (2048, 768)
+# Imagem já dentro do limite e menor que isso segue como está (não vale recodificar)
+KEEP_ORIGINAL_BYTES = int(os.getenv("VISION_KEEP_ORIGINAL_BYTES", 512 * 1024))
+JPEG_QUALITY = 85
+# Turnos do usuário (contando o atual) cujas imagens ainda vão como pixels
+RECENT_TURNS = int(os.getenv("VISION_RECENT_TURNS", 2))
+
+CAPTION_MODEL = os.getenv("CAPTION_MODEL", "gpt-4o-mini")
+CAPTION_SIZE = (512, 512)
+MAX_CAPTION_CHARS = 400
+
+DERIVED_DIR = os.getenv("VISION_DERIVED_DIR") or os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "static", "uploads", "derived"
+)
+
+_hashes = OrderedDict()
+_hashes_lock = threading.Lock()
+_HASH_CACHE_SIZE = 2048
+_captioning = set()
+_captioning_lock = threading.Lock()
+
+
+def content_hash(path):
+    """sha256 do arquivo (memorizado por caminho, tamanho e mtime)."""
+    stat = os.stat(path)
+    key = (path, stat.st_size, stat.st_mtime_ns)
+    with _hashes_lock:
+        if key in _hashes:
+            _hashes.move_to_end(key)
+            return _hashes[key]
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    value = digest.hexdigest()
+    with _hashes_lock:
+        _hashes[key] = value
+        while len(_hashes) > _HASH_CACHE_SIZE:
+            _hashes.popitem(last=False)
+    return value
+
+
+def max_size(model):
+    return MAX_SIZE.get(provider_of(model), DEFAULT_MAX_SIZE)
+
+
+def _scale(width, height, limits):
+    long_max, short_max = limits
+    return min(1.0, long_max / max(width, height), short_max / min(width, height))
+
+
+def derivative(path, mimetype, limits):
+    """
+    (caminho, mimetype) da versão da imagem dentro de `limits` (lado maior, lado menor).
+    Gerada uma vez por (conteúdo, limites) e reaproveitada entre turnos, chats e usuários.
+    """
+    try:
+        digest = content_hash(path)
+        out_base = os.path.join(DERIVED_DIR, f"{digest}_{limits[0]}x{limits[1]}")
+        for ext, mime in ((".jpg", "image/jpeg"), (".png", "image/png")):
+            if os.path.exists(out_base + ext):
+                return out_base + ext, mime
+
+        with Image.open(path) as img:
+            img = ImageOps.exif_transpose(img)
+            scale = _scale(img.width, img.height, limits)
+            if scale >= 1.0 and os.path.getsize(path) <= KEEP_ORIGINAL_BYTES:
+                return path, mimetype
+            if scale < 1.0:
+                img = img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))), Image.LANCZOS)
+            has_alpha = img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info)
+            ext, mime = (".png", "image/png") if has_alpha else (".jpg", "image/jpeg")
+            os.makedirs(DERIVED_DIR, exist_ok=True)
+            tmp = f"{out_base}.{os.getpid()}.{threading.get_ident()}.tmp"
+            if has_alpha:
+                img.convert("RGBA").save(tmp, "PNG", optimize=True)
+            else:
+                img.convert("RGB").save(tmp, "JPEG", quality=JPEG_QUALITY, optimize=True)
+        os.replace(tmp, out_base + ext)
+        incr("vision.derivative")
+        return out_base + ext, mime
+    except Exception as e:
+        print(f"[WARN] Falha ao preparar imagem {path}: {e}")
+        return path, mimetype
+
+
+def prepared_image(path, mimetype, model):
+    """Imagem pronta para o modelo: a derivada no tamanho máximo útil para ele."""
+    return derivative(path, mimetype, max_size(model))
+
+
+def aged_message_ids(history, recent_turns=None):
+    """Ids das mensagens anteriores aos últimos `recent_turns` turnos do usuário."""
+    recent_turns = RECENT_TURNS if recent_turns is None else recent_turns
+    user_seen = 0
+    for idx in range(len(history) - 1, -1, -1):
+        if history[idx].role == "user":
+            user_seen += 1
+            if user_seen == recent_turns:
+                return {m.id for m in history[:idx]}
+    return set()
+
+
+def caption_text(attachment):
+    """Texto que substitui uma imagem antiga. Sem legenda ainda: agenda a geração e usa o nome."""
+    if attachment.caption:
+        return f"[Imagem anterior ({attachment.name}): {attachment.caption}]"
+    enqueue_caption(attachment.id)
+    return f"[Imagem anterior: {attachment.name}]"
+
+
+def enqueue_caption(attachment_id):
+    with _captioning_lock:
+        if attachment_id in _captioning:
+            return
+        _captioning.add(attachment_id)
+
+    def done(future):
+        # com falha, não tenta de novo neste processo (a imagem segue com o nome no lugar)
+        if future.exception() is None:
+            with _captioning_lock:
+                _captioning.discard(attachment_id)
+
+    run_in_background(caption_attachment, attachment_id).add_done_callback(done)
+
+
+def caption_attachment(attachment_id):
+    """Gera (ou reaproveita, pelo hash do conteúdo) a legenda de uma imagem anexada."""
+    att = db.session.get(ChatAttachment, attachment_id)
+    if not att or att.caption or not (att.mimetype or "").startswith("image/") or not os.path.exists(att.path):
+        return
+    att.content_hash = att.content_hash or content_hash(att.path)
+    same = (
+        ChatAttachment.query
+        .filter(ChatAttachment.content_hash == att.content_hash, ChatAttachment.caption.isnot(None))
+        .first()
+    )
+    att.caption = same.caption if same else request_caption(att.path, att.mimetype)
+    db.session.commit()
+    incr("vision.caption", source="reused" if same else "model")
+
+
+def request_caption(path, mimetype, timeout=20):
+    """Legenda curta via modelo barato, com a imagem reduzida e detail low."""
+    from utils.retry import RetryPolicy, call_provider
+
+    small, small_mime = derivative(path, mimetype, CAPTION_SIZE)
+    with open(small, "rb") as f:
+        data_url = f"data:{small_mime};base64,{base64.b64encode(f.read()).decode('utf-8')}"
+    api_key = (os.getenv("API_KEY") or "").strip()
+    res = call_provider("openai", CAPTION_MODEL, lambda t: requests.post(
+        "https://api.openai.com/v1/chat/completions",
+        headers={"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"},
+        json={
+            "model": CAPTION_MODEL,
+            "messages": [{"role": "user", "content": [
+                {"type": "text", "text": (
+                    "Descreva esta imagem em uma frase curta (até 40 palavras), "
+                    "incluindo textos visíveis importantes. Responda só com a descrição."
+                )},
+                {"type": "image_url", "image_url": {"url": data_url, "detail": "low"}},
+            ]}],
+            "max_tokens": 120,
+            "temperature": 0.2,
+        },
+        timeout=min(timeout, t),
+    ), RetryPolicy(max_attempts=2, deadline=timeout * 2))
+    if res.status_code != 200:
+        raise RuntimeError(f"status {res.status_code}")
+    return (res.json()["choices"][0]["message"]["content"] or "").strip()[:MAX_CAPTION_CHARS] or None
@@ -4,6 +4,9 @@ import os
 # Adiciona o diretório src ao sys.path para que os imports funcionem no pytest
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
 
+# Workers de fundo (lotes, email) não sobem nos testes
+os.environ.setdefault("START_BACKGROUND_WORKERS", "false")
+
 import pytest
 from main import app
 from models import User
@@ -0,0 +1,76 @@
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+from flask_jwt_extended import create_access_token
+
+import main
+from extensions import bcrypt, db
+from models import User
+from models.chat import Chat
+
+
+def _user(username, role="user", created_at=None):
+    user = User(
+        id=str(uuid.uuid4()),
+        full_name=username.title(),
+        username=username,
+        email=f"{username}@example.com",
+        password=bcrypt.generate_password_hash("Senha123!").decode("utf-8"),
+        role=role,
+        is_active=True,
+        created_at=created_at,
+    )
+    db.session.add(user)
+    return user
+
+
+@pytest.fixture
+def admin_get(test_client, monkeypatch):
+    # a blocklist de tokens fica no Redis
+    monkeypatch.setattr(main, "check_if_token_revoked", lambda header, payload: False)
+    if not test_client.application.config.get("JWT_SECRET_KEY"):
+        monkeypatch.setitem(test_client.application.config, "JWT_SECRET_KEY", "segredo-de-teste-com-32-bytes-ou-mais")
+    with test_client.application.app_context():
+        admin = User.query.filter_by(username="diradmin").first() or _user("diradmin", role="admin")
+        if not User.query.filter(User.username.like("dirx%")).count():
+            base = datetime(2024, 1, 1)
+            users = [_user(f"dirx{i}", created_at=base + timedelta(days=i)) for i in range(5)]
+            db.session.flush()
+            db.session.add_all([Chat(user_id=users[4].id, title=f"c{i}") for i in range(3)])
+        db.session.commit()
+        token = create_access_token(identity=admin.id)
+
+    test_client.set_cookie("access_token_cookie", token)
+
+    def get(query):
+        resp = test_client.get(f"/api/admin/users?{query}")
+        assert resp.status_code == 200, resp.get_json()
+        return resp.get_json()
+
+    yield get
+    test_client.delete_cookie("access_token_cookie")
+
+
+def test_search_pages_newest_first(admin_get):
+    first = admin_get("q=dirx&per_page=2")
+    assert first["total"] == 5 and first["pages"] == 3
+    assert [u["username"] for u in first["results"]] == ["dirx4", "dirx3"]
+
+    last = admin_get("q=dirx&per_page=2&page=3")
+    assert [u["username"] for u in last["results"]] == ["dirx0"]
+    assert admin_get("q=dirx&per_page=2&page=9")["results"] == []
+
+
+def test_page_bounds_are_clamped(admin_get):
+    data = admin_get("q=dirx&page=0&per_page=1000")
+    assert data["page"] == 1 and data["per_page"] == 200 and len(data["results"]) == 5
+
+
+def test_stats_count_only_the_page_users(admin_get):
+    data = admin_get("q=dirx&per_page=2&with_stats=1")
+    stats = {u["username"]: u["stats"] for u in data["results"]}
+    assert stats == {
+        "dirx4": {"chat_count": 3, "tokens_this_month": 0},
+        "dirx3": {"chat_count": 0, "tokens_this_month": 0},
+    }
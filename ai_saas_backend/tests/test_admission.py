@@ -0,0 +1,86 @@
+import threading
+from types import SimpleNamespace
+
+from flask import Flask, jsonify
+
+import utils.admission as admission
+from utils.admission import admission_controlled, degraded_model
+
+
+class _Query:
+    def __init__(self, user):
+        self.user = user
+
+    def get(self, _id):
+        return self.user
+
+
+def _app(monkeypatch, plan_name="Grátis", view=None, operation="text"):
+    user = SimpleNamespace(id="user-1", plan=SimpleNamespace(name=plan_name))
+    monkeypatch.setattr(admission, "User", SimpleNamespace(query=_Query(user)))
+    monkeypatch.setattr(admission, "get_jwt_identity", lambda: "user-1")
+    monkeypatch.setattr(admission, "incr", lambda *a, **k: None)
+    monkeypatch.setattr(admission, "_queue_wait", 0.0)
+    app = Flask(__name__)
+
+    @app.route("/generate", methods=["POST"])
+    @admission_controlled(operation)
+    def generate():
+        if view:
+            view()
+        return jsonify({"model": degraded_model("text", "gpt-4o")}), 200
+
+    return app.test_client()
+
+
+def test_rejects_early_when_generation_threads_are_full(monkeypatch):
+    monkeypatch.setattr(admission, "MAX_IN_FLIGHT", 1)
+    monkeypatch.setattr(admission, "DEGRADE_IN_FLIGHT", 1)
+    inside, done = threading.Event(), threading.Event()
+
+    def hold():
+        inside.set()
+        done.wait(5)
+
+    client = _app(monkeypatch, plan_name="Pro", view=hold)
+    first = threading.Thread(target=client.post, args=("/generate",))
+    first.start()
+    inside.wait(5)
+    try:
+        resp = client.post("/generate")
+        assert resp.status_code == 503 and resp.headers["Retry-After"]
+    finally:
+        done.set()
+        first.join()
+    assert client.post("/generate").status_code == 200
+
+
+def test_free_plan_is_degraded_under_load(monkeypatch):
+    monkeypatch.setattr(admission, "DEGRADE_QUEUE_SECONDS", 1)
+    monkeypatch.setattr(admission, "REJECT_QUEUE_SECONDS", 100)
+    client = _app(monkeypatch)
+    assert client.post("/generate").get_json()["model"] == "gpt-4o"
+
+    for _ in range(20):
+        admission.record_queue_wait(5)
+    assert admission.admission_state()["level"] == "degrade"
+    assert client.post("/generate").get_json()["model"] == admission.DEGRADED_MODELS["text"]
+
+    paid = _app(monkeypatch, plan_name="Pro")
+    for _ in range(20):
+        admission.record_queue_wait(5)
+    assert paid.post("/generate").get_json()["model"] == "gpt-4o"
+
+
+def test_stream_readers_use_the_generation_thread_budget(monkeypatch):
+    monkeypatch.setattr(admission, "REJECT_QUEUE_SECONDS", 1)
+    monkeypatch.setattr(admission, "DEGRADE_QUEUE_SECONDS", 1)
+    client = _app(monkeypatch, operation="stream")
+
+    # fila lenta não recusa reconexões: o leitor só ocupa uma thread
+    for _ in range(20):
+        admission.record_queue_wait(5)
+    assert client.post("/generate").get_json()["model"] == "gpt-4o"
+
+    monkeypatch.setattr(admission, "_in_flight", admission.MAX_IN_FLIGHT)
+    assert client.post("/generate").status_code == 503
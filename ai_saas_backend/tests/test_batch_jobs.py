@@ -0,0 +1,195 @@
+import json
+import threading
+import uuid
+
+import pytest
+from flask import Flask, jsonify, request
+from werkzeug.serving import make_server
+
+import utils.batch_jobs as batch_jobs
+from extensions import db
+from models import User, BatchJob, BatchItem, GeneratedContent
+from utils.batch_jobs import OpenAIBatch, materialize, parse_prompts
+
+
+def _fake_openai():
+    """Substituto local de /v1/files e /v1/batches: responde cada linha do arquivo de entrada."""
+    app = Flask("fake_openai")
+    files, batches = {}, {}
+
+    @app.route("/v1/files", methods=["POST"])
+    def upload():
+        file_id = f"file-{len(files)}"
+        files[file_id] = request.files["file"].read().decode("utf-8")
+        return jsonify({"id": file_id, "purpose": request.form["purpose"]})
+
+    @app.route("/v1/batches", methods=["POST"])
+    def create():
+        batch_id = f"batch-{len(batches)}"
+        batches[batch_id] = {"id": batch_id, "status": "in_progress", **request.get_json()}
+        return jsonify(batches[batch_id])
+
+    @app.route("/v1/batches/<batch_id>", methods=["GET"])
+    def retrieve(batch_id):
+        batch = batches[batch_id]
+        if batch["status"] == "in_progress":
+            # primeira consulta ainda em andamento; na seguinte o resultado está pronto
+            batch["status"] = "completed"
+            return jsonify({**batch, "status": "in_progress"})
+        out, err = [], []
+        for line in files[batch["input_file_id"]].splitlines():
+            row = json.loads(line)
+            prompt = row["body"]["messages"][0]["content"]
+            if prompt == "falha":
+                err.append({"custom_id": row["custom_id"], "response": None, "error": {"message": "recusado"}})
+            else:
+                out.append({"custom_id": row["custom_id"], "response": {"status_code": 200, "body": {
+                    "choices": [{"message": {"content": prompt.upper()}}],
+                    "usage": {"prompt_tokens": 3, "completion_tokens": 2, "total_tokens": 5},
+                }}})
+        files["out"] = "\n".join(json.dumps(r) for r in out)
+        files["err"] = "\n".join(json.dumps(r) for r in err)
+        return jsonify({**batch, "output_file_id": "out", "error_file_id": "err"})
+
+    @app.route("/v1/files/<file_id>/content", methods=["GET"])
+    def content(file_id):
+        return files[file_id]
+
+    return app
+
+
+@pytest.fixture
+def fake_openai(monkeypatch):
+    monkeypatch.setattr(batch_jobs, "call_provider", lambda provider, model, fn, policy=None: fn(30))
+    server = make_server("127.0.0.1", 0, _fake_openai())
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    thread.join()
+
+
+def test_parse_prompts_formats():
+    assert parse_prompts("p.txt", b"um\n\n dois \n") == ["um", "dois"]
+    assert parse_prompts("p.csv", "id,prompt\n1,gato\n2,\"cão, azul\"\n") == ["gato", "cão, azul"]
+    assert parse_prompts("p.jsonl", '{"prompt": "a"}\n"b"\n') == ["a", "b"]
+
+
+def test_openai_batch_round_trip(fake_openai):
+    job = BatchJob(id="job-1", user_id="u", kind="text", model="gpt-4o", mode="openai_batch",
+                   params=json.dumps({"temperature": 0.2}))
+    items = [BatchItem(id="item-a", prompt="olá"), BatchItem(id="item-b", prompt="falha")]
+    client = OpenAIBatch(base_url=fake_openai, api_key="teste")
+
+    job.provider_batch_id = client.submit(job, items)
+    assert client.poll(job) is None
+
+    results = client.poll(job)
+    assert results["item-a"] == {"text": "OLÁ", "usage": (3, 2, 5)}
+    assert results["item-b"] == {"error": "recusado"}
+
+
+def test_materialize_writes_contents_and_counters(test_client):
+    with test_client.application.app_context():
+        user = User.query.filter_by(username="testuser").first()
+        job = BatchJob(user_id=user.id, kind="text", model="gpt-4o", mode="pool",
+                       params=json.dumps({"temperature": 0.5}), total_items=2)
+        db.session.add(job)
+        db.session.flush()
+        ok, bad = str(uuid.uuid4()), str(uuid.uuid4())
+        db.session.add_all([
+            BatchItem(id=ok, job_id=job.id, position=0, prompt="p1"),
+            BatchItem(id=bad, job_id=job.id, position=1, prompt="p2"),
+        ])
+        db.session.commit()
+
+        assert materialize(job, {
+            ok: ("p1", {"text": "r1", "usage": (1, 1, 2)}),
+            bad: ("p2", {"error": "timeout"}),
+        }) == (1, 1)
+
+        db.session.refresh(job)
+        assert (job.succeeded_items, job.failed_items) == (1, 1)
+        item = db.session.get(BatchItem, ok)
+        assert item.status == "succeeded"
+        assert db.session.get(GeneratedContent, item.content_id).content_data == "r1"
+        assert db.session.get(BatchItem, bad).error == "timeout"
+
+
+class _LockRedis:
+    """Só o necessário para o lock dos jobs (o script Lua emulado em Python)."""
+
+    def __init__(self):
+        self.data = {}
+
+    def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.data:
+            return None
+        self.data[key] = value
+        return True
+
+    def register_script(self, source):
+        def script(keys, args):
+            if self.data.get(keys[0]) != args[0]:
+                return 0
+            if int(args[1]) == 0:
+                self.data.pop(keys[0])
+            return 1
+        return script
+
+
+def test_lock_is_renewed_and_released_only_by_its_owner(monkeypatch):
+    monkeypatch.setattr(batch_jobs, "redis_client", _LockRedis())
+    monkeypatch.setattr(batch_jobs, "_lock_script", None)
+
+    token = batch_jobs._take_lock("job")
+    assert token and batch_jobs._take_lock("job") is None
+
+    # lock expirado e assumido por outro nó: o antigo dono não renova nem apaga
+    assert not batch_jobs._refresh_lock("job", "outro")
+    batch_jobs._release_lock("job", "outro")
+    assert batch_jobs._take_lock("job") is None
+
+    assert batch_jobs._refresh_lock("job", token)
+    batch_jobs._release_lock("job", token)
+    assert batch_jobs._take_lock("job")
+
+
+def test_pool_jobs_do_not_hold_up_provider_batches(test_client, monkeypatch):
+    monkeypatch.setattr(batch_jobs, "_take_lock", lambda job_id: "token")
+    monkeypatch.setattr(batch_jobs, "_release_lock", lambda job_id, token: None)
+    release, advanced = threading.Event(), []
+
+    def fake_advance(job, lost=None):
+        advanced.append(job.id)
+        if job.id == pool_id:
+            release.wait(10)
+
+    monkeypatch.setattr(batch_jobs, "advance_job", fake_advance)
+    with test_client.application.app_context():
+        user = User.query.filter_by(username="testuser").first()
+        pool = BatchJob(user_id=user.id, kind="image", model="gpt-image-1", mode="pool")
+        provider = BatchJob(user_id=user.id, kind="text", model="gpt-4o", mode="openai_batch")
+        db.session.add_all([pool, provider])
+        db.session.commit()
+        pool_id, provider_id = pool.id, provider.id
+
+        batch_jobs.process_jobs()
+
+        # o lote do provedor foi consultado enquanto o job do pool ainda roda
+        assert provider_id in advanced and pool_id in batch_jobs._running
+        release.set()
+
+
+def test_batch_is_charged_per_item_in_the_batch_window(monkeypatch):
+    import utils.rate_limit as rate_limit
+
+    calls = []
+    monkeypatch.setattr(rate_limit, "plan_rate_limit", lambda user: 60)
+    monkeypatch.setattr(rate_limit, "consume", lambda key, cost, limit, window=None: calls.append((key, cost, limit, window)) or (cost <= limit, 30, 0))
+    user = type("U", (), {"id": "u1", "role": "user"})()
+
+    assert rate_limit.charge_batch(user, "image", 100) is None
+    with Flask(__name__).app_context():
+        assert rate_limit.charge_batch(user, "image", 1000).status_code == 429
+    assert calls[0] == ("batch:u1", 500, 60 * 60, rate_limit.BATCH_WINDOW)
@@ -0,0 +1,120 @@
+import json
+import threading
+
+import pytest
+
+import utils.cancellation as cancellation
+from utils.cancellation import CancelToken, GenerationCancelled
+from utils.provider_stream import collect_stream
+
+
+class _FakeStream:
+    """Stream SSE que entrega os eventos e depois fica aberto até close()."""
+
+    def __init__(self, events, hang=False):
+        self.events = events
+        self.hang = hang
+        self.closed = threading.Event()
+        self.status_code = 200
+        self.headers = {}
+
+    def iter_lines(self, decode_unicode=True):
+        for event in self.events:
+            yield "data: " + json.dumps(event)
+            yield ""
+        if self.hang:
+            self.closed.wait(5)
+            raise OSError("conexão fechada")
+        yield "data: [DONE]"
+
+    def close(self):
+        self.closed.set()
+
+
+def _chunk(text):
+    return {"choices": [{"delta": {"content": text}}]}
+
+
+class _MemoryRedis:
+    def __init__(self):
+        self.data = {}
+
+    def setex(self, key, ttl, value):
+        self.data[key] = str(value)
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def mget(self, keys):
+        return [self.data.get(k) for k in keys]
+
+    def delete(self, *keys):
+        for k in keys:
+            self.data.pop(k, None)
+
+
+def test_stream_is_assembled_like_a_regular_completion():
+    events = [_chunk("Olá"), _chunk(", mundo"), {"choices": [], "usage": {"prompt_tokens": 3, "completion_tokens": 2}}]
+    resp = collect_stream(_FakeStream(events), "openai")
+
+    assert resp.json()["choices"][0]["message"]["content"] == "Olá, mundo"
+    assert resp.json()["usage"]["completion_tokens"] == 2
+
+    anthropic = [
+        {"type": "message_start", "message": {"usage": {"input_tokens": 5}}},
+        {"type": "content_block_delta", "delta": {"type": "text_delta", "text": "Oi"}},
+        {"type": "message_delta", "usage": {"output_tokens": 1}},
+    ]
+    data = collect_stream(_FakeStream(anthropic), "anthropic").json()
+    assert data["content"][0]["text"] == "Oi" and data["usage"] == {"input_tokens": 5, "output_tokens": 1}
+
+
+def test_cancel_closes_upstream_and_keeps_partial_text():
+    stream = _FakeStream([_chunk("parcial "), _chunk("até aqui")], hang=True)
+    token = CancelToken("g1", "user-1")
+    threading.Timer(0.1, token.cancel, args=("user_cancelled",)).start()
+
+    with pytest.raises(GenerationCancelled) as exc:
+        collect_stream(stream, "openai", token)
+
+    assert stream.closed.is_set()
+    assert exc.value.partial_text == "parcial até aqui" == token.partial_text
+
+
+def test_only_the_owner_can_cancel(monkeypatch):
+    monkeypatch.setattr(cancellation, "redis_client", _MemoryRedis())
+    token = cancellation.start_generation("user-1", "g2")
+    try:
+        assert cancellation.request_cancel("g2", "user-2") is False
+        assert not token.cancelled
+        assert cancellation.request_cancel("g2", "user-1") is True
+        assert token.cancelled and token.reason == "user_cancelled"
+    finally:
+        monkeypatch.setattr(cancellation, "incr", lambda *a, **k: None)
+        cancellation.finish_generation(token)
+    assert cancellation.request_cancel("g2", "user-1") is False
+
+
+def test_openrouter_completion_streams_and_reports_usage(monkeypatch):
+    import importlib
+
+    ai_api = importlib.import_module("routes.ai_generation_api")
+    sent = []
+
+    def fake_post(url, headers=None, json=None, timeout=None, stream=False):
+        sent.append((url, json, stream))
+        return _FakeStream([_chunk("Olá"), {"choices": [], "usage": {"prompt_tokens": 7, "completion_tokens": 1}}])
+
+    monkeypatch.setattr(ai_api.requests, "post", fake_post)
+    monkeypatch.setattr(ai_api, "call_provider", lambda provider, model, fn, policy=None: fn(30))
+    deltas = []
+    sink = type("Sink", (), {"restart": lambda self: None, "write": lambda self, d: deltas.append(d)})()
+    keys = {"OPENROUTER_API_KEY": "k", "OPENAI_API_KEY": "k"}
+
+    used, body, response = ai_api.request_chat_completion(
+        "meta-llama/llama-3-70b", [{"role": "user", "content": "oi"}], 0.7, keys, CancelToken("g1", "u1"), sink,
+    )
+
+    url, sent_body, stream = sent[0]
+    assert url.startswith("https://openrouter.ai") and stream and sent_body["stream_options"] == {"include_usage": True}
+    assert deltas == ["Olá"] and response.json()["usage"]["prompt_tokens"] == 7
@@ -0,0 +1,69 @@
+import uuid
+from types import SimpleNamespace
+
+import redis
+
+from extensions import bcrypt, db
+from models import User, Chat
+import utils.chat_titles as chat_titles
+from utils.chat_titles import provisional_title, generate_titles
+
+
+class _NoRedis:
+    def delete(self, *keys):
+        raise redis.exceptions.ConnectionError("sem redis")
+
+
+def test_provisional_title_is_local_and_short():
+    assert provisional_title("") == "Novo Chat"
+    assert provisional_title("  **como** faço um bolo de cenoura com cobertura?") == "Como faço um bolo de cenoura"
+    assert len(provisional_title("palavra" * 40)) <= chat_titles.MAX_TITLE_CHARS
+
+
+def test_batch_request_maps_titles_by_chat_id(monkeypatch):
+    content = 'Títulos:\n{"c2": "\\"Viagem a Paris\\"", "c1": "Bolo de cenoura", "outro": "Injetado"}'
+    response = SimpleNamespace(status_code=200, json=lambda: {"choices": [{"message": {"content": content}}]})
+    monkeypatch.setattr("utils.retry.call_provider", lambda provider, model, fn, policy=None: response)
+
+    titles = chat_titles._request_titles({"c1": "receita de bolo", "c2": "roteiro em paris", "c3": "terceiro"})
+
+    assert titles == {"c1": "Bolo de cenoura", "c2": "Viagem a Paris", "c3": None}
+
+
+def test_generate_titles_calls_once_per_user_and_keeps_renamed(test_client, monkeypatch):
+    calls = []
+
+    def fake_request(prompts):
+        calls.append(set(prompts.values()))
+        return {chat_id: f"Título {prompt}" for chat_id, prompt in prompts.items()}
+
+    monkeypatch.setattr(chat_titles, "redis_client", _NoRedis())
+    monkeypatch.setattr(chat_titles, "incr", lambda *a, **k: None)
+    monkeypatch.setattr(chat_titles, "_request_titles", fake_request)
+    with test_client.application.app_context():
+        users = []
+        for _ in range(2):
+            user = User(
+                id=str(uuid.uuid4()), full_name="T", username=f"t_{uuid.uuid4().hex[:6]}",
+                email=f"t_{uuid.uuid4().hex[:6]}@example.com",
+                password=bcrypt.generate_password_hash("Senha123!").decode("utf-8"),
+            )
+            db.session.add(user)
+            users.append(user)
+        db.session.flush()
+        fresh = Chat(user_id=users[0].id, title="Receita de bolo")
+        renamed = Chat(user_id=users[0].id, title="Meu nome")
+        other = Chat(user_id=users[1].id, title="Paris")
+        db.session.add_all([fresh, renamed, other])
+        db.session.commit()
+
+        generate_titles([
+            {"chat_id": fresh.id, "prompt": "bolo", "provisional": "Receita de bolo"},
+            {"chat_id": renamed.id, "prompt": "renomeado", "provisional": "Renomeado"},
+            {"chat_id": other.id, "prompt": "paris", "provisional": "Paris"},
+        ])
+
+        assert sorted(calls, key=sorted) == [{"bolo"}, {"paris"}]
+        assert db.session.get(Chat, fresh.id).title == "Título bolo"
+        assert db.session.get(Chat, renamed.id).title == "Meu nome"
+        assert db.session.get(Chat, other.id).title == "Título paris"
@@ -0,0 +1,84 @@
+from types import SimpleNamespace
+
+import fakeredis
+import pytest
+
+import utils.circuit_breaker as circuit_breaker
+from utils.circuit_breaker import CLOSED, OPEN, CircuitOpenError
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(circuit_breaker, "redis_client", fakeredis.FakeRedis(decode_responses=True))
+    monkeypatch.setattr(circuit_breaker, "time", SimpleNamespace(time=lambda: now[0]))
+    monkeypatch.setattr(circuit_breaker, "MIN_CALLS", 4)
+    return now
+
+
+def _state(scope):
+    return circuit_breaker._state(scope)["state"]
+
+
+def test_error_rate_opens_model_and_provider(clock):
+    for ok in (True, False, False, False):
+        circuit_breaker.record("openai", "gpt-4o", ok, 200)
+
+    assert _state("openai:gpt-4o") == OPEN and _state("openai") == OPEN
+    with pytest.raises(CircuitOpenError) as err:
+        circuit_breaker.check("openai", "gpt-4o")
+    assert err.value.retry_after > 0
+
+
+def test_half_open_lets_one_probe_through(clock):
+    for _ in range(4):
+        circuit_breaker.record("anthropic", None, False, 100)
+    clock[0] += circuit_breaker.OPEN_SECONDS + 1
+
+    circuit_breaker.check("anthropic")
+    # só uma sonda por vez entre todos os nós
+    with pytest.raises(CircuitOpenError):
+        circuit_breaker.check("anthropic")
+
+    circuit_breaker.record("anthropic", None, False, 100)
+    assert _state("anthropic") == OPEN
+
+    clock[0] += circuit_breaker.OPEN_SECONDS + 1
+    circuit_breaker.check("anthropic")
+    circuit_breaker.record("anthropic", None, True, 100)
+    assert _state("anthropic") == CLOSED
+    assert circuit_breaker.window_stats("anthropic")["calls"] == 0
+
+
+def test_open_model_does_not_hold_the_provider_probe(clock):
+    for _ in range(4):
+        circuit_breaker.record("openai", "gpt-4o", False, 100)
+    # o provedor já pode sondar; o modelo continua aberto
+    circuit_breaker.redis_client.hset(circuit_breaker._KEY.format("openai", "state"), "opened_at", clock[0] - circuit_breaker.OPEN_SECONDS - 1)
+
+    with pytest.raises(CircuitOpenError) as err:
+        circuit_breaker.check("openai", "gpt-4o")
+    assert err.value.scope == "openai:gpt-4o"
+    # a sonda do provedor segue livre para outra chamada
+    circuit_breaker.check("openai", "gpt-4o-mini")
+
+
+def test_old_buckets_leave_the_window(clock):
+    for _ in range(3):
+        circuit_breaker.record("gemini", None, False, 100)
+    assert circuit_breaker.window_stats("gemini")["calls"] == 3
+
+    clock[0] += circuit_breaker.WINDOW_SECONDS
+    circuit_breaker.record("gemini", None, False, 100)
+    # as 3 falhas antigas saíram da janela: 1 chamada não atinge MIN_CALLS
+    assert circuit_breaker.window_stats("gemini")["calls"] == 1
+    assert _state("gemini") == CLOSED
+
+
+def test_slow_model_opens_only_its_own_circuit(clock):
+    for _ in range(4):
+        circuit_breaker.record("openai", "gpt-image-1", True, circuit_breaker.LATENCY_THRESHOLD_MS + 1)
+
+    assert _state("openai:gpt-image-1") == OPEN
+    assert _state("openai") == CLOSED
+    circuit_breaker.check("openai", "gpt-4o")
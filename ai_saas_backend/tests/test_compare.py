@@ -0,0 +1,45 @@
+import importlib
+import queue
+
+import pytest
+
+# routes/__init__ reexporta o blueprint com o mesmo nome do módulo
+ai_api = importlib.import_module("routes.ai_generation_api")
+CompareSink, complete_text = ai_api.CompareSink, ai_api.complete_text
+
+
+def test_compare_follows_the_fallback_chain(monkeypatch):
+    monkeypatch.setattr(ai_api, "route_model", lambda model, allowed: [model, "claude-haiku-4-5"])
+    calls = []
+
+    def once(model_id, session_messages, temperature, env_keys, sink=None):
+        calls.append(model_id)
+        if model_id == "claude-opus-4-5":
+            raise RuntimeError("529: overloaded")
+        return "resposta", (3, 2, 5)
+
+    monkeypatch.setattr(ai_api, "_complete_text_once", once)
+
+    assert complete_text("claude-opus-4-5", [], 0.7, {}, "pro") == ("claude-haiku-4-5", "resposta", (3, 2, 5))
+    assert calls == ["claude-opus-4-5", "claude-haiku-4-5"]
+
+    monkeypatch.setattr(ai_api, "route_model", lambda model, allowed: [model])
+    with pytest.raises(RuntimeError):
+        complete_text("claude-opus-4-5", [], 0.7, {}, "pro")
+
+
+def test_sink_tags_deltas_with_the_model_and_resets_on_retry():
+    events = queue.Queue()
+    sink = CompareSink("gpt-4o", events)
+
+    sink.restart()
+    sink.write("Olá")
+    sink.restart()
+    sink.write("Oi")
+
+    received = [events.get_nowait() for _ in range(events.qsize())]
+    assert received == [
+        ("delta", "gpt-4o", "Olá"),
+        ("reset", "gpt-4o", None),
+        ("delta", "gpt-4o", "Oi"),
+    ]
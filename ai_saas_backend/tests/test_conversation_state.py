@@ -0,0 +1,82 @@
+import importlib
+import json
+from datetime import datetime
+from types import SimpleNamespace
+
+import utils.conversation_state as conversation_state
+from utils.provider_stream import collect_stream
+
+ai_api = importlib.import_module("routes.ai_generation_api")
+
+
+def _chat(**state):
+    fields = dict(state_provider="openai", state_id="resp_1", state_message_id="ai-1", state_updated_at=datetime.utcnow())
+    fields.update(state)
+    return SimpleNamespace(**fields)
+
+
+class _Response:
+    def __init__(self, status_code, payload):
+        self.status_code = status_code
+        self.payload = payload
+        self.text = json.dumps(payload)
+
+    def json(self):
+        return self.payload
+
+
+def test_state_is_continued_only_when_it_covers_the_history(monkeypatch):
+    monkeypatch.setattr(conversation_state, "incr", lambda *a, **k: None)
+
+    assert conversation_state.previous_id(_chat(), "openai", "ai-1") == "resp_1"
+    # outro modelo respondeu depois (ou foi uma comparação): o estado não cobre o histórico
+    assert conversation_state.previous_id(_chat(), "openai", "ai-2") is None
+    assert conversation_state.previous_id(_chat(), "gemini", "ai-1") is None
+    old = datetime.utcnow() - conversation_state.STATE_TTL["openai"]
+    assert conversation_state.previous_id(_chat(state_updated_at=old), "openai", "ai-1") is None
+
+
+def test_responses_sends_only_the_new_message_and_rebuilds_when_state_is_gone(monkeypatch):
+    monkeypatch.setattr(conversation_state, "incr", lambda *a, **k: None)
+    sent = []
+
+    def fake_request(url, headers, body, policy=None, cancel=None, sink=None):
+        sent.append(body)
+        if body.get("previous_response_id"):
+            return _Response(404, {"error": {"message": "Previous response with id 'resp_1' not found."}})
+        return _Response(200, {"id": "resp_2", "output": [{"type": "message", "content": [{"type": "output_text", "text": "oi"}]}]})
+
+    monkeypatch.setattr(ai_api, "make_request_with_retry", fake_request)
+    history = [
+        {"role": "user", "content": "primeira"},
+        {"role": "assistant", "content": "resposta"},
+        {"role": "user", "content": "segunda"},
+    ]
+
+    body, response = ai_api.request_openai_response("gpt-4o", history, 0.7, "k", previous_response_id="resp_1")
+
+    assert sent[0]["input"] == [{"role": "user", "content": "segunda"}]
+    assert sent[0]["instructions"] and sent[0]["store"] is True
+    assert "previous_response_id" not in body and [m["content"] for m in body["input"]] == ["primeira", "resposta", "segunda"]
+    assert response.status_code == 200 and ai_api.extract_text_from_responses(response.json()) == "oi"
+
+
+def test_responses_stream_keeps_the_final_response():
+    class _Stream:
+        status_code, headers = 200, {}
+
+        def iter_lines(self, decode_unicode=True):
+            for event in (
+                {"type": "response.output_text.delta", "delta": "Ol"},
+                {"type": "response.output_text.delta", "delta": "á"},
+                {"type": "response.completed", "response": {"id": "resp_9", "usage": {"input_tokens": 4}}},
+            ):
+                yield "data: " + json.dumps(event)
+
+        def close(self):
+            pass
+
+    deltas = []
+    resp = collect_stream(_Stream(), "responses", on_delta=deltas.append)
+    assert "".join(deltas) == "Olá"
+    assert resp.json()["id"] == "resp_9" and resp.json()["usage"] == {"input_tokens": 4}
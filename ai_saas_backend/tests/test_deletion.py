@@ -0,0 +1,126 @@
+import uuid
+
+from extensions import bcrypt, db
+from models import (
+    User, Chat, ChatMessage, ChatAttachment, Project, Notification, BatchJob, BatchItem,
+    GeneratedContent, GeneratedImageContent, project_content_association,
+)
+from utils import delete_chats, delete_contents, delete_messages
+from utils.deletion import delete_user_data, remove_files, unreferenced_paths
+
+
+def _make_user():
+    user = User(
+        id=str(uuid.uuid4()),
+        full_name="Heavy User",
+        username=f"heavy_{uuid.uuid4().hex[:6]}",
+        email=f"heavy_{uuid.uuid4().hex[:6]}@example.com",
+        password=bcrypt.generate_password_hash("Senha123!").decode("utf-8"),
+        role="user",
+        is_active=True,
+    )
+    db.session.add(user)
+    db.session.flush()
+    return user
+
+
+def _make_chat(user, path, n_messages=3):
+    chat = Chat(user_id=user.id, title="c")
+    db.session.add(chat)
+    db.session.flush()
+    for i in range(n_messages):
+        msg = ChatMessage(chat_id=chat.id, user_id=user.id, role="user", content=f"m{i}")
+        db.session.add(msg)
+        db.session.flush()
+        db.session.add(ChatAttachment(message_id=msg.id, name="a.png", path=str(path), mimetype="image/png"))
+    return chat
+
+
+def test_delete_chats_only_touches_owned_chat(test_client, tmp_path):
+    with test_client.application.app_context():
+        owner, other = _make_user(), _make_user()
+        chat = _make_chat(owner, tmp_path / "a.png")
+        foreign = _make_chat(other, tmp_path / "b.png")
+        db.session.commit()
+        chat_id, foreign_id = chat.id, foreign.id
+
+        assert delete_chats(other.id, [chat_id]) == 0
+        assert delete_chats(owner.id, [chat_id]) == 1
+
+        assert db.session.get(Chat, chat_id) is None
+        assert ChatMessage.query.filter_by(chat_id=chat_id).count() == 0
+        assert ChatMessage.query.filter_by(chat_id=foreign_id).count() == 3
+
+
+def test_delete_messages_keeps_the_rest_of_the_chat(test_client, tmp_path):
+    with test_client.application.app_context():
+        user = _make_user()
+        chat = _make_chat(user, tmp_path / "m.png")
+        db.session.commit()
+        first, *rest = [m.id for m in ChatMessage.query.filter_by(chat_id=chat.id).order_by(ChatMessage.content)]
+
+        assert delete_messages(chat.id, rest) == 2
+
+        assert [m.id for m in ChatMessage.query.filter_by(chat_id=chat.id)] == [first]
+        assert ChatAttachment.query.filter(ChatAttachment.message_id.in_(rest)).count() == 0
+
+
+def test_delete_user_data_in_batches(test_client, tmp_path, monkeypatch):
+    monkeypatch.setattr("utils.deletion.BATCH_SIZE", 2)
+    with test_client.application.app_context():
+        user = _make_user()
+        _make_chat(user, tmp_path / "c.png", n_messages=5)
+        content = GeneratedImageContent(user_id=user.id, prompt="p", model_used="gpt-image-1", file_path=str(tmp_path / "img.png"))
+        project = Project(name="p", user_id=user.id)
+        project.contents.append(content)
+        db.session.add_all([content, project, Notification(user_id=user.id, message="hi")])
+        db.session.commit()
+        user_id = user.id
+
+        progress = delete_user_data(user_id)
+
+        assert progress["chats"] == 1
+        assert progress["contents"] == 1
+        assert db.session.get(User, user_id) is None
+        assert GeneratedContent.query.filter_by(user_id=user_id).count() == 0
+        assert db.session.execute(db.select(project_content_association)).all() == []
+
+
+def test_delete_user_data_with_batch_jobs(test_client, monkeypatch):
+    monkeypatch.setattr("utils.deletion.BATCH_SIZE", 2)
+    with test_client.application.app_context():
+        user = _make_user()
+        job = BatchJob(user_id=user.id, kind="text", model="gpt-4o-mini", mode="pool", total_items=3)
+        db.session.add(job)
+        db.session.flush()
+        db.session.add_all([BatchItem(job_id=job.id, position=i, prompt=f"p{i}") for i in range(3)])
+        db.session.commit()
+        user_id, job_id = user.id, job.id
+
+        progress = delete_user_data(user_id)
+
+        assert progress["batches"] == 1
+        assert db.session.get(User, user_id) is None
+        assert BatchItem.query.filter_by(job_id=job_id).count() == 0
+
+
+def test_delete_contents_and_shared_files(test_client, tmp_path):
+    with test_client.application.app_context():
+        user = _make_user()
+        shared = tmp_path / "shared.png"
+        shared.write_bytes(b"x")
+        kept = GeneratedImageContent(user_id=user.id, prompt="a", model_used="m", file_path=str(shared))
+        gone = GeneratedImageContent(user_id=user.id, prompt="b", model_used="m", file_path=str(shared))
+        db.session.add_all([kept, gone])
+        db.session.commit()
+
+        assert delete_contents(user.id, [gone.id, "inexistente"]) == 1
+        # ainda referenciado por outro conteúdo: nem chega a ser agendado
+        assert unreferenced_paths([str(shared)]) == []
+        assert shared.exists()
+
+        delete_contents(user.id, [kept.id])
+        assert unreferenced_paths([str(shared)]) == [str(shared)]
+        # a fila em segundo plano pode ter chegado antes; o resultado final é o mesmo
+        remove_files([str(shared)])
+        assert not shared.exists()
@@ -0,0 +1,104 @@
+from types import SimpleNamespace
+
+from utils import documents
+from utils.documents import ChatIndex, split_chunks, with_context
+
+
+def _pdf(path, text):
+    """PDF mínimo de uma página com `text` (fonte padrão Helvetica)."""
+    stream = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET".encode("latin-1")
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents 4 0 R /Resources << /Font << /F1 5 0 R >> >> >>",
+        b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    out, offsets = b"%PDF-1.4\n", []
+    for i, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % i + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % o for o in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    path.write_bytes(out)
+    return str(path)
+
+
+def _chunk(attachment_id, position, text):
+    return SimpleNamespace(attachment_id=attachment_id, position=position, page=1, text=text,
+                           tokens=documents.estimate_tokens(text))
+
+
+def test_pdf_text_is_extracted_per_page(tmp_path):
+    path = _pdf(tmp_path / "contrato.pdf", "Prazo de entrega: 30 dias")
+    assert documents.extract_pdf_pages(path) == [(1, "Prazo de entrega: 30 dias")]
+
+
+def test_chunks_overlap_and_respect_the_size(monkeypatch):
+    monkeypatch.setattr(documents, "CHUNK_TOKENS", 10)
+    monkeypatch.setattr(documents, "CHUNK_OVERLAP_TOKENS", 2)
+    words = " ".join(f"palavra{i}" for i in range(40))
+
+    chunks = split_chunks([(3, words)])
+
+    assert len(chunks) > 1 and all(page == 3 and len(text) <= 40 for page, text in chunks)
+    # o começo de cada trecho repete o fim do anterior, sem cortar palavras
+    first, second = chunks[0][1].split(), chunks[1][1].split()
+    assert second[0] in first and all(w.startswith("palavra") for w in first + second)
+
+
+def test_bm25_picks_relevant_chunks_within_budget():
+    chunks = [
+        _chunk("a", 0, "Introdução ao relatório anual da empresa."),
+        _chunk("a", 1, "A multa por atraso é de 2% ao mês sobre o valor do contrato."),
+        _chunk("a", 2, "Anexo com fotos do evento de fim de ano."),
+        _chunk("b", 0, "Multa rescisória: três aluguéis, proporcional ao tempo restante. " * 4),
+    ]
+    index = ChatIndex(chunks)
+
+    top = index.top("qual a multa por atraso?", budget_tokens=1000, k=2)
+    assert [c.text for c in top][0].startswith("A multa por atraso")
+    assert chunks[2] not in top
+
+    # orçamento pequeno: só o que cabe
+    assert index.top("multa", budget_tokens=chunks[1].tokens, k=5) == [chunks[1]]
+    # sem termos em comum: começo do documento mais recente
+    assert index.top("resuma", budget_tokens=1000) == [chunks[3]]
+
+
+def test_context_goes_only_into_the_current_message():
+    history = [{"role": "user", "content": "oi"}, {"role": "user", "content": "e a multa?"}]
+    result = with_context(history, "Trechos relevantes...")
+    assert result[0] is history[0] and history[1]["content"] == "e a multa?"
+    assert result[1]["content"] == "e a multa?\n\nTrechos relevantes..."
+    assert with_context(history, "") is history
+
+
+def test_pdf_is_indexed_once_and_retrieved_for_the_chat(test_client, tmp_path, monkeypatch):
+    from extensions import db
+    from models import User, Chat, ChatMessage, ChatAttachment, DocumentChunk
+
+    monkeypatch.setattr(documents, "incr", lambda *a, **k: None)
+    with test_client.application.app_context():
+        user = User.query.filter_by(username="testuser").first()
+        chat = Chat(user_id=user.id, title="pdf")
+        db.session.add(chat)
+        db.session.flush()
+        msg = ChatMessage(chat_id=chat.id, role="user", content="segue o contrato")
+        db.session.add(msg)
+        db.session.flush()
+        att = ChatAttachment(message_id=msg.id, name="contrato.pdf", mimetype="application/pdf",
+                             path=_pdf(tmp_path / "contrato.pdf", "Clausula de reajuste anual pelo IPCA"))
+        db.session.add(att)
+        db.session.flush()
+
+        assert documents.index_attachment(att, chat.id) == 1
+        assert documents.index_attachment(att, chat.id) == 0
+        db.session.commit()
+
+        assert att.text_status == "indexed"
+        assert DocumentChunk.query.filter_by(chat_id=chat.id).count() == 1
+        context = documents.document_context(chat.id, "como funciona o reajuste?", {att.id: att.name})
+        assert "[contrato.pdf, p. 1]" in context and "IPCA" in context
@@ -0,0 +1,127 @@
+import json
+import socket
+
+import fakeredis
+import pytest
+
+aiosmtpd_controller = pytest.importorskip("aiosmtpd.controller")
+
+import utils.email_outbox as email_outbox
+import utils.reliable_queue as reliable_queue
+from utils.email_outbox import SMTPSender, build_email, deliver_batch
+
+
+class RecordingHandler:
+    def __init__(self):
+        self.messages = []
+        self.sessions = set()
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address.startswith("recusado@"):
+            return "550 mailbox unavailable"
+        if address.startswith("cheio@"):
+            return "452 mailbox full, try later"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        self.sessions.add(id(session))
+        self.messages.append((envelope.rcpt_tos[0], envelope.content.decode("utf-8", "replace")))
+        return "250 Message accepted"
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def smtp_server():
+    handler = RecordingHandler()
+    port = _free_port()
+    controller = aiosmtpd_controller.Controller(handler, hostname="127.0.0.1", port=port)
+    controller.start()
+    try:
+        yield handler, port
+    finally:
+        controller.stop()
+
+
+def _sender(port):
+    return SMTPSender(host="127.0.0.1", port=port, security="none", user="", password="", sender="noreply@example.com")
+
+
+def test_batch_reuses_one_connection(smtp_server):
+    handler, port = smtp_server
+    sender = _sender(port)
+    payloads = [build_email(f"user{i}@example.com", "Código", f"codigo {i}") for i in range(5)]
+
+    sent, failed = deliver_batch(sender, payloads)
+    sender.close()
+
+    assert len(sent) == 5 and failed == []
+    assert sender.connections_opened == 1
+    assert len(handler.sessions) == 1
+    assert [to for to, _ in handler.messages] == [p["to"] for p in payloads]
+
+
+def test_failures_are_classified(smtp_server):
+    handler, port = smtp_server
+    sender = _sender(port)
+    payloads = [
+        build_email("recusado@example.com", "x", "x"),
+        build_email("cheio@example.com", "x", "x"),
+        build_email("ok@example.com", "x", "x"),
+    ]
+
+    sent, failed = deliver_batch(sender, payloads)
+    sender.close()
+
+    assert [p["to"] for p in sent] == ["ok@example.com"]
+    permanent = {p["to"]: perm for p, perm, _ in failed}
+    assert permanent == {"recusado@example.com": True, "cheio@example.com": False}
+    # recusas do servidor não derrubam a conexão reaproveitada
+    assert sender.connections_opened == 1
+
+
+def test_reconnects_after_server_drop(smtp_server):
+    handler, port = smtp_server
+    sender = _sender(port)
+    deliver_batch(sender, [build_email("a@example.com", "x", "x")])
+    # simula o servidor derrubando a conexão ociosa
+    sender._conn.close()
+
+    sent, failed = deliver_batch(sender, [build_email("b@example.com", "x", "x")])
+    sender.close()
+
+    assert len(sent) == 1 and failed == []
+    assert sender.connections_opened == 2
+
+
+def test_crash_mid_batch_keeps_unsent_messages(smtp_server, monkeypatch):
+    handler, port = smtp_server
+    fake = fakeredis.FakeRedis(decode_responses=True)
+    monkeypatch.setattr(email_outbox, "redis_client", fake)
+    for i in range(3):
+        fake.rpush(email_outbox.OUTBOX_KEY, json.dumps(build_email(f"user{i}@example.com", "x", "x")))
+
+    sender = _sender(port)
+    real_send = sender.send
+
+    def send_then_crash(payload):
+        if payload["to"] == "user1@example.com":
+            raise RuntimeError("deploy no meio do lote")
+        real_send(payload)
+
+    monkeypatch.setattr(sender, "send", send_then_crash)
+    with pytest.raises(RuntimeError):
+        email_outbox.process_outbox(sender)
+    sender.close()
+
+    # a enviada saiu da lista de processamento; as outras sobrevivem ao "crash"
+    assert [to for to, _ in handler.messages] == ["user0@example.com"]
+    assert fake.llen(email_outbox.OUTBOX_KEY) == 0
+    assert reliable_queue.recover(fake, email_outbox.OUTBOX_KEY) == 2
+    queued = [json.loads(r)["to"] for r in fake.lrange(email_outbox.OUTBOX_KEY, 0, -1)]
+    assert queued == ["user1@example.com", "user2@example.com"]
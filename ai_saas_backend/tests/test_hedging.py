@@ -0,0 +1,115 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import utils.hedging as hedging
+
+
+@pytest.fixture
+def hedged(monkeypatch):
+    monkeypatch.setattr(hedging, "HEDGED_MODELS", {"slow/model:free": {"backup": "gpt-4o-mini"}})
+    monkeypatch.setattr(hedging, "hedge_delay", lambda model, percentile: 0.05)
+    monkeypatch.setattr(hedging, "_count_call", lambda: None)
+    monkeypatch.setattr(hedging, "_backup_available", lambda backup: True)
+    monkeypatch.setattr(hedging, "incr", lambda *a, **k: None)
+    budget = {"allowed": True}
+    monkeypatch.setattr(hedging, "_take_budget", lambda: budget["allowed"])
+    return budget
+
+
+def _ok(model):
+    return SimpleNamespace(status_code=200, model=model)
+
+
+def test_models_without_config_are_called_directly(hedged):
+    calls = []
+    assert hedging.hedged_call("gpt-4o", lambda m, leg: calls.append(m) or _ok(m))[0] == "gpt-4o"
+    assert calls == ["gpt-4o"]
+
+
+def test_backup_wins_when_primary_is_slow(hedged):
+    release = threading.Event()
+
+    def call(model, leg):
+        if model == "slow/model:free":
+            release.wait(2)
+        return _ok(model)
+
+    winner, response = hedging.hedged_call("slow/model:free", call)
+    release.set()
+    assert winner == "gpt-4o-mini" and response.model == "gpt-4o-mini"
+
+
+def test_failed_backup_falls_back_to_primary(hedged):
+    def call(model, leg):
+        if model == "gpt-4o-mini":
+            return SimpleNamespace(status_code=503)
+        threading.Event().wait(0.2)
+        return _ok(model)
+
+    assert hedging.hedged_call("slow/model:free", call)[0] == "slow/model:free"
+
+
+def test_no_hedge_without_budget(hedged):
+    hedged["allowed"] = False
+    calls = []
+
+    def call(model, leg):
+        calls.append(model)
+        threading.Event().wait(0.1)
+        return _ok(model)
+
+    assert hedging.hedged_call("slow/model:free", call)[0] == "slow/model:free"
+    assert calls == ["slow/model:free"]
+
+
+class _Sink:
+    def __init__(self):
+        self.events = []
+
+    def write(self, delta):
+        self.events.append(delta)
+
+    def restart(self):
+        self.events.append("reset")
+
+
+def test_first_byte_before_delay_skips_the_hedge(hedged):
+    calls = []
+
+    def call(model, leg):
+        calls.append(model)
+        leg.responded()
+        threading.Event().wait(0.2)
+        return _ok(model)
+
+    assert hedging.hedged_call("slow/model:free", call)[0] == "slow/model:free"
+    assert calls == ["slow/model:free"]
+
+
+def test_loser_is_aborted_and_only_winner_text_is_published(hedged):
+    sink = _Sink()
+    aborted = threading.Event()
+
+    def call(model, leg):
+        if model == "slow/model:free":
+            leg.cancel.on_cancel(aborted.set)
+            threading.Event().wait(0.1)
+            leg.sink.write("principal")
+            aborted.wait(2)
+            leg.cancel.raise_if_cancelled()
+            return _ok(model)
+        leg.sink.write("backup")
+        return _ok(model)
+
+    winner, _ = hedging.hedged_call("slow/model:free", call, sink=sink)
+    assert winner == "gpt-4o-mini"
+    assert aborted.wait(1)
+    assert sink.events == ["reset", "backup"]
+
+
+def test_backup_must_match_allowed_providers(monkeypatch):
+    monkeypatch.setattr(hedging, "HEDGED_MODELS", {"gpt-4o": {"backup": "claude-haiku-4-5"}})
+    assert hedging.hedge_config("gpt-4o", providers=("openai", "openrouter")) is None
+    assert hedging.hedge_config("gpt-4o")["backup"] == "claude-haiku-4-5"
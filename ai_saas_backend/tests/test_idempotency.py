@@ -0,0 +1,108 @@
+from io import BytesIO
+
+from flask import Flask, jsonify, request
+
+import utils.idempotency as idempotency
+from utils.idempotency import idempotent
+
+
+class _MemoryRedis:
+    def __init__(self):
+        self.data = {}
+
+    def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.data:
+            return None
+        self.data[key] = value
+        return True
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+    def expire(self, key, ttl):
+        self.expired = getattr(self, "expired", []) + [key]
+
+
+def _app(monkeypatch, status=201, view=None):
+    monkeypatch.setattr(idempotency, "redis_client", _MemoryRedis())
+    monkeypatch.setattr(idempotency, "get_jwt_identity", lambda: "user-1")
+    monkeypatch.setattr(idempotency, "incr", lambda *a, **k: None)
+    calls = []
+    app = Flask(__name__)
+
+    @app.route("/generate", methods=["POST"])
+    @idempotent("text")
+    def generate():
+        calls.append(1)
+        if view:
+            view()
+        return jsonify({"n": len(calls)}), status
+
+    return app.test_client(), calls
+
+
+def test_repeat_with_same_key_replays_first_response(monkeypatch):
+    client, calls = _app(monkeypatch)
+    headers = {"Idempotency-Key": "abc"}
+
+    first = client.post("/generate", json={"input": "oi"}, headers=headers)
+    second = client.post("/generate", json={"input": "oi"}, headers=headers)
+
+    assert first.status_code == second.status_code == 201
+    assert second.get_json() == {"n": 1} and second.headers["Idempotent-Replayed"] == "true"
+    assert len(calls) == 1
+
+    client.post("/generate", json={"input": "oi"})
+    assert len(calls) == 2
+
+
+def test_same_key_with_different_body_is_rejected(monkeypatch):
+    client, calls = _app(monkeypatch)
+    client.post("/generate", json={"input": "oi"}, headers={"Idempotency-Key": "abc"})
+
+    resp = client.post("/generate", json={"input": "outro"}, headers={"Idempotency-Key": "abc"})
+
+    assert resp.status_code == 422 and len(calls) == 1
+
+
+def test_same_file_name_with_other_content_is_rejected(monkeypatch):
+    seen = []
+    client, calls = _app(monkeypatch, view=lambda: seen.append(request.files["files"].read()))
+    headers = {"Idempotency-Key": "abc"}
+
+    def upload(content):
+        data = {"input": "oi", "files": (BytesIO(content), "doc.pdf")}
+        return client.post("/generate", data=data, headers=headers, content_type="multipart/form-data")
+
+    assert upload(b"versao 1").status_code == 201
+    # o hash não consome o arquivo: a rota ainda lê o conteúdo inteiro
+    assert seen == [b"versao 1"]
+    assert upload(b"versao 1").headers["Idempotent-Replayed"] == "true"
+    assert upload(b"versao 2").status_code == 422
+    assert len(calls) == 1
+
+
+def test_server_errors_are_not_stored(monkeypatch):
+    client, calls = _app(monkeypatch, status=500)
+    for _ in range(2):
+        client.post("/generate", json={"input": "oi"}, headers={"Idempotency-Key": "abc"})
+    assert len(calls) == 2
+
+
+def test_reservation_is_renewed_while_the_request_runs(monkeypatch):
+    import time
+
+    monkeypatch.setattr(idempotency, "IN_PROGRESS_TTL", 0.15)
+    client, calls = _app(monkeypatch, view=lambda: time.sleep(0.3))
+
+    client.post("/generate", json={"input": "oi"}, headers={"Idempotency-Key": "abc"})
+
+    fake = idempotency.redis_client
+    assert fake.expired and set(fake.expired) == {"idem:user-1:text:abc"}
+    # depois de gravado o resultado, a reserva não é mais renovada
+    renewed = len(fake.expired)
+    time.sleep(0.2)
+    assert len(fake.expired) == renewed and '"state": "done"' in fake.data["idem:user-1:text:abc"]
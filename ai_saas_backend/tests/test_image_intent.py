@@ -0,0 +1,48 @@
+import pytest
+
+import utils.image_intent as image_intent
+from utils.image_intent import normalize, wants_image
+
+
+@pytest.fixture(autouse=True)
+def no_metrics(monkeypatch):
+    monkeypatch.setattr(image_intent, "incr", lambda *a, **k: None)
+
+
+@pytest.mark.parametrize("prompt", [
+    "Gere uma imagem de um gato astronauta",
+    "desenhe um dragão",
+    "faça um logo para minha padaria",
+    "pode gerar uma imagem de um gato de chapéu?",
+    "generate an image of a red car",
+    "crie uma arte para o instagram da loja",
+])
+def test_detects_image_requests(prompt):
+    assert wants_image(prompt) is True
+
+
+@pytest.mark.parametrize("prompt", [
+    "obrigado!",
+    "pode gerar imagem?",
+    "Você consegue gerar imagens?",
+    "Descreva esta imagem",
+    "explique o que é uma imagem docker",
+    "qual a melhor câmera para foto noturna?",
+    "faça isso logo, por favor: resuma o texto",
+    "crie um texto sobre arte moderna",
+    "gere um relatório com base na figura 3",
+    "me mostre a foto que eu enviei",
+    "make a summary of this picture",
+    "",
+])
+def test_ignores_other_prompts(prompt):
+    assert wants_image(prompt) is False
+
+
+def test_cache_is_keyed_by_normalized_prompt():
+    image_intent._wants_image_normalized.cache_clear()
+    wants_image("Desenhe   um GATO")
+    wants_image("desenhe um gato")
+    info = image_intent._wants_image_normalized.cache_info()
+    assert normalize("Ilustração  Ótima") == "ilustracao otima"
+    assert info.hits == 1 and info.misses == 1
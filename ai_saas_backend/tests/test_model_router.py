@@ -0,0 +1,67 @@
+import pytest
+
+import utils.model_router as router
+
+
+def _health(**overrides):
+    base = {"state": "closed", "p50_ms": 800, "p95_ms": 2000, "error_rate": 0.0, "headroom": 1.0, "health": 1.0}
+    return {**base, **overrides}
+
+
+@pytest.fixture
+def health(monkeypatch):
+    table = {}
+    monkeypatch.setattr(router, "model_health", lambda m: table.get(m, _health()))
+    return table
+
+
+def test_follows_declarative_chain_when_healthy(health):
+    assert router.route("claude-opus-4-5") == ["claude-opus-4-5", "claude-sonnet-4-5", "claude-haiku-4-5"]
+    assert router.route("gpt-4o") == ["gpt-4o"]
+
+
+def test_disabled_models_go_straight_to_fallback(health):
+    assert router.route("gemini-2.5-pro") == ["gemini-2.5-flash"]
+
+
+def test_fully_disabled_chain_raises(health, monkeypatch):
+    monkeypatch.setitem(router.ROUTING, "disabled", ["gpt-4o"])
+    with pytest.raises(router.ModelUnavailableError):
+        router.route("gpt-4o")
+
+
+def test_plan_filters_fallbacks(health):
+    basic = {"sonar", "sonar-reasoning", "sonar-deep-research"}
+    assert router.route("sonar-reasoning-pro", allowed=basic.__contains__) == ["sonar-reasoning-pro", "sonar-reasoning", "sonar"]
+    assert router.route("claude-opus-4-5", allowed=lambda m: m == "claude-haiku-4-5") == ["claude-opus-4-5", "claude-haiku-4-5"]
+
+
+def test_open_circuit_is_skipped_and_degraded_goes_last(health):
+    health["claude-opus-4-5"] = _health(state="open")
+    health["claude-sonnet-4-5"] = _health(p95_ms=90000, health=0.4)
+    assert router.route("claude-opus-4-5") == ["claude-haiku-4-5", "claude-sonnet-4-5"]
+
+    health["claude-haiku-4-5"] = _health(headroom=0.0, health=1.0)
+    assert router.route("claude-opus-4-5") == ["claude-sonnet-4-5", "claude-haiku-4-5"]
+
+
+def test_all_open_returns_candidates_to_fail_fast(health):
+    for m in ("sonar-reasoning", "sonar"):
+        health[m] = _health(state="open")
+    assert router.route("sonar-reasoning") == ["sonar-reasoning", "sonar"]
+
+
+def test_quota_headroom_from_headers(monkeypatch):
+    stored = {}
+    monkeypatch.setattr(router.redis_client, "setex", lambda key, ttl, value: stored.__setitem__(key, value))
+
+    router.record_quota("anthropic", "claude-haiku-4-5", 200, {
+        "anthropic-ratelimit-requests-limit": "100",
+        "anthropic-ratelimit-requests-remaining": "40",
+        "anthropic-ratelimit-tokens-limit": "1000",
+        "anthropic-ratelimit-tokens-remaining": "900",
+    })
+    router.record_quota("openai", "gpt-4o", 429, None)
+
+    assert stored["router:quota:anthropic:claude-haiku-4-5"] == 0.4
+    assert stored["router:quota:openai:gpt-4o"] == 0.0
@@ -0,0 +1,52 @@
+import importlib
+import json
+
+from utils.prompt_cache import anthropic_usage, mark_anthropic_history, openai_cached_tokens
+
+ai_api = importlib.import_module("routes.ai_generation_api")
+
+KEYS = {"OPENAI_API_KEY": "k", "OPENROUTER_API_KEY": "k", "ANTHROPIC_API_KEY": "k"}
+
+
+def _turns(n):
+    msgs = []
+    for i in range(n):
+        msgs.append({"role": "user", "content": f"pergunta {i}"})
+        msgs.append({"role": "assistant", "content": f"resposta {i}"})
+    return msgs + [{"role": "user", "content": "nova pergunta"}]
+
+
+def test_anthropic_prefix_is_stable_and_marked():
+    _, _, first = ai_api.build_anthropic_request("claude-sonnet-4-5", _turns(2), 0.7, "k")
+    _, _, second = ai_api.build_anthropic_request("claude-sonnet-4-5", _turns(3), 0.7, "k")
+
+    assert first["system"][0]["cache_control"] == {"type": "ephemeral"}
+    assert json.dumps(first["system"]) == json.dumps(second["system"])
+    marked = [i for i, m in enumerate(second["messages"]) if "cache_control" in m["content"][-1]]
+    assert marked == [len(second["messages"]) - 2, len(second["messages"]) - 1]
+    # sem os marcadores, o histórico do turno anterior é prefixo exato do seguinte
+    strip = lambda msgs: [{**m, "content": [{"type": "text", "text": b["text"]} for b in m["content"]]} for m in msgs]
+    older = len(first["messages"]) - 1
+    assert strip(second["messages"])[:older] == strip(first["messages"])[:older]
+
+
+def test_mark_does_not_touch_the_input():
+    msgs = [{"role": "user", "content": [{"type": "text", "text": "oi"}]}]
+    assert mark_anthropic_history(msgs)[0]["content"][0]["cache_control"] == {"type": "ephemeral"}
+    assert "cache_control" not in msgs[0]["content"][0]
+
+
+def test_prompt_cache_key_only_for_openai():
+    _, _, body = ai_api.build_chat_completion_request("gpt-4o", _turns(1), 0.7, KEYS, "chat:1")
+    assert body["prompt_cache_key"] == "chat:1"
+    _, _, body = ai_api.build_chat_completion_request("deepseek/deepseek-r1-0528:free", _turns(1), 0.7, KEYS, "chat:1")
+    assert "prompt_cache_key" not in body
+
+
+def test_cached_token_counts():
+    assert anthropic_usage({
+        "input_tokens": 10, "cache_read_input_tokens": 900, "cache_creation_input_tokens": 50, "output_tokens": 20,
+    }) == (960, 20, 980, 900)
+    assert anthropic_usage({}) == (None, None, None, None)
+    assert openai_cached_tokens({"prompt_tokens": 2000, "prompt_tokens_details": {"cached_tokens": 1920}}) == 1920
+    assert openai_cached_tokens({"prompt_tokens": 10}) is None
@@ -0,0 +1,97 @@
+import threading
+import time
+
+import fakeredis
+import pytest
+
+import utils.provider_limits as provider_limits
+from utils.provider_limits import ProviderBusyError, acquire, busy_response, provider_slot, release
+
+
+@pytest.fixture
+def limits(monkeypatch):
+    monkeypatch.setattr(provider_limits, "redis_client", fakeredis.FakeRedis(decode_responses=True))
+    monkeypatch.setattr(provider_limits, "_script", None)
+    monkeypatch.setattr(provider_limits, "incr", lambda *a, **k: None)
+    monkeypatch.setattr(provider_limits, "observe", lambda *a, **k: None)
+    configured = {}
+    monkeypatch.setattr(provider_limits, "PROVIDER_LIMITS", configured)
+    return configured
+
+
+def test_concurrency_is_shared_and_released(limits):
+    limits["p"] = {"concurrency": 1, "rps": 1000}
+    token, scopes = acquire("p")
+    assert token
+
+    with pytest.raises(ProviderBusyError):
+        acquire("p", timeout=0.2)
+
+    release(token, scopes)
+    with provider_slot("p", timeout=1):
+        pass
+
+
+def test_waiters_are_served_in_arrival_order(limits):
+    limits["p"] = {"concurrency": 1, "rps": 1000}
+    token, scopes = acquire("p")
+    order = []
+
+    def waiter(name):
+        with provider_slot("p", timeout=5):
+            order.append(name)
+            time.sleep(0.05)
+
+    threads = []
+    for name in ("primeiro", "segundo"):
+        threads.append(threading.Thread(target=waiter, args=(name,)))
+        threads[-1].start()
+        time.sleep(0.2)
+    release(token, scopes)
+    for t in threads:
+        t.join()
+
+    assert order == ["primeiro", "segundo"]
+
+
+def test_token_bucket_limits_the_request_rate(limits):
+    limits["p"] = {"concurrency": 100, "rps": 1, "burst": 2}
+    for _ in range(2):
+        release(*acquire("p"))
+
+    with pytest.raises(ProviderBusyError):
+        acquire("p", timeout=0.2)
+
+
+def test_model_scope_is_limited_together_with_the_provider(limits):
+    limits["p"] = {"concurrency": 10, "rps": 1000}
+    limits["p:m"] = {"concurrency": 1, "rps": 1000}
+    token, scopes = acquire("p", "m")
+
+    with pytest.raises(ProviderBusyError):
+        acquire("p", "m", timeout=0.2)
+    # outro modelo do mesmo provedor segue livre
+    release(*acquire("p", "outro", timeout=0.2))
+    release(token, scopes)
+
+
+def test_lease_frees_slots_held_by_dead_processes(limits, monkeypatch):
+    monkeypatch.setattr(provider_limits, "LEASE_SECONDS", 0.2)
+    limits["p"] = {"concurrency": 1, "rps": 1000}
+    acquire("p")  # nunca liberado
+
+    release(*acquire("p", timeout=2))
+
+
+def test_busy_maps_to_503_with_retry_after(limits, test_client):
+    limits["p"] = {"concurrency": 1, "rps": 1000}
+    token, scopes = acquire("p")
+    with pytest.raises(ProviderBusyError) as busy:
+        acquire("p", timeout=0.1)
+    release(token, scopes)
+
+    with test_client.application.test_request_context():
+        resp = busy_response(busy.value)
+    assert resp.status_code == 503
+    assert resp.headers["Retry-After"] == str(provider_limits.BUSY_RETRY_AFTER)
+    assert resp.get_json()["retry_after"] == provider_limits.BUSY_RETRY_AFTER
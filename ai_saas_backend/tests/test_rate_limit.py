@@ -0,0 +1,55 @@
+from types import SimpleNamespace
+
+import fakeredis
+import pytest
+from flask import Flask, jsonify, request
+
+import utils.rate_limit as rate_limit
+from utils.rate_limit import consume, cost_limited, refund_current_request
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(rate_limit, "redis_client", fakeredis.FakeRedis(decode_responses=True))
+    monkeypatch.setattr(rate_limit, "_script", None)
+    monkeypatch.setattr(rate_limit, "time", SimpleNamespace(time=lambda: now[0]))
+    return now
+
+
+def test_sliding_window_weights_costs_and_reports_retry_after(clock):
+    assert consume("u1", 5, 10, window=60)[0]
+    clock[0] += 20
+    assert consume("u1", 5, 10, window=60) == (True, 0, 10)
+
+    allowed, retry_after, used = consume("u1", 1, 10, window=60)
+    # a entrada mais antiga sai da janela em 40 s
+    assert (allowed, retry_after, used) == (False, 40, 10)
+
+    clock[0] += 41
+    assert consume("u1", 5, 10, window=60) == (True, 0, 10)
+    # outro usuário tem a própria janela; custo acima do limite nunca cabe
+    assert consume("u2", 11, 10, window=60)[:2] == (False, 60)
+
+
+def test_refund_returns_the_units_of_the_current_request(clock, monkeypatch):
+    user = SimpleNamespace(id="u1", role="user", plan_id=None)
+    monkeypatch.setattr(rate_limit, "User", SimpleNamespace(query=SimpleNamespace(get=lambda _id: user)))
+    monkeypatch.setattr(rate_limit, "get_jwt_identity", lambda: "u1")
+    monkeypatch.setattr(rate_limit, "plan_rate_limit", lambda u: rate_limit.OPERATION_COSTS["image"])
+    app = Flask(__name__)
+
+    @app.route("/generate", methods=["POST"])
+    @cost_limited("image")
+    def generate():
+        if request.args.get("cancel"):
+            assert refund_current_request()
+        return jsonify({}), 200
+
+    client = app.test_client()
+    # geração cancelada: as unidades voltam para a janela
+    assert client.post("/generate?cancel=1").status_code == 200
+    assert client.post("/generate").status_code == 200
+
+    resp = client.post("/generate")
+    assert resp.status_code == 429 and int(resp.headers["Retry-After"]) > 0
@@ -0,0 +1,31 @@
+import pytest
+
+import utils.response_cache as response_cache
+from utils.response_cache import cache_key, should_use
+
+
+@pytest.fixture(autouse=True)
+def no_stats(monkeypatch):
+    monkeypatch.setattr(response_cache, "_count", lambda kind, result: None)
+
+
+def test_cache_key_is_canonical():
+    messages = [{"role": "user", "content": "olá", "attachments": []}]
+    a = cache_key("text", "gpt-4o", messages, 0.0, tools=["image_generation", "web"])
+    b = cache_key("text", "gpt-4o", [dict(reversed(list(messages[0].items())))], 0.0, tools=["web", "image_generation"])
+
+    assert a == b and a.startswith("text:")
+    assert a != cache_key("text", "gpt-4o", messages, 0.7, tools=["web", "image_generation"])
+    assert a != cache_key("text", "gpt-4o-mini", messages, 0.0, tools=["web", "image_generation"])
+    assert cache_key("image", "gpt-image-1", ["gato"], ratio="1:1") != cache_key("image", "gpt-image-1", ["gato"], ratio="16:9")
+
+
+def test_cache_is_opt_in_and_bypassed_for_sampling_temperatures(monkeypatch):
+    monkeypatch.setattr(response_cache, "plan_allows_any_temperature", lambda user: False)
+    assert should_use("text", False, 0.0, None) is False
+    assert should_use("text", True, 0.0, None) is True
+    assert should_use("text", True, 0.7, None) is False
+    assert should_use("image", True, None, None) is True
+
+    monkeypatch.setattr(response_cache, "plan_allows_any_temperature", lambda user: True)
+    assert should_use("text", True, 0.7, None) is True
@@ -0,0 +1,115 @@
+from sqlalchemy import create_engine, insert, select
+
+import utils.resumable_stream as resumable_stream
+from models.chat import ChatMessage
+from utils.resumable_stream import GenerationStream
+
+
+class _MemoryRedis:
+    def __init__(self):
+        self.data = {}
+        self.streams = {}
+
+    def pipeline(self):
+        return self
+
+    def execute(self):
+        return []
+
+    def setex(self, key, ttl, value):
+        self.data[key] = str(value)
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def expire(self, key, ttl):
+        return True
+
+    def xadd(self, key, fields, maxlen=None):
+        entries = self.streams.setdefault(key, [])
+        entries.append((f"{len(entries) + 1}-0", dict(fields)))
+
+    def events(self, key):
+        return [fields["event"] for _, fields in self.streams.get(key, [])]
+
+
+def _stream(monkeypatch):
+    fake = _MemoryRedis()
+    monkeypatch.setattr(resumable_stream, "redis_client", fake)
+    engine = create_engine("sqlite://")
+    table = ChatMessage.__table__
+    table.create(engine)
+    with engine.begin() as conn:
+        conn.execute(insert(table).values(id="m1", chat_id="c1", role="ai", content="", status="streaming"))
+    return GenerationStream("m1", "g1", engine), fake, engine
+
+
+def _stored(engine):
+    table = ChatMessage.__table__
+    with engine.connect() as conn:
+        return conn.execute(select(table.c.content, table.c.status).where(table.c.id == "m1")).one()
+
+
+def test_deltas_are_streamed_and_checkpointed(monkeypatch):
+    monkeypatch.setattr(resumable_stream, "CHECKPOINT_CHARS", 5)
+    stream, fake, engine = _stream(monkeypatch)
+
+    stream.write("Olá, ")
+    stream.write("mundo")
+
+    assert fake.get("gen:msg:g1") == "m1"
+    assert fake.events(stream.key) == ["start", "delta", "delta"]
+    assert _stored(engine).content == "Olá, mundo"
+
+
+def test_retry_resets_the_stream(monkeypatch):
+    stream, fake, _ = _stream(monkeypatch)
+    stream.write("tentativa 1")
+    stream.restart()
+    stream.write("tentativa 2")
+
+    assert stream.text == "tentativa 2"
+    assert fake.events(stream.key) == ["start", "delta", "reset", "delta"]
+
+
+def test_failed_request_keeps_partial_text(monkeypatch):
+    stream, fake, engine = _stream(monkeypatch)
+    stream.write("parcial")
+
+    stream.finish("error")
+    stream.finish("complete", {"content": "ignorado"})
+
+    assert fake.events(stream.key)[-1] == "done"
+    assert tuple(_stored(engine)) == ("parcial", "partial")
+
+
+def test_reader_stops_when_the_stream_ends_without_done(test_client, monkeypatch):
+    import importlib
+
+    from extensions import db
+    from models import User
+    from models.chat import Chat
+
+    ai_api = importlib.import_module("routes.ai_generation_api")
+    app = test_client.application
+    with app.app_context():
+        user = User.query.filter_by(username="testuser").first()
+        chat = Chat(user_id=user.id, title="c")
+        db.session.add(chat)
+        db.session.flush()
+        msg = ChatMessage(chat_id=chat.id, role="ai", content="parcial", status="streaming")
+        db.session.add(msg)
+        db.session.commit()
+        user_id, msg_id = user.id, msg.id
+
+    alive = iter([True, False])
+    monkeypatch.setattr(ai_api, "get_jwt_identity", lambda: user_id)
+    monkeypatch.setattr(ai_api, "message_for_generation", lambda generation_id: msg_id)
+    monkeypatch.setattr(ai_api, "stream_exists", lambda message_id: next(alive))
+    monkeypatch.setattr(ai_api, "read_events", lambda message_id, after: [])
+
+    with app.test_request_context("/api/ai/generations/g1/stream"):
+        body = "".join(ai_api.stream_generation.__wrapped__("g1").response)
+
+    # o produtor sumiu e o stream expirou: a conexão termina com o que está no banco
+    assert body.startswith("event: done") and '"content": "parcial"' in body
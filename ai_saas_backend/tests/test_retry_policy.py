@@ -0,0 +1,111 @@
+from types import SimpleNamespace
+
+import pytest
+import requests
+
+import utils.retry as retry
+from utils.retry import RetryPolicy, call_with_retry, classify
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    recorded = []
+    monkeypatch.setattr(retry.time, "sleep", recorded.append)
+    monkeypatch.setattr(retry, "incr", lambda *a, **k: None)
+    return recorded
+
+
+def _response(status, headers=None):
+    return SimpleNamespace(status_code=status, headers=headers or {})
+
+
+class _SDKError(Exception):
+    def __init__(self, status_code, headers=None):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+        self.response = SimpleNamespace(headers=headers or {})
+
+
+def test_classification_by_status_and_type():
+    assert classify(_response(429, {"retry-after": "3"})) == (True, 3.0, "429")
+    assert classify(_response(529))[0] is True
+    assert classify(_response(400)) == (False, None, None)
+    assert classify(_response(200)) == (False, None, None)
+
+    assert classify(exc=requests.exceptions.ConnectionError("reset"))[0] is True
+    assert classify(exc=ConnectionResetError())[0] is True
+    assert classify(exc=ValueError("bug"))[0] is False
+    # exceções de SDK: pelo status carregado, não pelo texto da mensagem
+    assert classify(exc=_SDKError(503, {"retry-after-ms": "1500"})) == (True, 1.5, "503")
+    assert classify(exc=_SDKError(401))[0] is False
+
+
+def test_retry_after_http_date():
+    assert retry._parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+    assert retry._parse_retry_after("abc") is None
+
+
+def test_transient_errors_are_retried_with_full_jitter(sleeps):
+    calls = []
+
+    def fn(timeout):
+        calls.append(timeout)
+        if len(calls) < 3:
+            raise requests.exceptions.ConnectionError("connection reset")
+        return _response(200)
+
+    policy = RetryPolicy(max_attempts=5, base_delay=1, max_delay=4, deadline=60)
+    assert call_with_retry(fn, policy).status_code == 200
+    assert len(calls) == 3
+    assert len(sleeps) == 2
+    assert 0 <= sleeps[0] <= 1 and 0 <= sleeps[1] <= 2
+
+
+def test_honours_retry_after_and_returns_last_response(sleeps):
+    responses = iter([_response(429, {"retry-after": "2"}), _response(503, {"retry-after": "1"})])
+    policy = RetryPolicy(max_attempts=2, deadline=60)
+
+    result = call_with_retry(lambda timeout: next(responses), policy)
+
+    assert result.status_code == 503
+    assert sleeps == [2.0]
+
+
+def test_fails_fast_when_retry_after_exceeds_deadline(sleeps):
+    def fn(timeout):
+        raise _SDKError(429, {"retry-after": "30"})
+
+    with pytest.raises(_SDKError):
+        call_with_retry(fn, RetryPolicy(max_attempts=5, deadline=5))
+    assert sleeps == []
+
+
+def test_non_retryable_error_propagates_immediately(sleeps):
+    calls = []
+
+    def fn(timeout):
+        calls.append(1)
+        raise ValueError("payload inválido")
+
+    with pytest.raises(ValueError):
+        call_with_retry(fn, RetryPolicy(deadline=60))
+    assert calls == [1] and sleeps == []
+
+
+def test_breaker_ignores_quota_errors_and_uses_first_byte_latency(monkeypatch):
+    import utils.circuit_breaker as circuit_breaker
+    from utils.cancellation import GenerationCancelled
+
+    recorded = []
+    monkeypatch.setattr(circuit_breaker, "record", lambda *a: recorded.append(a))
+    started = retry.time.monotonic() - 90
+
+    retry._record_outcome("openai", "gpt-4o", True, 429, started, _response(429))
+    retry._record_outcome("openai", "gpt-4o", False, None, started, GenerationCancelled("user", "parcial"))
+    assert recorded == []
+
+    streamed = SimpleNamespace(status_code=200, latency_ms=800.0)
+    retry._record_outcome("openai", "gpt-4o", False, 200, started, streamed)
+    retry._record_outcome("openai", "gpt-image-1", False, 200, started, _response(200))
+    assert recorded[0] == ("openai", "gpt-4o", True, 800.0)
+    assert recorded[1][3] >= 90000
@@ -0,0 +1,58 @@
+from types import SimpleNamespace
+
+from flask import Flask, jsonify
+
+import utils.scheduler as scheduler
+from utils.scheduler import GenerationShedError, scheduled
+
+
+class _Query:
+    def __init__(self, user):
+        self.user = user
+
+    def get(self, _id):
+        return self.user
+
+
+def _app(monkeypatch, acquire):
+    user = SimpleNamespace(id="user-1", role="user", plan_id=3)
+    monkeypatch.setattr(scheduler, "User", SimpleNamespace(query=_Query(user)))
+    monkeypatch.setattr(scheduler, "get_jwt_identity", lambda: "user-1")
+    monkeypatch.setattr(scheduler, "plan_scheduling", lambda u: (4, 2, 7))
+    released = []
+    monkeypatch.setattr(scheduler, "acquire", acquire)
+    monkeypatch.setattr(scheduler, "release", released.append)
+    app = Flask(__name__)
+
+    @app.route("/generate", methods=["POST"])
+    @scheduled("image")
+    def generate():
+        return jsonify({"ok": True}), 200
+
+    return app.test_client(), released
+
+
+def test_slot_is_held_for_the_request_and_released(monkeypatch):
+    calls = []
+
+    def acquire(user_id, tier, weight, user_cap, cost, timeout):
+        calls.append((user_id, tier, weight, user_cap, cost, timeout))
+        return "token-1"
+
+    client, released = _app(monkeypatch, acquire)
+    resp = client.post("/generate")
+
+    assert resp.status_code == 200
+    assert calls == [("user-1", "3", 4, 2, 5, 7)]
+    assert released == ["token-1"]
+
+
+def test_request_is_shed_after_the_plan_queue_time(monkeypatch):
+    def acquire(*args):
+        raise GenerationShedError("Alta demanda")
+
+    client, released = _app(monkeypatch, acquire)
+    resp = client.post("/generate")
+
+    assert resp.status_code == 503 and resp.headers["Retry-After"] == "7"
+    assert released == []
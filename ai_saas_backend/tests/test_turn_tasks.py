@@ -0,0 +1,42 @@
+import time
+
+import pytest
+
+from utils.turn_tasks import run_dag
+
+
+def _sleep_then(value, seconds=0.2):
+    def fn(**deps):
+        time.sleep(seconds)
+        return value
+    return fn
+
+
+def test_independent_tasks_run_concurrently():
+    started = time.monotonic()
+    turn = run_dag({"intent": (_sleep_then(True), []), "main": (_sleep_then("texto"), [])})
+
+    assert turn["main"].result() == "texto" and turn["intent"].result() is True
+    assert time.monotonic() - started < 0.35
+
+
+def test_dependent_task_receives_results_and_failures_propagate():
+    def boom():
+        raise RuntimeError("provedor fora")
+
+    turn = run_dag({
+        "intent": (lambda: True, []),
+        "main": (lambda: "texto", []),
+        "image": (lambda intent, main: f"{main}:{intent}", ["intent", "main"]),
+        "broken": (boom, []),
+        "after_broken": (lambda broken: "nunca", ["broken"]),
+    })
+
+    assert turn["image"].result(timeout=2) == "texto:True"
+    with pytest.raises(RuntimeError):
+        turn["after_broken"].result(timeout=2)
+
+
+def test_unknown_dependency_is_rejected():
+    with pytest.raises(ValueError):
+        run_dag({"image": (lambda main: None, ["main"])})
@@ -0,0 +1,61 @@
+from datetime import datetime, date
+
+from extensions import db
+from models import User, Chat, ChatMessage, UsageDaily
+from utils import record_usage, rebuild_usage_rollups
+
+
+def _user():
+    return User.query.filter_by(username="testuser").first()
+
+
+def test_record_usage_increments_same_key(test_client):
+    with test_client.application.app_context():
+        user = _user()
+        at = datetime(2025, 1, 10, 12, 0, 0)
+
+        record_usage(user.id, "gpt-4o", 10, 5, 15, at=at)
+        record_usage(user.id, "gpt-4o", 1, 2, 3, at=at)
+        record_usage(user.id, "claude-haiku-4-5", 7, 3, None, at=at)
+        db.session.commit()
+
+        row = UsageDaily.query.filter_by(user_id=user.id, day=date(2025, 1, 10), model="gpt-4o").one()
+        assert (row.prompt_tokens, row.completion_tokens, row.total_tokens) == (11, 7, 18)
+        assert row.message_count == 2
+
+        other = UsageDaily.query.filter_by(user_id=user.id, day=date(2025, 1, 10), model="claude-haiku-4-5").one()
+        assert other.total_tokens == 10
+
+
+def test_rebuild_matches_chat_messages(test_client):
+    with test_client.application.app_context():
+        user = _user()
+        chat = Chat(user_id=user.id, title="rollup")
+        db.session.add(chat)
+        db.session.flush()
+
+        for day, tokens in ((2, 100), (2, 50), (3, 10)):
+            db.session.add(ChatMessage(
+                chat_id=chat.id,
+                role="assistant",
+                content="ok",
+                model_used="gpt-4o",
+                prompt_tokens=tokens,
+                completion_tokens=tokens,
+                total_tokens=tokens * 2,
+                created_at=datetime(2025, 2, day, 8, 30),
+            ))
+        # mensagens do usuário não entram na conta
+        db.session.add(ChatMessage(chat_id=chat.id, role="user", content="oi", created_at=datetime(2025, 2, 2)))
+        db.session.commit()
+
+        assert rebuild_usage_rollups(date(2025, 2, 1), date(2025, 2, 28)) == 2
+
+        rows = {r.day: r for r in UsageDaily.query.filter(UsageDaily.user_id == user.id, UsageDaily.day >= date(2025, 2, 1)).all()}
+        assert rows[date(2025, 2, 2)].total_tokens == 300
+        assert rows[date(2025, 2, 2)].message_count == 2
+        assert rows[date(2025, 2, 3)].prompt_tokens == 10
+
+        # reconstruir de novo é idempotente
+        rebuild_usage_rollups(date(2025, 2, 1), date(2025, 2, 28))
+        assert UsageDaily.query.filter(UsageDaily.user_id == user.id, UsageDaily.day >= date(2025, 2, 1)).count() == 2
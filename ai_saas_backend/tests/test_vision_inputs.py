@@ -0,0 +1,72 @@
+import importlib
+from types import SimpleNamespace
+
+from PIL import Image
+
+import utils.vision_inputs as vision_inputs
+
+ai_api = importlib.import_module("routes.ai_generation_api")
+
+
+def _image(tmp_path, size, name="foto.jpg"):
+    path = tmp_path / name
+    Image.new("RGB", size, (200, 30, 30)).save(path, "JPEG", quality=95)
+    return str(path)
+
+
+def test_large_image_is_downscaled_once_per_content_and_limits(tmp_path, monkeypatch):
+    monkeypatch.setattr(vision_inputs, "DERIVED_DIR", str(tmp_path / "derived"))
+    monkeypatch.setattr(vision_inputs, "KEEP_ORIGINAL_BYTES", 0)
+    calls = []
+    monkeypatch.setattr(vision_inputs, "incr", lambda *a, **k: calls.append(a))
+    path = _image(tmp_path, (4000, 3000))
+
+    out, mime = vision_inputs.prepared_image(path, "image/jpeg", "gpt-4o")
+    with Image.open(out) as img:
+        # OpenAI: lado menor até 768, lado maior até 2048
+        assert img.size == (1024, 768)
+    assert mime == "image/jpeg"
+
+    # mesma imagem em outro anexo: reaproveita a derivada
+    copy = tmp_path / "copia.jpg"
+    copy.write_bytes(open(path, "rb").read())
+    assert vision_inputs.prepared_image(str(copy), "image/jpeg", "gpt-4o")[0] == out
+    assert len(calls) == 1
+
+    with Image.open(vision_inputs.prepared_image(path, "image/jpeg", "claude-3-5-sonnet")[0]) as img:
+        assert max(img.size) == 1568
+
+
+def test_small_image_goes_as_is(tmp_path, monkeypatch):
+    monkeypatch.setattr(vision_inputs, "DERIVED_DIR", str(tmp_path / "derived"))
+    path = _image(tmp_path, (640, 480))
+    assert vision_inputs.prepared_image(path, "image/jpeg", "gpt-4o") == (path, "image/jpeg")
+
+
+def test_only_images_before_the_recent_turns_are_aged():
+    history = [
+        SimpleNamespace(id=i, role=role)
+        for i, role in enumerate(["user", "assistant", "user", "assistant", "user"])
+    ]
+    assert vision_inputs.aged_message_ids(history, recent_turns=2) == {0, 1}
+    assert vision_inputs.aged_message_ids(history, recent_turns=3) == set()
+
+
+def test_aged_image_is_sent_as_its_caption(monkeypatch):
+    monkeypatch.setattr(ai_api.os.path, "exists", lambda p: True)
+    monkeypatch.setattr(ai_api.vision_inputs, "prepared_image", lambda *a: (_ for _ in ()).throw(AssertionError("pixels")))
+    messages = [{
+        "role": "user",
+        "content": "o que tem aqui?",
+        "attachments": [{
+            "name": "foto.jpg",
+            "path": "/tmp/foto.jpg",
+            "mimetype": "image/jpeg",
+            "caption": "[Imagem anterior (foto.jpg): um gato laranja]",
+        }],
+    }]
+
+    content = ai_api.build_messages_for_openai(messages, "gpt-4o")[-1]["content"]
+
+    assert {"type": "text", "text": "[Imagem anterior (foto.jpg): um gato laranja]"} in content
+    assert not any(p.get("type") == "image_url" for p in content)
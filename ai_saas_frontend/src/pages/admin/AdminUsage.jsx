@@ -11,12 +11,16 @@ export default function AdminUsage() {
   const [end, setEnd] = useState("");
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState("");
+  const [page, setPage] = useState(1);
+  const [total, setTotal] = useState(0);
+  const perPage = 50;
+  const pages = Math.max(1, Math.ceil(total / perPage));
 
   const fmt = (n) => (n ?? 0).toLocaleString(t("dates.locale"));
   const pct = (used, quota) =>
     quota ? Math.min(100, Math.round(((used ?? 0) / quota) * 100)) : null;
 
-  const fetchData = async () => {
+  const fetchData = async (targetPage = 1) => {
     setLoading(true);
     setError("");
     try {
@@ -24,6 +28,8 @@ export default function AdminUsage() {
       if (model) params.set("model", model);
       if (start) params.set("start", start);
       if (end) params.set("end", end);
+      params.set("page", String(targetPage));
+      params.set("per_page", String(perPage));
       const res = await fetch(`/api/admin/usage?${params.toString()}`, { credentials: "include" });
       const j = await res.json();
       if (!res.ok) {
@@ -32,6 +38,8 @@ export default function AdminUsage() {
         throw new Error(key ? t(key) : errorMsg);
       }
       setRows(j.results || []);
+      setTotal(j.total ?? (j.results || []).length);
+      setPage(targetPage);
     } catch (e) {
       const errorMsg = e.message || t("admin.usage.load_data_error");
       const key = backendMessageKeyMap[errorMsg];
@@ -97,7 +105,7 @@ export default function AdminUsage() {
             />
           </div>
           <button
-            onClick={fetchData}
+            onClick={() => fetchData(1)}
             className="px-4 py-2 rounded-lg bg-[var(--color-primary)] text-white text-sm shadow-sm hover:opacity-90"
             disabled={loading}
           >
@@ -183,6 +191,25 @@ export default function AdminUsage() {
               </tbody>
             </table>
           </div>
+          {pages > 1 && (
+            <div className="flex items-center justify-end gap-3 px-4 py-3 border-t border-gray-100 text-sm">
+              <button
+                onClick={() => fetchData(page - 1)}
+                disabled={loading || page <= 1}
+                className="px-3 py-1.5 rounded-lg border bg-white disabled:opacity-50"
+              >
+                {t("admin.usage.pagination.previous")}
+              </button>
+              <span className="text-gray-600">{t("admin.usage.pagination.page", { page, pages })}</span>
+              <button
+                onClick={() => fetchData(page + 1)}
+                disabled={loading || page >= pages}
+                className="px-3 py-1.5 rounded-lg border bg-white disabled:opacity-50"
+              >
+                {t("admin.usage.pagination.next")}
+              </button>
+            </div>
+          )}
         </div>
       </div>
     </Layout>
@@ -2,7 +2,7 @@ import { useState, useEffect, useMemo } from "react";
 import Layout from "../../../components/layout/Layout";
 import { Trash, Edit, Search, ArrowLeft } from "lucide-react";
 import { toast } from "react-toastify";
-import { adminRoutes, userRoutes } from "../../../services/apiRoutes";
+import { adminRoutes, userRoutes, plansRoutes } from "../../../services/apiRoutes";
 import { apiFetch } from "../../../services/apiService";
 import useSelectionMode from "../../workspace/hooks/useSelectionMode";
 import SelectionToggleButton from "../../workspace/components/SelectionToggleButton";
@@ -20,6 +20,9 @@ export default function AdminUsersList() {
   const [searchTerm, setSearchTerm] = useState("");
   const [planFilter, setPlanFilter] = useState("all");
   const [modalUser, setModalUser] = useState(null);
+  const [plans, setPlans] = useState([]);
+  const [page, setPage] = useState(1);
+  const [pages, setPages] = useState(1);
 
   const { selectionMode, selectedItems, toggleSelectionMode, toggleSelect, clearSelection } = useSelectionMode();
   const selectedIds = selectedItems.map((u) => u?.id);
@@ -58,13 +61,27 @@ export default function AdminUsersList() {
   };
 
   useEffect(() => {
-    fetchUsers().finally(() => setLoading(false));
+    apiFetch(plansRoutes.list)
+      .then((data) => setPlans(Array.isArray(data) ? data : []))
+      .catch(() => setPlans([]));
   }, []);
 
+  // Busca, filtro e paginação acontecem no servidor; a busca espera o usuário parar de digitar
+  useEffect(() => {
+    const timer = setTimeout(() => {
+      setLoading(true);
+      fetchUsers().finally(() => setLoading(false));
+    }, searchTerm ? 300 : 0);
+    return () => clearTimeout(timer);
+  }, [searchTerm, planFilter, page]);
+
   const fetchUsers = async () => {
     try {
-      const data = await apiFetch(adminRoutes.listUsers());
-      const safeData = data.map((u, i) => ({
+      const params = new URLSearchParams({ page: String(page), per_page: "30" });
+      if (searchTerm.trim()) params.set("q", searchTerm.trim());
+      if (planFilter !== "all") params.set("plan_id", planFilter);
+      const data = await apiFetch(adminRoutes.listUsers(params.toString()));
+      const safeData = (data.results || []).map((u, i) => ({
         id: u.id ?? `missing-id-${i}`,
         full_name: u.full_name ?? t("common.placeholder"),
         username: u.username ?? t("common.placeholder"),
@@ -76,6 +93,7 @@ export default function AdminUsersList() {
         created_at: u.created_at ?? u.createdAt ?? null,
       }));
       setUsers(safeData);
+      setPages(Math.max(1, data.pages || 1));
     } catch {
       toast.error(t("admin.users.load_error"));
     }
@@ -107,27 +125,10 @@ export default function AdminUsersList() {
     }
   };
 
-  const planOptions = useMemo(() => {
-    const uniquePlans = new Map();
-    users.forEach((u) => {
-      const planId = u.plan?.id ? String(u.plan.id) : null;
-      if (planId && !uniquePlans.has(planId)) {
-        uniquePlans.set(planId, u.plan?.name ?? planId);
-      }
-    });
-    return Array.from(uniquePlans.entries()).map(([value, label]) => ({ value, label: t(getPlanTranslationKey(label)) }));
-  }, [users, t]);
-
-  const filteredUsers = users.filter((u) => {
-    const matchesSearch =
-      (u.username?.toLowerCase().includes(searchTerm.toLowerCase()) ?? false) ||
-      (u.email?.toLowerCase().includes(searchTerm.toLowerCase()) ?? false) ||
-      (u.full_name?.toLowerCase().includes(searchTerm.toLowerCase()) ?? false);
-
-    const matchesPlan = planFilter === "all" || (u.plan?.id && String(u.plan.id) === planFilter);
-
-    return matchesSearch && matchesPlan;
-  });
+  const planOptions = useMemo(
+    () => plans.map((p) => ({ value: String(p.id), label: t(getPlanTranslationKey(p.name)) })),
+    [plans, t]
+  );
 
   return (
     <Layout>
@@ -152,7 +153,7 @@ export default function AdminUsersList() {
               type="search"
               placeholder={t("admin.users.search.placeholder")}
               value={searchTerm}
-              onChange={(e) => setSearchTerm(e.target.value)}
+              onChange={(e) => { setSearchTerm(e.target.value); setPage(1); }}
               className="w-full pl-10 py-2 rounded-lg border bg-white text-black border-gray-300 text-sm shadow-sm focus:outline-none focus:shadow-md"
               autoComplete="off"
             />
@@ -162,7 +163,7 @@ export default function AdminUsersList() {
               <label className="text-sm text-gray-600 whitespace-nowrap">{t("admin.users.filters.plan.label")}</label>
               <select
                 value={planFilter}
-                onChange={(e) => setPlanFilter(e.target.value)}
+                onChange={(e) => { setPlanFilter(e.target.value); setPage(1); }}
                 className="min-w-[160px] rounded-lg border bg-white text-black border-gray-300 text-sm py-2 px-3 shadow-sm focus:outline-none focus:shadow-md"
               >
                 <option value="all">{t("admin.users.filters.plan.all")}</option>
@@ -177,11 +178,11 @@ export default function AdminUsersList() {
 
       {loading ? (
         <p className="mt-6 text-sm text-gray-500">{t("admin.users.loading")}</p>
-      ) : filteredUsers.length === 0 ? (
+      ) : users.length === 0 ? (
         <p className="mt-6 text-sm text-gray-500">{t("admin.users.empty")}</p>
       ) : (
         <div className="grid grid-cols-1 lg:grid-cols-2 xl:grid-cols-3 gap-4">
-          {filteredUsers.map((user) => {
+          {users.map((user) => {
             const isSelected = selectedItems.some((u) => u?.id === user?.id);
             const bgClass = user.is_active ? "bg-white border-blue-400" : "bg-gray-50 border-gray-300";
             return (
@@ -258,6 +259,26 @@ export default function AdminUsersList() {
         </div>
       )}
 
+      {pages > 1 && (
+        <div className="flex items-center justify-end gap-3 mt-6 text-sm">
+          <button
+            onClick={() => setPage((p) => Math.max(1, p - 1))}
+            disabled={loading || page <= 1}
+            className="px-3 py-1.5 rounded-lg border bg-white disabled:opacity-50"
+          >
+            {t("admin.users.pagination.previous")}
+          </button>
+          <span className="text-gray-600">{t("admin.users.pagination.page", { page, pages })}</span>
+          <button
+            onClick={() => setPage((p) => Math.min(pages, p + 1))}
+            disabled={loading || page >= pages}
+            className="px-3 py-1.5 rounded-lg border bg-white disabled:opacity-50"
+          >
+            {t("admin.users.pagination.next")}
+          </button>
+        </div>
+      )}
+
       <SelectionToolbar 
         count={selectedItems.length} 
         confirmLabel={t("admin.users.toolbar.delete_selected")} 
@@ -36,7 +36,7 @@ export const userRoutes = {
 };
 
 export const adminRoutes = {
-  listUsers: () => `${API_BASE}/admin/users`,                       // GET all users
+  listUsers: (qs = "") => `${API_BASE}/admin/users${qs ? `?${qs}` : ""}`, // GET paginado (q, plan_id, role, is_active, page, per_page)
   createUser: () => `${API_BASE}/admin/users`,                      // POST → criar user
   updateUserPlan: (id) => `${API_BASE}/admin/users/${id}/plan`,     // PUT → atualizar plano
   updateUserStatus: (id) => `${API_BASE}/admin/users/${id}/status`, // PUT → atualizar role e is_active